@@ -559,6 +559,11 @@ class BlockSpectral(block_spectral_identity.BlockSpectralIdentity):
             else:
                 self._phase_1[x, y, z, 0, 0] = phase_1
 
+    def get_phase_maps(self):
+        """ Returns phase 0 and phase 1 for all voxels as [z,y,x] arrays,
+        i.e. in the same order as the voxel dimensions of self.data """
+        return self._phase_0[:,:,:,0,0].T, self._phase_1[:,:,:,0,0].T
+
 
     def get_frequency_shift(self, xyz):
         """ Returns frequency_shift for the voxel at the xyz tuple """
@@ -1,4 +1,5 @@
 # Python modules
+import collections
 
 # 3rd party modules
 import numpy as np
@@ -38,6 +39,13 @@ class ChainSpectral(Chain):
         # processing functor - provides entry points for chain
         self.functor_all = funct_spectral_all.do_processing_all
 
+        # voxel -> HLSVD line fids and spectra, see funct_spectral_all
+        self.svd_cache = collections.OrderedDict()
+
+        # supplies HLSVD fits done ahead of time in the background, or None,
+        # see util_prefetch.VoxelPrefetcher
+        self.svd_prefetch = None
+
         self.reset_results_arrays()
 
 
@@ -49,6 +57,7 @@ class ChainSpectral(Chain):
 
         """
         spectral_dim0 = self._dataset.spectral_dims[0]
+        self.svd_cache.clear()
         if len(self.data) != spectral_dim0:
             self.pre_roll        = np.zeros(self.raw_dim0, complex)
             self.kodata          = np.zeros(self.raw_dim0, complex)
@@ -65,6 +74,19 @@ class ChainSpectral(Chain):
                         
 
 
+    def update_svd_selection(self, voxels):
+        """
+        Applies the HLSVD threshold and lipid exclusion settings to all the
+        given voxels at once and reprocesses, in one batched pass, those
+        whose line selection changed. Returns the list of changed voxels.
+
+        """
+        changed = funct_spectral_all.select_svd_lines_volume(self, voxels)
+        if changed:
+            funct_spectral_all.do_processing_volume(self, changed)
+        return changed
+
+
     def run(self, voxels, entry='all'):
         """
         Run is typically called every time a processing setting is changed
@@ -2,8 +2,9 @@
 Stack DICOM datasets into volumes. The contents of this module are imported
 into the package namespace.
 """
-import warnings, re
+import os, warnings, re, itertools
 from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 try:
     from collections import OrderedDict
@@ -25,6 +26,9 @@ with warnings.catch_warnings():
     warnings.simplefilter('ignore')
     from nibabel.nicom.dicomwrappers import wrapper_from_data
 
+# read_file was removed in pydicom 3.0
+_dcmread = getattr(pydicom, 'dcmread', None) or pydicom.read_file
+
 from .dcmmeta import DcmMetaExtension, NiftiWrapper
 from .utils import iteritems
 
@@ -370,7 +374,8 @@ class DicomOrdering(object):
 def _make_dummy(reference, meta, iop):
     '''Make a "dummy" NiftiWrapper (no valid pixel data).'''
     #Create the dummy data array filled with largest representable value
-    data = np.empty_like(reference.nii_img.get_data())
+    data = np.empty(reference.nii_img.shape,
+                    dtype=reference.nii_img.get_data_dtype())
     data[...] = np.iinfo(np.int16).max
 
     #Create the nifti image and set header data
@@ -415,14 +420,137 @@ default_close_keys = ('ImageOrientationPatient',)
 
 _pix_attrs = ('PixelData', 'FloatPixelData', 'DoubleFloatPixelData')
 
+_pix_tags = tuple(pydicom.tag.Tag(attr) for attr in _pix_attrs)
+
 
 def is_image(dcm):
     '''Test if the data set is an image'''
-    if any(hasattr(dcm, attr) for attr in _pix_attrs):
+    # Test membership rather than hasattr, so deferred pixel data is not read
+    if any(attr in dcm for attr in _pix_attrs):
         return True
     return False
 
 
+def _extract_header_meta(dcm, extractor):
+    '''Run the extractor with the pixel data elements temporarily removed
+    from the data set, so that deferred pixel data is not read just to be
+    ignored by the extractor.'''
+    hidden = [(tag, dcm._dict.pop(tag)) for tag in _pix_tags
+              if tag in dcm._dict]
+    try:
+        return extractor(dcm)
+    finally:
+        dcm._dict.update(hidden)
+
+
+def _parse_file(dcm_path, extractor, force, defer_size):
+    '''Read a single DICOM file and extract its meta data. Used by
+    `parse_and_group`, possibly in a worker thread or process.
+
+    Returns a tuple (dcm, meta, error). Read errors are returned instead of
+    raised, so the caller can decide to warn or raise. For non-image data sets
+    meta is None.
+    '''
+    try:
+        dcm = _dcmread(dcm_path, force=force, defer_size=defer_size)
+    except Exception as e:
+        return None, None, e
+
+    if not is_image(dcm):
+        return dcm, None, None
+
+    if defer_size is None:
+        meta = extractor(dcm)
+    else:
+        meta = _extract_header_meta(dcm, extractor)
+    return dcm, meta, None
+
+
+class _CloseKeyIndex(object):
+    '''Index of the values of the "close" keys for the sub results of one
+    equality key in `parse_and_group`.
+
+    Values are quantized into buckets of size `4*atol`, and each sub result is
+    stored in the bucket of its canonical (first) value. A lookup only tests
+    the sub results in buckets that a match (within the `np.allclose`
+    tolerance) could fall into, rather than every sub result. Values that can
+    not be quantized (not numeric or not finite) are tested linearly, as are
+    lookups that would need to look in too many buckets.
+    '''
+
+    max_buckets = 256
+
+    def __init__(self, atol=5e-5, rtol=1e-5):
+        self.atol = atol
+        self.rtol = rtol
+        self.quantum = 4 * atol
+        self.values = []
+        self._flat = []
+        self._buckets = {}
+        self._linear = []
+
+    def _flatten(self, close_list):
+        try:
+            vals = [np.asarray(val, dtype=np.float64) for val in close_list]
+        except (TypeError, ValueError):
+            return None, None
+        shapes = tuple(val.shape for val in vals)
+        if vals:
+            flat = np.concatenate([val.ravel() for val in vals])
+        else:
+            flat = np.zeros(0)
+        if not np.all(np.isfinite(flat)):
+            return None, None
+        return shapes, flat
+
+    def _matches(self, idx, close_list, shapes, flat):
+        c_shapes, c_flat = self._flat[idx]
+        if shapes is not None and shapes == c_shapes:
+            # same test as np.allclose, on all values at once
+            return bool(np.all(np.abs(c_flat - flat) <=
+                               self.atol + self.rtol * np.abs(flat)))
+        for c_val, val in zip(self.values[idx], close_list):
+            if not np.allclose(c_val, val, atol=self.atol, rtol=self.rtol):
+                return False
+        return True
+
+    def find(self, close_list):
+        '''Return the index of the first sub result that matches
+        `close_list`, or None'''
+        shapes, flat = self._flatten(close_list)
+        candidates = set(self._linear)
+        if shapes is None:
+            candidates.update(range(len(self.values)))
+        else:
+            margin = self.atol + self.rtol * np.abs(flat)
+            lo = np.floor((flat - margin) / self.quantum).astype(np.int64)
+            hi = np.floor((flat + margin) / self.quantum).astype(np.int64)
+            if np.prod(hi - lo + 1) > self.max_buckets:
+                candidates.update(range(len(self.values)))
+            else:
+                ranges = [range(l, h + 1) for l, h in zip(lo, hi)]
+                for bucket in itertools.product(*ranges):
+                    candidates.update(self._buckets.get((shapes, bucket), ()))
+        for idx in sorted(candidates):
+            if self._matches(idx, close_list, shapes, flat):
+                return idx
+        return None
+
+    def add(self, close_list):
+        '''Add a new sub result with canonical value `close_list`, returns
+        its index'''
+        idx = len(self.values)
+        shapes, flat = self._flatten(close_list)
+        self.values.append(close_list)
+        self._flat.append((shapes, flat))
+        if shapes is None:
+            self._linear.append(idx)
+        else:
+            bucket = tuple(np.floor(flat / self.quantum).astype(np.int64))
+            self._buckets.setdefault((shapes, bucket), []).append(idx)
+        return idx
+
+
 class DicomStack(object):
     '''Defines a method for stacking together DICOM data sets into a multi
     dimensional volume.
@@ -602,7 +730,8 @@ class DicomStack(object):
         #Create a NiftiWrapper for this input if possible
         nii_wrp = None
         if not is_dummy:
-            nii_wrp = NiftiWrapper.from_dicom_wrapper(dw, meta)
+            nii_wrp = NiftiWrapper.from_dicom_wrapper(dw, meta,
+                                                      defer_data=True)
             if self._ref_input is None:
                 #We don't have a reference input yet, use this one
                 self._ref_input = nii_wrp
@@ -645,6 +774,8 @@ class DicomStack(object):
         self._meta_dirty = True
         self._meta = None
 
+        self._data = None
+
         self._files_info = []
 
     def _chk_order(self, slice_positions, files_per_vol, num_volumes,
@@ -701,6 +832,9 @@ class DicomStack(object):
         if not self._shape_dirty:
             return self._shape
 
+        #Any cached voxel data is stale once the files change or get resorted
+        self._data = None
+
         #We need at least one non-dummy file in the stack
         if len(self._files_info) == 0:
             raise InvalidStackError("No (non-dummy) files in the stack")
@@ -799,9 +933,24 @@ class DicomStack(object):
 
     shape = property(fget=get_shape)
 
-    def get_data(self):
+    def get_data(self, jobs=1, mmap_path=None):
         '''Get an array of the voxel values.
 
+        The array is assembled once and cached until files are added to, or
+        reordered in, the stack. The cached array is read-only, copy it if you
+        need to modify the values.
+
+        Parameters
+        ----------
+        jobs : int
+            Number of threads used to decode the pixel data of the files. One
+            (the default) decodes serially, None or zero uses one thread per
+            CPU.
+
+        mmap_path : str
+            If not None the array is a numpy memmap stored (in .npy format) at
+            this path, rather than in memory. Useful for large 4D/5D stacks.
+
         Returns
         -------
         A numpy array filled with values from the DICOM data sets' pixels.
@@ -811,9 +960,15 @@ class DicomStack(object):
         InvalidStackError
             The stack is incomplete or invalid.
         '''
+        out_shape = self.shape
+        if self._data is not None:
+            if (mmap_path is None or
+                os.path.abspath(mmap_path) == getattr(self._data, 'filename',
+                                                      None)):
+                return self._data
+
         #Create a numpy array for storing the voxel data
-        stack_shape = self.shape
-        stack_shape = tuple(list(stack_shape) + ((5 - len(stack_shape)) * [1]))
+        stack_shape = tuple(list(out_shape) + ((5 - len(out_shape)) * [1]))
         stack_dtype = self._files_info[0][0].nii_img.get_data_dtype()
         bits_stored = self._files_info[0][0].get_meta('BitsStored', default=16)
         # This is a hack to keep fslview happy, it does not like unsigned short
@@ -821,36 +976,62 @@ class DicomStack(object):
         # to signed short.        
         if stack_dtype == np.uint16 and bits_stored < 16:
             stack_dtype = np.int16
-        vox_array = np.empty(stack_shape, dtype=stack_dtype)
-
-        #Fill the array with data
-        n_vols = 1
-        if len(stack_shape) > 3:
-            n_vols *= stack_shape[3]
-        if len(stack_shape) > 4:
-            n_vols *= stack_shape[4]
+        if mmap_path is None:
+            out_array = np.empty(out_shape, dtype=stack_dtype)
+        else:
+            out_array = np.lib.format.open_memmap(os.path.abspath(mmap_path),
+                                                  mode='w+',
+                                                  dtype=stack_dtype,
+                                                  shape=out_shape)
+        vox_array = out_array.reshape(stack_shape)
+
+        #Work out where each file goes in the array
+        n_vols = stack_shape[3] * stack_shape[4]
         files_per_vol = len(self._files_info) // n_vols
         file_shape = self._files_info[0][0].nii_img.shape
+        targets = []
         for vec_idx in range(stack_shape[4]):
             for time_idx in range(stack_shape[3]):
                 if files_per_vol == 1 and file_shape[2] != 1:
                     file_idx = vec_idx*(stack_shape[3]) + time_idx
-                    vox_array[:, :, :, time_idx, vec_idx] = \
-                        self._files_info[file_idx][0].nii_img.get_data()
+                    targets.append((file_idx,
+                                    (Ellipsis, time_idx, vec_idx),
+                                    False))
                 else:
                     for slice_idx in range(files_per_vol):
                         file_idx = (vec_idx*(stack_shape[3]*stack_shape[2]) +
                                     time_idx*(stack_shape[2]) + slice_idx)
-                        vox_array[:, :, slice_idx, time_idx, vec_idx] = \
-                            self._files_info[file_idx][0].nii_img.get_data()[:, :, 0]
+                        targets.append((file_idx,
+                                        (slice(None), slice(None),
+                                         slice_idx, time_idx, vec_idx),
+                                        True))
+
+        #Fill the array with data, each file writes to its own region so the
+        #files can be decoded concurrently
+        def fill(target):
+            file_idx, region, is_slice = target
+            file_data = self._files_info[file_idx][0].nii_img.dataobj
+            file_data = np.asanyarray(file_data)
+            if is_slice:
+                file_data = file_data[:, :, 0]
+            vox_array[region] = file_data
+
+        if jobs is None or jobs < 1:
+            jobs = os.cpu_count() or 1
+        if jobs == 1 or len(targets) < 2:
+            for target in targets:
+                fill(target)
+        else:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                for _ in executor.map(fill, targets):
+                    pass
 
-        #Trim unused time/vector dimensions
-        if stack_shape[4] == 1:
-            vox_array = vox_array[...,0]
-            if stack_shape[3] == 1:
-                vox_array = vox_array[...,0]
+        if mmap_path is not None:
+            out_array.flush()
 
-        return vox_array
+        out_array.flags.writeable = False
+        self._data = out_array
+        return out_array
 
     data = property(fget=get_data)
 
@@ -892,7 +1073,7 @@ class DicomStack(object):
 
     affine = property(fget=get_affine)
 
-    def to_nifti(self, voxel_order='LAS', embed_meta=False):
+    def to_nifti(self, voxel_order='LAS', embed_meta=False, jobs=1):
         '''Returns a NiftiImage with the data and affine from the stack.
 
         Parameters
@@ -906,12 +1087,15 @@ class DicomStack(object):
             If true a dcmmeta.DcmMetaExtension will be embedded in the Nifti
             header.
 
+        jobs : int
+            Number of threads used to decode the pixel data, see `get_data`.
+
         Returns
         -------
         A nibabel.nifti1.Nifti1Image created with the stack's data and affine.
         '''
         #Get the voxel data and affine
-        data = self.get_data()
+        data = self.get_data(jobs)
         affine = self.affine
 
         #Figure out the number of three (or two) dimensional volumes
@@ -1063,7 +1247,8 @@ class DicomStack(object):
 
 def parse_and_group(src_paths, group_by=default_group_keys, extractor=None,
                     force=False, warn_on_except=False,
-                    close_tests=default_close_keys):
+                    close_tests=default_close_keys, jobs=1, pool='thread',
+                    defer_size=None):
     '''Parse the given dicom files and group them together. Each group is
     stored as a (list) value in a dict where the key is a tuple of values
     corresponding to the keys in 'group_by'
@@ -1093,6 +1278,21 @@ def parse_and_group(src_paths, group_by=default_group_keys, extractor=None,
         Any `group_by` key listed here is tested with `numpy.allclose` instead
         of straight equality when determining group membership.
 
+    jobs : int
+        Number of workers used to read and parse the files. One (the default)
+        parses serially, None or zero uses one worker per CPU. Results are the
+        same, and in the same order, regardless of the number of workers.
+
+    pool : str
+        Either 'thread' or 'process', the kind of worker pool used when `jobs`
+        is not one. With 'process' the `extractor` must be picklable.
+
+    defer_size : int, str or None
+        Passed to pydicom when reading. Elements larger than this (typically
+        the pixel data) are not read until they are accessed, e.g. when the
+        data set is stacked, so grouping only reads the headers. The source
+        files need to remain in place until then.
+
     Returns
     -------
     groups : dict
@@ -1104,54 +1304,74 @@ def parse_and_group(src_paths, group_by=default_group_keys, extractor=None,
         from .extract import default_extractor
         extractor = default_extractor
 
-    results = {}
-    close_elems = {}
-    for dcm_path in src_paths:
-        #Read the DICOM file
-        try:
-            dcm = pydicom.read_file(dcm_path, force=force)
-        except Exception as e:
-            if warn_on_except:
-                warnings.warn('Error reading file %s: %s' % (dcm_path, str(e)))
-                continue
-            else:
-                raise
+    if pool not in ('thread', 'process'):
+        raise ValueError("pool must be 'thread' or 'process'")
+    if not jobs:
+        jobs = os.cpu_count() or 1
+
+    src_paths = list(src_paths)
+    n_paths = len(src_paths)
+    if jobs == 1 or n_paths < 2:
+        parsed = map(_parse_file, src_paths,
+                     itertools.repeat(extractor, n_paths),
+                     itertools.repeat(force, n_paths),
+                     itertools.repeat(defer_size, n_paths))
+        executor = None
+    else:
+        executor_class = ThreadPoolExecutor if pool == 'thread' else ProcessPoolExecutor
+        executor = executor_class(max_workers=jobs)
+        parsed = executor.map(_parse_file, src_paths,
+                              itertools.repeat(extractor, n_paths),
+                              itertools.repeat(force, n_paths),
+                              itertools.repeat(defer_size, n_paths),
+                              chunksize=1 if pool == 'thread' else 16)
 
-        # Warn and skip non-image data sets
-        if not is_image(dcm):
-            warnings.warn("Skipping non-image data set: %s" % dcm_path)
-            continue
+    results = {}
+    close_index = {}
+    try:
+        for dcm_path, (dcm, meta, error) in zip(src_paths, parsed):
+            #Check the DICOM file was read
+            if error is not None:
+                if warn_on_except:
+                    warnings.warn('Error reading file %s: %s' % (dcm_path, str(error)))
+                    continue
+                else:
+                    raise error
 
-        #Extract the meta data and group
-        meta = extractor(dcm)
-        key_list = [] # Values from group_by elems with equality testing
-        close_list = [] # Values from group_by elems with np.allclose testing
-        for grp_key in group_by:
-            key_elem = meta.get(grp_key)
-            if isinstance(key_elem, list) or isinstance(key_elem, pydicom.multival.MultiValue):
-                key_elem = tuple(key_elem)
-            if grp_key in close_tests:
-                close_list.append(key_elem)
-            else:
-                key_list.append(key_elem)
+            # Warn and skip non-image data sets
+            if meta is None:
+                warnings.warn("Skipping non-image data set: %s" % dcm_path)
+                continue
 
-        # Initially each key has multiple sub_results (corresponding to
-        # different values of the "close" keys)
-        key = tuple(key_list)
-        if not key in results:
-            results[key] = [(close_list, [(dcm, meta, dcm_path)])]
-        else:
-            # Look for a matching sub_result
-            for c_list, sub_res in results[key]:
-                for c_idx, c_val in enumerate(c_list):
-                    if not np.allclose(c_val, close_list[c_idx], atol=5e-5):
-                        break
+            #Group on the extracted meta data
+            key_list = [] # Values from group_by elems with equality testing
+            close_list = [] # Values from group_by elems with np.allclose testing
+            for grp_key in group_by:
+                key_elem = meta.get(grp_key)
+                if isinstance(key_elem, list) or isinstance(key_elem, pydicom.multival.MultiValue):
+                    key_elem = tuple(key_elem)
+                if grp_key in close_tests:
+                    close_list.append(key_elem)
                 else:
-                    sub_res.append((dcm, meta, dcm_path))
-                    break
-            else:
+                    key_list.append(key_elem)
+
+            # Initially each key has multiple sub_results (corresponding to
+            # different values of the "close" keys), the index finds the
+            # first sub_result that matches without testing all of them
+            key = tuple(key_list)
+            if not key in results:
+                results[key] = []
+                close_index[key] = _CloseKeyIndex()
+            idx = close_index[key].find(close_list)
+            if idx is None:
                 # No match found, append another sub result
+                close_index[key].add(close_list)
                 results[key].append((close_list, [(dcm, meta, dcm_path)]))
+            else:
+                results[key][idx][1].append((dcm, meta, dcm_path))
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
 
     # Unpack sub results, using the canonical value for the close keys
     full_results = {}
@@ -1188,7 +1408,8 @@ def stack_group(group, warn_on_except=False, **stack_args):
 
 
 def parse_and_stack(src_paths, group_by=default_group_keys, extractor=None,
-                    force=False, warn_on_except=False, **stack_args):
+                    force=False, warn_on_except=False, jobs=1, pool='thread',
+                    defer_size=None, **stack_args):
     '''Parse the given dicom files into a dictionary containing one or more
     DicomStack objects.
 
@@ -1213,6 +1434,9 @@ def parse_and_stack(src_paths, group_by=default_group_keys, extractor=None,
         Convert exceptions into warnings, possibly allowing some results to be
         returned.
 
+    jobs, pool, defer_size :
+        Passed to `parse_and_group`.
+
     stack_args : kwargs
         Keyword arguments to pass to the DicomStack constructor.
     '''
@@ -1220,7 +1444,10 @@ def parse_and_stack(src_paths, group_by=default_group_keys, extractor=None,
                               group_by,
                               extractor,
                               force,
-                              warn_on_except)
+                              warn_on_except,
+                              jobs=jobs,
+                              pool=pool,
+                              defer_size=defer_size)
 
     for key, group in iteritems(results):
         results[key] = stack_group(group, warn_on_except, **stack_args)
@@ -5,8 +5,9 @@ Command line interface to dcmstack.
 """
 
 
-import os, sys, argparse, string
+import os, sys, csv, argparse, string
 from glob import glob
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 try:
     import pydicom
@@ -29,6 +30,13 @@ volumes, optionally extracting meta data.
 prog_epilog = """IT IS YOUR RESPONSIBILITY TO KNOW IF THERE IS PRIVATE HEALTH
 INFORMATION IN THE METADATA EXTRACTED BY THIS PROGRAM."""
 
+#Elements larger than this many bytes are read when first used, not when the
+#files are parsed and grouped. Kept below the size of any pixel data, so that
+#is read when a group is stacked, or never with --dry-run. The pixel data
+#element is still present, so is_image() works. Encapsulated (compressed) pixel
+#data has no defined length and is always read.
+DEFER_SIZE = 256
+
 def parse_tags(opt_str):
     tag_strs = opt_str.split(',')
     tags = []
@@ -50,6 +58,46 @@ def sanitize_path_comp(path_comp):
             result.append(char)
     return ''.join(result)
 
+def write_stack(stack, out_path, voxel_order, embed_meta, dump_meta, jobs=1):
+    '''Write the stack to out_path, and its meta data to a JSON file with
+    the same base name if dump_meta is True.'''
+    nii = stack.to_nifti(voxel_order, embed_meta or dump_meta, jobs)
+
+    if dump_meta:
+        nii_wrp = NiftiWrapper(nii)
+        path_tokens = out_path.split('.')
+        if path_tokens[-1] == 'gz':
+            path_tokens = path_tokens[:-1]
+        if path_tokens[-1] == 'nii':
+            path_tokens = path_tokens[:-1]
+        meta_path = '.'.join(path_tokens + ['json'])
+        out_file = open(meta_path, 'w')
+        out_file.write(nii_wrp.meta_ext.to_json())
+        out_file.close()
+
+        if not embed_meta:
+            nii_wrp.remove_extension()
+
+        del nii_wrp
+
+    nii.to_filename(out_path)
+
+def convert_group(group, out_path, stack_args, write_args, warn_on_except,
+                  jobs=1):
+    '''Stack one group of DICOM files and write it to out_path.'''
+    stack = stack_group(group, warn_on_except=warn_on_except, **stack_args)
+    write_stack(stack, out_path, jobs=jobs, **write_args)
+    return out_path
+
+def write_group_table(out_file, group_by, outputs):
+    '''Write a tab separated table with a row for each group: the output
+    path, the number of files, the first file and the group_by values.'''
+    writer = csv.writer(out_file, delimiter='\t', lineterminator='\n')
+    writer.writerow(['output', 'n_files', 'first_file'] + list(group_by))
+    for key, group, out_path in outputs:
+        writer.writerow([out_path, len(group), group[0][2]] +
+                        ['' if val is None else val for val in key])
+
 def main(argv=sys.argv):
     #Handle command line options
     arg_parser = argparse.ArgumentParser(description=prog_descrip,
@@ -155,6 +203,15 @@ def main(argv=sys.argv):
     gen_opt.add_argument('--strict', default=False, action='store_true',
                          help=('Fail on the first exception instead of '
                          'showing a warning.'))
+    gen_opt.add_argument('-j', '--jobs', default=1, type=int,
+                         help=('Number of files parsed, and groups stacked '
+                         'and written, at the same time. Zero uses one job '
+                         'per CPU. Default: %(default)s'))
+    gen_opt.add_argument('--dry-run', default=False, action='store_true',
+                         help=('Only parse and group the files, and print a '
+                         'tab separated table of the groups and their output '
+                         'paths instead of writing them. Uncompressed pixel '
+                         'data is not read.'))
     gen_opt.add_argument('--version', default=False, action='store_true',
                          help=('Show the version and exit.'))
 
@@ -249,6 +306,20 @@ def main(argv=sys.argv):
     if len(args.src_dirs) == 0:
         arg_parser.error('No source directories were provided.')
 
+    if args.jobs < 0:
+        arg_parser.error('The number of jobs can not be negative.')
+    jobs = args.jobs or os.cpu_count() or 1
+
+    stack_args = {'time_order' : time_order,
+                  'vector_order' : vector_order,
+                  'allow_dummies' : args.allow_dummies,
+                  'meta_filter' : meta_filter,
+                 }
+    write_args = {'voxel_order' : args.voxel_order,
+                  'embed_meta' : args.embed_meta,
+                  'dump_meta' : args.dump_meta,
+                 }
+
     #Handle group-by option
     if not args.group_by is None:
         group_by = args.group_by.split(',')
@@ -272,12 +343,14 @@ def main(argv=sys.argv):
         if args.verbose:
             print("Found %d source files in the directory" % len(src_paths))
 
-        #Group the files in this directory
+        #Group the files in this directory, the pixel data is not read yet
         groups = parse_and_group(src_paths,
                                  group_by,
                                  extractor,
                                  args.force_read,
                                  not args.strict,
+                                 jobs=jobs,
+                                 defer_size=DEFER_SIZE,
                                 )
 
         if args.verbose:
@@ -286,15 +359,11 @@ def main(argv=sys.argv):
         if len(groups) == 0:
             print("No DICOM files found in %s" % src_dir)
 
-        out_idx = 0
+        #Work out all the output paths first, so they do not depend on the
+        #order the groups are written in
+        outputs = []
         generated_outs = set()
-        for key, group in iteritems(groups):
-            stack = stack_group(group,
-                                warn_on_except=not args.strict,
-                                time_order=time_order,
-                                vector_order=vector_order,
-                                allow_dummies=args.allow_dummies,
-                                meta_filter=meta_filter)
+        for out_idx, (key, group) in enumerate(iteritems(groups)):
             meta = group[0][1]
 
             #Build an appropriate output format string if none was specified
@@ -318,7 +387,6 @@ def main(argv=sys.argv):
             if out_fn in generated_outs:
                 out_fn += '-%03d' % out_idx
             generated_outs.add(out_fn)
-            out_idx += 1
             out_fn = out_fn + args.output_ext
 
             if args.dest_dir:
@@ -326,37 +394,44 @@ def main(argv=sys.argv):
             else:
                 out_path = os.path.join(src_dir, out_fn)
 
-            if args.verbose:
-                print("Writing out stack to path %s" % out_path)
-
-            nii = stack.to_nifti(args.voxel_order, gen_meta)
-
-            if args.dump_meta:
-                nii_wrp = NiftiWrapper(nii)
-                path_tokens = out_path.split('.')
-                if path_tokens[-1] == 'gz':
-                    path_tokens = path_tokens[:-1]
-                if path_tokens[-1] == 'nii':
-                    path_tokens = path_tokens[:-1]
-                meta_path = '.'.join(path_tokens + ['json'])
-                out_file = open(meta_path, 'w')
-                out_file.write(nii_wrp.meta_ext.to_json())
-                out_file.close()
-
-                if not args.embed_meta:
-                    nii_wrp.remove_extension()
-
-                del nii_wrp
-
-            nii.to_filename(out_path)
-
-            del key
-            del group
-            del stack
-            del meta
-            del nii
+            outputs.append((key, group, out_path))
         del groups
 
+        if args.dry_run:
+            write_group_table(sys.stdout, group_by, outputs)
+            continue
+
+        if jobs == 1 or len(outputs) < 2:
+            #One group at a time, its pixel data can still be read by jobs
+            #threads
+            while outputs:
+                key, group, out_path = outputs.pop(0)
+                if args.verbose:
+                    print("Writing out stack to path %s" % out_path)
+                convert_group(group, out_path, stack_args, write_args,
+                              not args.strict, jobs)
+                del key
+                del group
+        else:
+            #Independent groups are stacked and written concurrently, reading
+            #and compressing the data mostly releases the GIL
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                futures = [executor.submit(convert_group, group, out_path,
+                                           stack_args, write_args,
+                                           not args.strict)
+                           for key, group, out_path in outputs]
+                n_outputs = len(outputs)
+                del outputs
+                try:
+                    for n_done, future in enumerate(as_completed(futures), 1):
+                        out_path = future.result()
+                        if args.verbose:
+                            print("[%d/%d] Wrote out stack to path %s" %
+                                  (n_done, n_outputs, out_path))
+                except BaseException:
+                    executor.shutdown(cancel_futures=True)
+                    raise
+
     return 0
 
 if __name__ == '__main__':
@@ -1,8 +1,11 @@
 """
 Extract meta data from a DICOM data set.
 """
+import re
 import struct
+import hashlib
 import warnings
+import threading
 from collections import namedtuple, defaultdict
 
 try:
@@ -190,6 +193,38 @@ def _parse_phoenix_line(line, str_delim='""'):
 
     raise PhoenixParseError(line)
 
+#Values the common protocol lines hold, in the order _parse_phoenix_line tries
+#them. int() and float() accept a few more forms, those lines take the slow path.
+_phoenix_int_re = re.compile(r'[+-]?[0-9]+\Z')
+_phoenix_hex_re = re.compile(r'[+-]?(?:0[xX])?[0-9a-fA-F]+\Z')
+_phoenix_float_re = re.compile(r'[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?\Z')
+
+def _parse_phoenix_lines(lines, str_delim='""'):
+    '''Parse the ASCCONV lines into an OrderedDict in one pass. Gives the
+    same result as calling `_parse_phoenix_line` on each line, but handles
+    the common 'key = number' lines inline, leaving comments, string literals
+    and anything unusual to `_parse_phoenix_line`.
+    '''
+    result = OrderedDict()
+    for line in lines:
+        key, sep, val_str = line.partition('=')
+        val_str = val_str.strip()
+        if (sep and not '#' in line and val_str and
+            not val_str.startswith(str_delim)):
+            if _phoenix_int_re.match(val_str):
+                result[key.strip()] = int(val_str)
+                continue
+            elif _phoenix_hex_re.match(val_str):
+                result[key.strip()] = int(val_str, 16)
+                continue
+            elif _phoenix_float_re.match(val_str):
+                result[key.strip()] = float(val_str)
+                continue
+        parse_result = _parse_phoenix_line(line, str_delim)
+        if parse_result:
+            result[parse_result[0]] = parse_result[1]
+    return result
+
 def parse_phoenix_prot(prot_key, prot_val):
     '''Parse the MrPheonixProtocol string.
 
@@ -217,13 +252,7 @@ def parse_phoenix_prot(prot_key, prot_val):
     ascconv_end = prot_val.find('### ASCCONV END ###')
     ascconv = prot_val[ascconv_start:ascconv_end].split('\n')[1:-1]
 
-    result = OrderedDict()
-    for line in ascconv:
-        parse_result = _parse_phoenix_line(line, str_delim)
-        if parse_result:
-            result[parse_result[0]] = parse_result[1]
-
-    return result
+    return _parse_phoenix_lines(ascconv, str_delim)
 
 def csa_series_trans_func(elem):
     '''Function for parsing the CSA series sub header.'''
@@ -334,6 +363,9 @@ default_conversions = {'DS' : float,
                        'UI' : unicode_str,
                       }
 
+TRANS_CACHE_SIZE = 32
+'''Default number of translator results a `MetaExtractor` keeps.'''
+
 class MetaExtractor(object):
     '''Callable object for extracting meta data from a dicom dataset.
     Initialize with a set of ignore rules, translators, and type
@@ -357,10 +389,16 @@ class MetaExtractor(object):
 
     warn_on_trans_except : bool
         Convert any exceptions from translators into warnings.
+
+    trans_cache_size : int
+        Number of translator results to keep, keyed on the translator and a
+        hash of the element bytes. The files of a series mostly share the
+        same CSA series header, which is then only parsed once. Set to 0 if
+        a translator depends on more than the element value.
     '''
 
     def __init__(self, ignore_rules=None, translators=None, conversions=None,
-                 warn_on_trans_except=True):
+                 warn_on_trans_except=True, trans_cache_size=TRANS_CACHE_SIZE):
         if ignore_rules is None:
             self.ignore_rules = default_ignore_rules
         else:
@@ -374,6 +412,37 @@ class MetaExtractor(object):
         else:
             self.conversions = conversions
         self.warn_on_trans_except = warn_on_trans_except
+        self.trans_cache_size = trans_cache_size
+        self._trans_cache = OrderedDict()
+        #The extractor is shared by the worker threads of parse_and_group
+        self._trans_cache_lock = threading.Lock()
+
+    def _translate(self, translator, elem):
+        '''Run the translator on the element, reusing the result for an
+        element with the same bytes.'''
+        value = elem.value
+        if self.trans_cache_size <= 0 or not isinstance(value, bytes):
+            return translator.trans_func(elem)
+
+        key = (translator, hashlib.sha1(value).digest())
+        with self._trans_cache_lock:
+            meta = self._trans_cache.get(key)
+            if meta is not None:
+                self._trans_cache.move_to_end(key)
+        if meta is None:
+            #Translate outside the lock, two threads may both translate the
+            #same header the first time, which is harmless
+            meta = translator.trans_func(elem)
+            with self._trans_cache_lock:
+                self._trans_cache[key] = meta
+                while len(self._trans_cache) > self.trans_cache_size:
+                    self._trans_cache.popitem(last=False)
+
+        #Callers may modify the result, don't hand out the cached one
+        if meta:
+            meta = OrderedDict((name, val[:] if isinstance(val, list) else val)
+                               for name, val in meta.items())
+        return meta
 
     def _get_elem_key(self, elem):
         '''Get the key for any non-translated elements.'''
@@ -415,6 +484,10 @@ class MetaExtractor(object):
             else:
                 value = elem.value
 
+        #Newer pydicom gives empty elements a value of None
+        if value is None:
+            return None
+
         #Handle any conversions
         if elem.VR in self.conversions:
             if n_vals == 1:
@@ -477,7 +550,7 @@ class MetaExtractor(object):
             #If there is a translator for this element, use it
             if elem.tag in trans_map:
                 try:
-                    meta = trans_map[elem.tag].trans_func(elem)
+                    meta = self._translate(trans_map[elem.tag], elem)
                 except Exception as e:
                     if self.warn_on_trans_except:
                         warnings.warn("Exception from translator %s: %s" %
@@ -0,0 +1,172 @@
+"""
+DecimatedLine2D is a matplotlib Line2D that draws a per-pixel min/max
+envelope of its data rather than every data point.
+
+Spectral plots often hold many long lines (e.g. 20 HLSVD lines plus data and
+residual at 8-16k zero-filled points each) in an axes that is only several
+hundred pixels wide. Drawing every point costs time in proportion to the data
+length while adding nothing that can be seen. Here, at draw time, the points
+within the current x-axis limits are split into one bin per pixel column and
+only the min and max of each bin are drawn. Peaks and noise envelopes look the
+same as the full resolution line, but the draw cost tracks the window width.
+
+The envelope is cached on the axes x-limits and pixel width, so it is only
+recalculated when the data changes or the plot is zoomed or resized. A zoom
+in ZoomSpan or ZoomBox (release) sets new x-limits and redraws the canvas,
+which refines the envelope to the new range automatically.
+
+The full resolution data is kept as the line data, so get_xdata(),
+get_ydata() and everything that relies on them (cursor values, area
+calculations) are not affected by the decimation.
+
+"""
+
+# Python modules
+
+
+# 3rd party modules
+import numpy as np
+from matplotlib.lines import Line2D
+
+
+# Our modules
+
+
+
+# Lines with less than this many visible points per pixel column are drawn
+# at full resolution (only the visible part of the line is drawn).
+LOD_POINTS_PER_PIXEL = 4
+
+
+
+class DecimatedLine2D(Line2D):
+    """
+    Line2D that renders a min/max envelope with one bin per pixel column for
+    the visible x range. Lines with markers, non-default draw styles or an x
+    axis that is not monotonic are drawn as a normal Line2D.
+
+    """
+    def __init__(self, *args, **kwargs):
+        Line2D.__init__(self, *args, **kwargs)
+        self._lod_key   = None
+        self._lod_order = None
+        self._lod_data  = None
+        self._lod_proxy = None
+        self._lod_proxy_data = None
+
+
+    def set_xdata(self, x):
+        Line2D.set_xdata(self, x)
+        self._lod_key   = None
+        self._lod_order = None
+
+
+    def set_ydata(self, y):
+        Line2D.set_ydata(self, y)
+        self._lod_key = None
+
+
+    def draw(self, renderer):
+        if not self.get_visible():
+            return
+
+        lod = self._get_lod_data()
+        if lod is None:
+            Line2D.draw(self, renderer)
+            return
+
+        # the envelope is drawn through a proxy line that copies our
+        # properties (color, width, style, transform, clipping)
+        if self._lod_proxy is None:
+            self._lod_proxy = Line2D([], [])
+        proxy = self._lod_proxy
+        proxy.update_from(self)
+        if self._lod_proxy_data is not lod:
+            proxy.set_data(lod[0], lod[1])
+            self._lod_proxy_data = lod
+        proxy.draw(renderer)
+        self.stale = False
+
+
+    def _get_order(self, x):
+        """ 1 for ascending, -1 for descending, 0 if x is not monotonic """
+        if self._lod_order is None:
+            dx = np.diff(x)
+            if np.all(dx >= 0):
+                self._lod_order = 1
+            elif np.all(dx <= 0):
+                self._lod_order = -1
+            else:
+                self._lod_order = 0
+        return self._lod_order
+
+
+    def _get_lod_data(self):
+        """
+        Returns (x, y) arrays of what should be drawn for the current x-axis
+        limits and axes width, or None if the full line should be drawn.
+
+        """
+        axes = self.axes
+        if axes is None:
+            return None
+        if self.get_marker() not in (None, '', ' ', 'None', 'none'):
+            return None
+        if self.get_drawstyle() != 'default':
+            return None
+
+        x = np.asarray(self.get_xdata())
+        y = np.asarray(self.get_ydata())
+        npts = len(x)
+        width = int(np.ceil(axes.bbox.width))
+
+        if width < 1 or npts < LOD_POINTS_PER_PIXEL * width or len(y) != npts:
+            return None
+
+        key = (tuple(axes.get_xlim()), width)
+        if key == self._lod_key:
+            return self._lod_data
+
+        order = self._get_order(x)
+        if order == 0:
+            return None
+
+        # index range of points inside the x limits, plus one point on either
+        # side so the line runs all the way to the edges of the axes
+        xlo, xhi = sorted(axes.get_xlim())
+        if order > 0:
+            i0 = np.searchsorted(x, xlo, 'left')
+            i1 = np.searchsorted(x, xhi, 'right')
+        else:
+            xr = x[::-1]
+            i0 = npts - np.searchsorted(xr, xhi, 'right')
+            i1 = npts - np.searchsorted(xr, xlo, 'left')
+        i0 = max(i0-1, 0)
+        i1 = min(i1+1, npts)
+        count = i1 - i0
+
+        if count < LOD_POINTS_PER_PIXEL * width:
+            xd = x[i0:i1]
+            yd = y[i0:i1]
+        else:
+            # one bin per pixel column, in each bin draw from min to max if
+            # the data rises across the bin, else from max to min, so that
+            # adjacent bins connect the way the full line would
+            edges = i0 + (np.arange(width) * count) // width
+            seg   = y[i0:i1]
+            ymin  = np.minimum.reduceat(seg, edges - i0)
+            ymax  = np.maximum.reduceat(seg, edges - i0)
+            rising = y[np.append(edges[1:], i1) - 1] >= y[edges]
+
+            xd = np.empty(2*width+1, dtype=float)
+            yd = np.empty(2*width+1, dtype=float)
+            xd[0:-1:2] = x[edges]
+            xd[1:-1:2] = x[edges]
+            yd[0:-1:2] = np.where(rising, ymin, ymax)
+            yd[1:-1:2] = np.where(rising, ymax, ymin)
+            xd[-1] = x[i1-1]
+            yd[-1] = y[i1-1]
+
+        self._lod_key  = key
+        self._lod_data = (xd, yd)
+        return self._lod_data
@@ -13,6 +13,13 @@ import ice_view.common.funct_water_filter as funct_water
 import ice_view.common.hlsvdpropy as hlsvdpro
 
 
+# size in bytes of the HLSVD line fids and spectra kept in the chain's
+# svd_cache, see _get_svd_lines(). At least the current voxel is kept.
+SVD_CACHE_BYTES = 32 * 1024 * 1024
+
+# number of voxels processed at a time in do_processing_volume()
+VOLUME_CHUNK_VOXELS = 64
+
 
 
 def apodization(chain):
@@ -79,6 +86,112 @@ def left_shift(chain):
     chain.data[-set.left_shift_value:] = chain.data[0]*0.0
 
 
+def fit_svd(signals, nsv_sought, dwell_time):
+    """
+    Runs HLSVD on the signals and returns the lines found as an SvdOutput.
+    Has no side effects, so it can also be run for other voxels in a
+    background thread, see util_prefetch.
+
+    """
+    results = hlsvdpro.hlsvd(signals, nsv_sought, dwell_time)
+
+    nsv_found = results[0]
+
+    # The second element of the return tuple is a list of singular
+    # values that we don't care about. We don't care about any trailing
+    # return values either
+    frequencies, damping_factors, amplitudes, phases = results[2:6]
+
+    if nsv_found:
+        # hlsvd() returns lists; we want numpy arrays.
+        frequencies     = np.array(frequencies)
+        damping_factors = np.array(damping_factors)
+        amplitudes      = np.array(amplitudes)
+        phases          = np.array(phases)
+    else:
+        # When the HLSVD module finds nothing (due to bugs,
+        # algorithmic weakness, sun spots, etc.), we dummy up fake
+        # results that are all 0.0 to make downstream code happy.
+        nsv_found = nsv_sought
+        frequencies     = np.zeros(nsv_sought)
+        damping_factors = np.zeros(nsv_sought)
+        amplitudes      = np.zeros(nsv_sought)
+        phases          = np.zeros(nsv_sought)
+
+
+    svd_output = svd_output_module.SvdOutput(frequencies,
+                                             damping_factors,
+                                             amplitudes,
+                                             phases)
+
+    # PS - The code below writes the HLSVD input and output
+    # data to a file in your home folder. It's great for
+    # generating test data with which to exercise HLSVD outside
+    # of Vespa, but not useful otherwise.
+    # DON'T EVER COMMIT THIS FILE WITH THIS CODE ACTIVE!
+    # It will destroy performance and cause users to wail
+    # and gnash their teeth.
+    #
+    # import ice_view.common.xml_ as util_xml
+    # import os.path
+    #
+    # input_ = {"dwell_time" : dwell_time,
+    #           "nsv_sought" : nsv_sought,
+    #           "signals" : signals
+    #          }
+    #
+    # output = { "nsv_found" : results[0],
+    #            "singular_values" : results[1],
+    #            "frequencies" : results[2],
+    #            "damping_factors" : results[3],
+    #            "amplitudes" : results[4],
+    #            "phases" : results[5],
+    #          }
+    #
+    # d = {"input" : input_, "output" : output }
+    #
+    # filename = chain.dataset.dataset_filename
+    # if not filename:
+    #     # Construct a filename from the raw filename.
+    #     raw = chain.dataset.blocks["raw"]
+    #     filename = raw.data_source
+    #
+    # path, filename = os.path.split(filename)
+    # filename = os.path.splitext(filename)[0] + ".xml"
+    #
+    # home = os.path.expanduser("~")
+    # filename = os.path.join(home, filename)
+    #
+    # util_xml._dict_to_file(d, filename)
+
+    return svd_output
+
+
+def fit_svd_voxels(dataset, block, voxels):
+    """
+    Runs HLSVD for those of the voxels that need a fit (do_fit is set), from
+    the same inputs svd_filter() uses, and stores the fits in the block. Only
+    the fits and do_fit flags are changed. The chain uses these fits the next
+    time it processes the voxels.
+
+    """
+    source = dataset.get_source_data('spectral')
+    dwell_time = 1000.0 / dataset.sw
+
+    for voxel in voxels:
+        if not block.get_do_fit(voxel):
+            continue
+        x, y, z = voxel
+        data = source[0,0,z,y,x,:]
+        if not np.sum(data.real):
+            # svd_filter() does not fit voxels without data either
+            continue
+        signals    = data[:block.get_data_point_count(voxel)]
+        nsv_sought = block.get_signal_singular_value_count(voxel)
+        block.set_svd_output(fit_svd(signals, nsv_sought, dwell_time), voxel)
+        block.set_do_fit(False, voxel)
+
+
 def svd_filter(chain):
     set = chain._block.set
 
@@ -92,130 +205,45 @@ def svd_filter(chain):
         svd_data = chain.pre_roll.copy()
 
         if chain.do_fit:
-            # Recompute HLSVD lib simulation
+            # Recompute HLSVD lib simulation, unless it was already done in
+            # the background for this voxel and these inputs
 
             signals = chain.pre_roll[:chain.ndp]
 
-            results = hlsvdpro.hlsvd(signals, nsv_sought, dwell_time)
-
-            nsv_found = results[0]
-
-            # The second element of the return tuple is a list of singular
-            # values that we don't care about. We don't care about any trailing
-            # return values either
-            frequencies, damping_factors, amplitudes, phases = results[2:6]
+            svd_output = None
+            if chain.svd_prefetch is not None:
+                svd_output = chain.svd_prefetch.get(chain.voxel, signals,
+                                                    nsv_sought, dwell_time)
+            if svd_output is None:
+                svd_output = fit_svd(signals, nsv_sought, dwell_time)
 
-            if nsv_found:
-                # hlsvd() returns lists; we want numpy arrays.
-                frequencies     = np.array(frequencies)
-                damping_factors = np.array(damping_factors)
-                amplitudes      = np.array(amplitudes)
-                phases          = np.array(phases)
-            else:
-                # When the HLSVD module finds nothing (due to bugs,
-                # algorithmic weakness, sun spots, etc.), we dummy up fake
-                # results that are all 0.0 to make downstream code happy.
-                nsv_found = nsv_sought
-                frequencies     = np.zeros(nsv_sought)
-                damping_factors = np.zeros(nsv_sought)
-                amplitudes      = np.zeros(nsv_sought)
-                phases          = np.zeros(nsv_sought)
-
-
-            svd_output = svd_output_module.SvdOutput(frequencies,
-                                                     damping_factors,
-                                                     amplitudes,
-                                                     phases)
             chain.svd_output = svd_output
             chain.do_fit = False
 
-            # PS - The code below writes the HLSVD input and output
-            # data to a file in your home folder. It's great for
-            # generating test data with which to exercise HLSVD outside
-            # of Vespa, but not useful otherwise.
-            # DON'T EVER COMMIT THIS FILE WITH THIS CODE ACTIVE!
-            # It will destroy performance and cause users to wail
-            # and gnash their teeth.
-            #
-            # import ice_view.common.xml_ as util_xml
-            # import os.path
-            #
-            # input_ = {"dwell_time" : dwell_time,
-            #           "nsv_sought" : nsv_sought,
-            #           "signals" : signals
-            #          }
-            #
-            # output = { "nsv_found" : results[0],
-            #            "singular_values" : results[1],
-            #            "frequencies" : results[2],
-            #            "damping_factors" : results[3],
-            #            "amplitudes" : results[4],
-            #            "phases" : results[5],
-            #          }
-            #
-            # d = {"input" : input_, "output" : output }
-            #
-            # filename = chain.dataset.dataset_filename
-            # if not filename:
-            #     # Construct a filename from the raw filename.
-            #     raw = chain.dataset.blocks["raw"]
-            #     filename = raw.data_source
-            #
-            # path, filename = os.path.split(filename)
-            # filename = os.path.splitext(filename)[0] + ".xml"
-            #
-            # home = os.path.expanduser("~")
-            # filename = os.path.join(home, filename)
-            #
-            # util_xml._dict_to_file(d, filename)
-
-
-        # create the fids for each element in the HLSVD model
+
+        # create the fids for each element in the HLSVD model, and their
+        # processed spectra, or get both from the chain's cache
         #
         # Note. Here we do NOT deal with any frequency shifts that are applied
         # to the raw data. This is dealt with when the water filter itself is
         # applied. At that point the individual HLSVD fids can be sorted to
         # determine which is below the threshold, or not, or maybe has been
         # manually selected in the SVD Filter sub-tab.
-        svd_fids = _create_hlsvd_fids(chain.svd_output.frequencies,
-                                      chain.svd_output.damping_factors,
-                                      chain.svd_output.amplitudes,
-                                      chain.svd_output.phases,
-                                      chain._dataset.raw_dims[0],
-                                      len(chain.svd_output),
-                                      0.0,
-                                      dwell_time)
+        svd_fids, svd_peaks = _get_svd_lines(chain, dwell_time)
 
         chain.svd_fids_all = svd_fids             # previously chain.time_fids
 
 
-
         # CALCULATE AUTO SELECT for FIDs ---------------------------
         #
         #  Apply rules here so it is part of pipline not the GUI 
 
-        fshift = chain.svd_output.frequencies + (chain.frequency_shift / 1000.0)
-        ppms   = chain._dataset.resppm - (fshift * 1000.0 / chain._dataset.frequency)
-
         if set.svd_apply_threshold or set.svd_exclude_lipid:
-            chain.svd_output.in_model.fill(False)
-            
-        if set.svd_apply_threshold:
-            if set.svd_threshold_unit == 'Hz':
-                width = set.svd_threshold / 1000.0
-                for i,freq in enumerate(fshift):
-                    if freq <= width:
-                        chain.svd_output.in_model[i] = True
-            else:
-                width = set.svd_threshold 
-                for i,ppm in enumerate(ppms):
-                    if ppm >= width:
-                        chain.svd_output.in_model[i] = True
-                
-        if set.svd_exclude_lipid:
-            for i,ppm in enumerate(ppms):
-                if ppm >= set.svd_exclude_lipid_end and ppm <= set.svd_exclude_lipid_start:
-                    chain.svd_output.in_model[i] = True
+            chain.svd_output.in_model[:] = select_svd_lines(set,
+                                                            chain.svd_output.frequencies,
+                                                            chain.frequency_shift,
+                                                            chain._dataset.resppm,
+                                                            chain._dataset.frequency)
 
 
         # here we calculate and save svd_fids_checked
@@ -232,97 +260,344 @@ def svd_filter(chain):
 
         chain.svd_fids_checked = sum_fids              # previously sum_time_fids
 
+        if chain.frequency_shift != 0.0:
+            chain.svd_fids_checked = chain.svd_fids_checked * _frequency_shift_roll(chain)
 
-        # FREQUENCY_SHIFT --------------------
+        # the data goes through the same steps as the lines, see _process_svd_lines()
+        svd_data = _process_svd_lines(chain, svd_data[np.newaxis,:])[0]
 
-        if chain.frequency_shift != 0.0:
 
-            # seterr() avoids underflow error
-            old_err_state = np.seterr(all='ignore')
-            t = np.arange(chain._dataset.raw_dims[0]) / chain._dataset.sw
-            phroll = np.exp(1j * 2.0 * np.pi * chain.frequency_shift * t)
-            svd_fids = svd_fids * phroll
-            svd_data = svd_data * phroll 
-            chain.svd_fids_checked = chain.svd_fids_checked * phroll
-            np.seterr(**old_err_state)
+        # SAVE THINGS ----------------------------
 
-        # APODIZE ----------------------------
-        
-        if set.apodization:
+        chain.svd_data = svd_data.copy()      # previously chain.freq_svd
 
-            t = np.arange(chain._dataset.raw_dims[0]) / chain._dataset.sw
-            old_settings = np.seterr(all='ignore')  # avoid underflow warnings
-            if set.apodization == 'gaussian':
-                lineshape = safe_exp(-(set.apodization_width * np.pi * 0.6 * t) ** 2, 0)
-            elif set.apodization == 'lorentzian':
-                lineshape = safe_exp(-(set.apodization_width * np.pi * t), 0)
-            svd_fids = svd_fids * lineshape
-            svd_data = svd_data * lineshape
-            np.seterr(**old_settings)
+        if cnt > 0:
+            if cnt > 1:
+                svd_fids      = svd_peaks[in_model,:]
+                svd_peaks_sum = np.sum(svd_fids,axis=0)
+            else:
+                svd_fids      = svd_peaks[in_model[0],:]
+                svd_peaks_sum = svd_fids.copy()
+        else:
+            svd_fids      = np.zeros(chain.spectral_dim0, complex)
+            svd_peaks_sum = np.zeros(chain.spectral_dim0, complex)      # no terms on in the filter
 
-        # CHOP ------------------------------
+        if len(svd_fids.shape) <= 1:
+            svd_fids.shape = 1,svd_fids.shape[0]
 
-        if set.chop:
-            chop = ((((np.arange(chain._dataset.raw_dims[0]) + 1) % 2) * 2) - 1)
-            svd_fids = svd_fids * chop
-            svd_data = svd_data * chop
+        chain.svd_peaks_checked     = svd_fids.copy()       # previously chain.fids
+        chain.svd_peaks_checked_sum = svd_peaks_sum         # previously chain.sum_fids
 
-        # ZEROFILL ---------------------------
 
-        dim0 = chain._dataset.raw_dims[0] * set.zero_fill_multiplier
+def select_svd_lines(set, frequencies, frequency_shift, resppm, frequency):
+    """
+    Applies the HLSVD threshold and lipid exclusion rules in the settings.
+    Returns the 'in model' flags for the lines, True for lines to remove.
+
+    frequencies      - line frequencies in kHz, shape (..., nlines). Unused
+                       entries can be NaN, they are never selected.
+    frequency_shift  - in Hz, a scalar or shape (...), i.e. one per voxel
+
+    """
+    fshift = frequencies + (np.asarray(frequency_shift)[..., np.newaxis] / 1000.0)
+    ppms   = resppm - (fshift * 1000.0 / frequency)
+
+    in_model = np.zeros(fshift.shape, bool)
 
-        if len(svd_fids.shape) > 1:
-            svd_fids[:,0] *= 0.5
+    if set.svd_apply_threshold:
+        if set.svd_threshold_unit == 'Hz':
+            in_model |= fshift <= set.svd_threshold / 1000.0
         else:
-            svd_fids[0] *= 0.5
+            in_model |= ppms >= set.svd_threshold
 
-        svd_data[0] *= 0.5
+    if set.svd_exclude_lipid:
+        in_model |= (ppms >= set.svd_exclude_lipid_end) & (ppms <= set.svd_exclude_lipid_start)
 
-        # FFT ---------------------------
+    return in_model
 
-        svd_fids = np.fft.fft(svd_fids, n=dim0) / dim0   #svd_fids.shape[-1]
-        svd_data = np.fft.fft(svd_data, n=dim0) / dim0   #svd_data.shape[-1]
 
-        # FLIP_SPECTRAL_AXIS -----------------
+def select_svd_lines_volume(chain, voxels):
+    """
+    Applies the HLSVD threshold and lipid exclusion rules to all the given
+    voxels at once, using each voxel's frequency shift, and sets their
+    SvdOutput.in_model flags. Returns the list of voxels whose flags changed.
+    Voxels still waiting for an HLSVD fit are skipped, the rules are applied
+    to them when they are fitted.
 
-        if set.flip:
+    """
+    set   = chain._block.set
+    block = chain._block
 
-            if len(svd_fids.shape)>1:
-                for i in range(svd_fids.shape[0]):
-                    svd_fids[i,:] = svd_fids[i,::-1].copy()
-            else:
-                svd_fids = svd_fids[::-1].copy()
+    if not (set.svd_apply_threshold or set.svd_exclude_lipid):
+        return []
 
-            svd_data = svd_data[::-1].copy()
+    voxels  = [voxel for voxel in voxels if not block.get_do_fit(voxel)]
+    outputs = [block.get_svd_output(voxel) for voxel in voxels]
+    nlines  = max([len(output) for output in outputs] + [0])
+    if not nlines:
+        return []
 
-        # AMPLITUDE and DC OFFSET  ---------------------------
+    # dense (voxel, line) array, voxels with fewer lines are padded with NaN
+    frequencies = np.full((len(voxels), nlines), np.nan)
+    for i, output in enumerate(outputs):
+        frequencies[i,:len(output)] = output.frequencies
 
-        svd_fids = svd_fids * set.amplitude + set.dc_offset
-        svd_data = svd_data * set.amplitude + set.dc_offset
+    xs, ys, zs = np.array(voxels).T
+    frequency_shift = block._frequency_shift[xs, ys, zs, 0, 0]
 
+    in_model = select_svd_lines(set, frequencies, frequency_shift,
+                                chain._dataset.resppm, chain._dataset.frequency)
 
-        # SAVE THINGS ----------------------------
+    changed = []
+    for i, output in enumerate(outputs):
+        flags = in_model[i,:len(output)]
+        if not np.array_equal(output.in_model, flags):
+            output.in_model[:] = flags
+            changed.append(voxels[i])
 
-        chain.svd_data = svd_data.copy()      # previously chain.freq_svd
+    return changed
 
-        in_model = np.where(chain.svd_output.in_model)[0]
-        cnt = len(in_model)
-        if cnt > 0:
-            if cnt > 1:
-                svd_fids      = svd_fids[in_model,:]
-                svd_peaks_sum = np.sum(svd_fids,axis=0)
-            else:
-                svd_fids      = svd_fids[in_model[0],:]
-                svd_peaks_sum = svd_fids.copy()
+
+def do_processing_volume(chain, voxels):
+    """
+    Reprocesses the given voxels after a change in their HLSVD line selection.
+    This is the same as do_processing_all() for each voxel, but done as array
+    operations on chunks of VOLUME_CHUNK_VOXELS voxels. Only the data that
+    goes into the block is calculated, not the per voxel results for the
+    View (svd_data, svd_peaks_checked, ...), these are set on the next run().
+
+    The selection only changes the data if the HLSVD water filter is used.
+    Voxels that still need an HLSVD fit or have no signal go through
+    chain.run() one at a time.
+
+    """
+    set     = chain._block.set
+    block   = chain._block
+    dataset = chain._dataset
+
+    if set.water_filter_method != 'SVD - water filter':
+        return
+
+    source   = dataset.get_source_data('spectral')
+    raw_dim0 = dataset.raw_dims[0]
+    dim0     = raw_dim0 * set.zero_fill_multiplier
+    t        = np.arange(raw_dim0) / dataset.sw
+    tt       = np.arange(raw_dim0) * (1000.0 / dataset.sw)     # ms, as in HLSVD
+    K        = 1j * 2 * np.pi
+
+    single  = []
+    batched = []
+    for voxel in voxels:
+        x, y, z = voxel
+        if block.get_do_fit(voxel) or not sum(source[0,0,z,y,x,:].real):
+            single.append(voxel)
         else:
-            svd_fids      = np.zeros(chain.spectral_dim0, complex)
-            svd_peaks_sum = np.zeros(chain.spectral_dim0, complex)      # no terms on in the filter
+            batched.append(voxel)
 
-        if len(svd_fids.shape) <= 1:
-            svd_fids.shape = 1,svd_fids.shape[0]
+    old_err_state = np.seterr(all='ignore')
 
-        chain.svd_peaks_checked     = svd_fids.copy()       # previously chain.fids
-        chain.svd_peaks_checked_sum = svd_peaks_sum         # previously chain.sum_fids
+    for i in range(0, len(batched), VOLUME_CHUNK_VOXELS):
+        chunk = batched[i:i+VOLUME_CHUNK_VOXELS]
+        xs, ys, zs = np.array(chunk).T
+        data = source[0,0,zs,ys,xs,:].astype(complex)
+
+        # LEFT_SHIFT and FREQUENCY_SHIFT ----
+
+        if set.left_shift_value:
+            data = np.roll(data, -set.left_shift_value, axis=-1)
+            data[:,-set.left_shift_value:] = 0.0
+
+        fshift  = block._frequency_shift[xs, ys, zs, 0, 0]
+        shifted = fshift != 0.0
+        phroll  = np.exp(1j * 2.0 * np.pi * fshift[shifted,np.newaxis] * t)
+        data[shifted] = data[shifted] * phroll
+
+        # SVD_FILTER - sum of the fids of the lines in the model -----
+
+        outputs = [block.get_svd_output(voxel) for voxel in chunk]
+        nlines  = max(len(output) for output in outputs)
+        lines   = np.zeros((4, len(chunk), nlines))
+        flags   = np.zeros((len(chunk), nlines), bool)
+        for j, output in enumerate(outputs):
+            n = len(output)
+            lines[:,j,:n] = (output.frequencies, output.damping_factors,
+                             output.amplitudes,  output.phases)
+            flags[j,:n] = output.in_model
+        freqs, decays, areas, phases = lines
+
+        checked = np.zeros((len(chunk), raw_dim0), complex)
+        for k in range(nlines):
+            use = flags[:,k] & (decays[:,k] != 0)
+            if not np.any(use):
+                continue
+            line = areas[use,k,np.newaxis] * np.exp((tt/decays[use,k,np.newaxis]) +
+                            K * (freqs[use,k,np.newaxis]*tt + phases[use,k,np.newaxis]/360.0))
+            line[np.isnan(line)] = 0.0
+            checked[use] += line
+
+        checked[shifted] = checked[shifted] * phroll
+
+        # WATER_FILTER, APODIZE, CHOP ----------
+
+        data = data - checked
+
+        if set.apodization:
+            if set.apodization == 'gaussian':
+                data = data * safe_exp(-(set.apodization_width * np.pi * 0.6 * t) ** 2, 0)
+            elif set.apodization == 'lorentzian':
+                data = data * safe_exp(-(set.apodization_width * np.pi * t), 0)
+
+        if set.chop:
+            data = data * ((((np.arange(raw_dim0) + 1) % 2) * 2) - 1)
+
+        # FFT and FLIP ------------------------
+
+        data[:,0] *= 0.5
+        if set.fft:
+            data = sp.fft.fft(data, n=dim0) / float(dim0)
+        elif set.zero_fill_multiplier > 1:
+            temp = np.zeros((len(chunk), dim0), 'complex')
+            temp[:,0:raw_dim0] = data
+            data = temp
+
+        if set.flip:
+            data = data[:,::-1]
+
+        block.data[0,0,zs,ys,xs,:] = data
+
+    np.seterr(**old_err_state)
+
+    if single:
+        chain.run(single, entry='all')
+
+
+def _get_svd_lines(chain, dwell_time):
+    """
+    Returns the time domain fids of all HLSVD lines for the current voxel and
+    their spectra processed like the data (see _process_svd_lines()).
+
+    Toggling lines in or out of the model, by hand or via the threshold and
+    lipid rules, does not change either array, only which rows get summed.
+    So both are cached per voxel in chain.svd_cache, keyed on the HLSVD
+    parameters and the processing settings, and only recalculated when one
+    of those changes. The cache keeps the most recently used voxels that fit
+    in SVD_CACHE_BYTES.
+
+    """
+    set = chain._block.set
+    svd_output = chain.svd_output
+
+    key = (svd_output.frequencies.tobytes(),
+           svd_output.damping_factors.tobytes(),
+           svd_output.amplitudes.tobytes(),
+           svd_output.phases.tobytes(),
+           chain._dataset.raw_dims[0],
+           chain._dataset.sw,
+           chain.frequency_shift,
+           set.apodization,
+           set.apodization_width,
+           set.chop,
+           set.zero_fill_multiplier,
+           set.flip,
+           set.amplitude,
+           set.dc_offset)
+
+    voxel = tuple(chain.voxel)
+    cache = chain.svd_cache
+    entry = cache.get(voxel)
+    if entry is not None and entry[0] == key:
+        cache.move_to_end(voxel)
+        return entry[1], entry[2]
+
+    svd_fids = _create_hlsvd_fids(svd_output.frequencies,
+                                  svd_output.damping_factors,
+                                  svd_output.amplitudes,
+                                  svd_output.phases,
+                                  chain._dataset.raw_dims[0],
+                                  len(svd_output),
+                                  0.0,
+                                  dwell_time)
+
+    svd_peaks = _process_svd_lines(chain, svd_fids)
+
+    cache[voxel] = (key, svd_fids, svd_peaks)
+    cache.move_to_end(voxel)
+    nbytes = svd_cache_bytes(chain)
+    while len(cache) > 1 and nbytes > SVD_CACHE_BYTES:
+        _, (_, fids, peaks) = cache.popitem(last=False)
+        nbytes -= fids.nbytes + peaks.nbytes
+
+    return svd_fids, svd_peaks
+
+
+def svd_cache_bytes(chain):
+    """ Returns the size of the arrays in chain.svd_cache in bytes """
+    return sum(fids.nbytes + peaks.nbytes for _, fids, peaks in chain.svd_cache.values())
+
+
+def _frequency_shift_roll(chain):
+    # seterr() avoids underflow error
+    old_err_state = np.seterr(all='ignore')
+    t = np.arange(chain._dataset.raw_dims[0]) / chain._dataset.sw
+    phroll = np.exp(1j * 2.0 * np.pi * chain.frequency_shift * t)
+    np.seterr(**old_err_state)
+    return phroll
+
+
+def _process_svd_lines(chain, svd_fids):
+    """
+    Takes fids as rows of a 2D array through frequency shift, apodization,
+    chop, zero fill, FFT, flip and amplitude/dc offset, as in the main chain,
+    and returns the spectra. The input array is not changed.
+
+    """
+    set = chain._block.set
+
+    # FREQUENCY_SHIFT --------------------
+
+    if chain.frequency_shift != 0.0:
+        svd_fids = svd_fids * _frequency_shift_roll(chain)
+
+    # APODIZE ----------------------------
+    
+    if set.apodization:
+
+        t = np.arange(chain._dataset.raw_dims[0]) / chain._dataset.sw
+        old_settings = np.seterr(all='ignore')  # avoid underflow warnings
+        if set.apodization == 'gaussian':
+            lineshape = safe_exp(-(set.apodization_width * np.pi * 0.6 * t) ** 2, 0)
+        elif set.apodization == 'lorentzian':
+            lineshape = safe_exp(-(set.apodization_width * np.pi * t), 0)
+        svd_fids = svd_fids * lineshape
+        np.seterr(**old_settings)
+
+    # CHOP ------------------------------
+
+    if set.chop:
+        chop = ((((np.arange(chain._dataset.raw_dims[0]) + 1) % 2) * 2) - 1)
+        svd_fids = svd_fids * chop
+
+    # ZEROFILL ---------------------------
+
+    dim0 = chain._dataset.raw_dims[0] * set.zero_fill_multiplier
+
+    svd_fids = svd_fids.copy()
+    svd_fids[:,0] *= 0.5
+
+    # FFT ---------------------------
+
+    svd_fids = np.fft.fft(svd_fids, n=dim0) / dim0   #svd_fids.shape[-1]
+
+    # FLIP_SPECTRAL_AXIS -----------------
+
+    if set.flip:
+        svd_fids = svd_fids[:,::-1].copy()
+
+    # AMPLITUDE and DC OFFSET  ---------------------------
+
+    svd_fids = svd_fids * set.amplitude + set.dc_offset
+
+    return svd_fids
 
 
 def _create_hlsvd_fids(freqs, decays, areas, phases, acqdim0, nlines, toff, dwell_time):
@@ -107,6 +107,11 @@ class ImagePanelToolbar2(wx.Panel):
         self.vmin       = [LEVSTR  for i in range(naxes)]
         self.vmax_orig  = [WIDMAX  for i in range(naxes)]
         self.vmin_orig  = [LEVSTR  for i in range(naxes)]
+
+        # patches and lines last added to each axes in update_images(), they
+        # are only removed and re-added when the caller sends new ones
+        self._image_patches = [None for i in range(naxes)]
+        self._image_lines   = [None for i in range(naxes)]
         
         # here we create the required naxes, add them to the figure, but we
         # also keep a permanent reference to each axes so they can be added
@@ -446,6 +451,11 @@ class ImagePanelToolbar2(wx.Panel):
     def update_images(self, index=None, force_bounds=False):
         """
         Sets the data from the normalized image numpy arrays into the axes.
+
+        One AxesImage is kept per axes and updated in place with set_data()
+        and set_clim(), rather than being removed and recreated. There is no
+        need to copy the data here, set_data() does that already. Patches and
+        lines are only swapped when a new list of them has been sent in. 
         
         We also set the axes dataLim and viewLim ranges here just in case
         the dimensions on the image being displayed has changed. This reset
@@ -457,17 +467,9 @@ class ImagePanelToolbar2(wx.Panel):
         for i in indices:
 
             axes = self.all_axes[i]
-            
-            if axes.images:
-                yold, xold = axes.images[0].get_array().shape
-            else:
-                yold, xold = -1,-1
-
-            for item in axes.images:
-                item.remove()
 
             ddict    = self.data[i][0]
-            data     = ddict['data'].copy() 
+            data     = ddict['data']
             alpha    = ddict['alpha']
             cmap     = ddict['cmap']
             vmax     = self.vmax[i]
@@ -476,30 +478,45 @@ class ImagePanelToolbar2(wx.Panel):
             lines    = ddict['lines']
                 
             xmin, xwid, ymin, ywid = 0, data.shape[1], 0, data.shape[0]
-            
-            # Explicit set origin here so the user rcParams value is not used. 
-            # This keeps us consistent across users.
-            self.imageid[i] = axes.imshow(data, cmap=cmap, 
-                                                alpha=alpha, 
-                                                vmax=vmax, 
-                                                vmin=vmin, 
-                                                aspect='equal', 
-                                                origin='upper') 
-
-            if patches is not None:
-                self.imageid[i].axes.patches = []
-                for patch in patches:
-                    self.imageid[i].axes.add_patch(patch)
+
+            image = self.imageid[i]
+            if image is None or image not in axes.images:
+                for item in list(axes.images):
+                    item.remove()
+                yold, xold = -1,-1
+                # Explicit set origin here so the user rcParams value is not
+                # used. This keeps us consistent across users.
+                self.imageid[i] = axes.imshow(data, cmap=cmap, 
+                                                    alpha=alpha, 
+                                                    vmax=vmax, 
+                                                    vmin=vmin, 
+                                                    aspect='equal', 
+                                                    origin='upper') 
             else:
-                for item in self.imageid[i].axes.patches:
+                yold, xold = image.get_array().shape
+                image.set_data(data)
+                image.set_cmap(cmap)
+                image.set_alpha(alpha)
+                image.set_clim(vmin, vmax)
+                if xold != xwid or yold != ywid:
+                    image.set_extent((xmin-0.5, xmin+xwid-0.5, ymin+ywid-0.5, ymin-0.5))
+
+            if patches is not self._image_patches[i]:
+                for item in list(axes.patches):
                     item.remove()
+                if patches is not None:
+                    for patch in patches:
+                        axes.add_patch(patch)
+                self._image_patches[i] = patches
 
-            if len(self.imageid[i].axes.lines) > 2:
+            if lines is not self._image_lines[i]:
                 # should be two lines in here for cursor tracking
-                self.imageid[i].axes.lines = self.imageid[i].axes.lines[0:2]
-            if lines is not None:
-                for line in lines:
-                    self.imageid[i].axes.add_line(line)
+                for item in list(axes.lines)[2:]:
+                    item.remove()
+                if lines is not None:
+                    for line in lines:
+                        axes.add_line(line)
+                self._image_lines[i] = lines
 
             if xold != xwid or yold!=ywid or force_bounds: 
                 xmin -= 0.5     # this centers the image range to voxel centers
@@ -519,6 +536,13 @@ class ImagePanelToolbar2(wx.Panel):
 # #             self.figure.hold(False)
 
 
+    def update_clims(self, index=None):
+        """ Sets only the vmin/vmax values into the image(s), e.g. for width/level """
+        for i in self.parse_indices(index):
+            if self.imageid[i] is not None:
+                self.imageid[i].set_clim(self.vmin[i], self.vmax[i])
+
+
     def parse_indices(self, index=None):
         """ 
         Ensure we know what data axes to act upon
@@ -672,6 +696,10 @@ class NavigationToolbar3Wx(NavigationToolbar2, wx.ToolBar):
         self._button_pressed = None
         self._xypress = None
 
+        # background and animated artists used to blit level and pan drags
+        self._blit_background = None
+        self._blit_artists = []
+
         # turn off crosshair cursors when mouse outside canvas
         self._idAxLeave  = self.canvas.mpl_connect('axes_leave_event', self.leave)
         self._idFigLeave = self.canvas.mpl_connect('figure_leave_event', self.leave)
@@ -729,9 +757,26 @@ class NavigationToolbar3Wx(NavigationToolbar2, wx.ToolBar):
         self.local_setup_after_event()
 
 
+    def press_pan(self, event):
+        NavigationToolbar2.press_pan(self, event)
+        if getattr(self, '_pan_info', None) is not None:
+            self.blit_start()
+
+
     def drag_pan(self, event):
-        NavigationToolbar2.drag_pan(self, event)
+        pan_info = getattr(self, '_pan_info', None)
+        if self._blit_background is None or pan_info is None or event.buttons != {pan_info.button}:
+            NavigationToolbar2.drag_pan(self, event)
+        else:
+            for ax in pan_info.axes:
+                ax.drag_pan(pan_info.button, event.key, event.x, event.y)
+            self.blit_update()
         self.mouse_move(event)
+
+
+    def release_pan(self, event):
+        self.blit_stop()
+        NavigationToolbar2.release_pan(self, event)
         
         
     def level(self, *args):
@@ -790,6 +835,9 @@ class NavigationToolbar3Wx(NavigationToolbar2, wx.ToolBar):
                 self._idDrag = self.canvas.mpl_connect('motion_notify_event', self.drag_level)
         
         self.press_local(event)
+
+        if self._xypress:
+            self.blit_start()
  
  
     def drag_level(self, event):
@@ -820,15 +868,18 @@ class NavigationToolbar3Wx(NavigationToolbar2, wx.ToolBar):
             self.parent.width[indx] = wid   # need this in case values were
             self.parent.level[indx] = lev   # clipped by MIN MAX bounds
             
-            self.parent.update_images(index=indx)
+            self.parent.update_clims(index=indx)
 
             # prep new 'last' location for next event call
             self._xypress[0][2] = event.x
             self._xypress[0][3] = event.y
             
         self.mouse_move(event)
-    
-        self.dynamic_update()
+
+        if self._blit_background is not None:
+            self.blit_update()
+        else:
+            self.dynamic_update()
 
  
     def release_level(self, event):
@@ -847,6 +898,7 @@ class NavigationToolbar3Wx(NavigationToolbar2, wx.ToolBar):
         self._button_pressed = None
         self.push_current()
         self.release_local(event)
+        self.blit_stop()
         self.canvas.draw()
 
 
@@ -1091,6 +1143,45 @@ class NavigationToolbar3Wx(NavigationToolbar2, wx.ToolBar):
         return xloc,yloc
     
     
+    def blit_start(self):
+        """
+        Sets up blitting for a mouse drag. The images, patches and lines in
+        all axes are made animated and the canvas is drawn once without them
+        to save a background. During the drag, blit_update() restores that
+        background and only draws these artists.
+
+        """
+        self.blit_stop()
+        artists = []
+        for axes in self.parent.axes:
+            artists += list(axes.images) + list(axes.patches) + list(axes.lines)
+        artists.sort(key=lambda artist: artist.get_zorder())
+        for artist in artists:
+            artist.set_animated(True)
+        self.canvas.draw()
+        self._blit_artists = artists
+        self._blit_background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self.blit_update()
+
+
+    def blit_update(self):
+        if self._blit_background is None:
+            return
+        self.canvas.restore_region(self._blit_background)
+        for artist in self._blit_artists:
+            if artist.get_visible():
+                artist.axes.draw_artist(artist)
+        self.canvas.blit(self.canvas.figure.bbox)
+
+
+    def blit_stop(self):
+        """ Ends blitting, the caller is responsible for a full redraw """
+        for artist in self._blit_artists:
+            artist.set_animated(False)
+        self._blit_artists = []
+        self._blit_background = None
+
+
     def dynamic_update(self):
         d = self._idle
         self._idle = False
@@ -0,0 +1,165 @@
+"""
+IntegralMap calculates a metabolite integral for every voxel of a CSI data
+set over a range of spectral points.
+
+The integral of the phased spectrum over points [start, end) is the same sum
+as the one calculated for the reference span in PlotPanelSpectrum, namely
+sum(data[start:end]) of the real, imaginary or magnitude spectrum. To make
+that cheap to repeat, we keep two cumulative sum tables for all voxels:
+
+  - the complex spectrum with phase 1 applied
+  - the magnitude spectrum (which does not depend on phase)
+
+and any range integral is then the difference of two table columns. Phase 0
+is constant across the spectrum, so it is applied to the summed complex value
+rather than the data. As a result:
+
+  - changing the range costs O(1) per voxel
+  - changing phase 0 (for one or all voxels) costs O(1) per voxel
+  - changing phase 1 or the data in one voxel (e.g. after a B0 shift) only
+    recalculates the table rows for that voxel
+  - changing the phase 1 pivot recalculates all table rows
+
+Tables are built in chunks of voxels, so temporary arrays stay small even for
+large data sets.
+
+"""
+
+# Python modules
+
+
+# 3rd party modules
+import numpy as np
+
+
+# Our modules
+from ice_view.common.constants import DEGREES_TO_RADIANS
+
+
+
+# number of voxels processed at a time when (re)building the tables
+CHUNK_VOXELS = 256
+
+DATA_TYPES = ['real', 'imaginary', 'magnitude']
+
+
+
+class IntegralMap(object):
+    """
+    Cumulative sum tables and per voxel phases for a spectral data set.
+
+    data     - complex ndarray, shape (..., dim0), spectral dim last
+    phase_0  - ndarray in degrees, shape data.shape[:-1]
+    phase_1  - ndarray in degrees, shape data.shape[:-1]
+    pivot    - phase 1 pivot location, in points
+
+    """
+    def __init__(self, data, phase_0, phase_1, pivot):
+
+        data = np.asarray(data)
+
+        self.shape = data.shape[:-1]
+        self.dim0  = data.shape[-1]
+
+        nvox  = int(np.prod(self.shape))
+        dtype = np.result_type(data.dtype, np.complex64)
+
+        self._data     = data.reshape(nvox, self.dim0)
+        self._phase_0  = np.zeros(nvox)
+        self._phase_1  = np.zeros(nvox)
+        self._pivot    = pivot
+
+        # tables have a leading column of zeros so that the integral over
+        # [start, end) is always table[:,end] - table[:,start]
+        self._csum = np.zeros((nvox, self.dim0+1), dtype=dtype)
+        self._msum = np.zeros((nvox, self.dim0+1), dtype=np.finfo(dtype).dtype)
+
+        self._phase_1[:] = np.ravel(phase_1)
+        self._phase_0[:] = np.ravel(phase_0)
+        self._update_rows(np.arange(nvox), magnitude=True)
+
+
+    def set_phases(self, phase_0, phase_1, pivot=None):
+        """
+        Sets phase 0 and phase 1 for all voxels. Only the table rows of voxels
+        whose phase 1 has changed are recalculated, unless the pivot changed,
+        in which case all rows are.
+
+        """
+        phase_0 = np.ravel(phase_0)
+        phase_1 = np.ravel(phase_1)
+
+        if pivot is not None and pivot != self._pivot:
+            self._pivot = pivot
+            rows = np.arange(len(phase_1))
+        else:
+            rows = np.nonzero(phase_1 != self._phase_1)[0]
+
+        self._phase_0[:] = phase_0
+        self._phase_1[:] = phase_1
+        if len(rows):
+            self._update_rows(rows)
+
+
+    def update_voxel(self, index, data=None, phase_0=None, phase_1=None):
+        """
+        Updates one voxel, index is a tuple into self.shape. If data is given
+        it replaces the spectrum for that voxel (e.g. after a B0 shift or HLSVD
+        water removal), otherwise only the phases are updated.
+
+        """
+        row = np.ravel_multi_index(index, self.shape)
+
+        if phase_0 is not None:
+            self._phase_0[row] = phase_0
+
+        changed = False
+        if data is not None:
+            self._data[row,:] = data
+            changed = True
+        if phase_1 is not None and phase_1 != self._phase_1[row]:
+            self._phase_1[row] = phase_1
+            changed = True
+
+        if changed:
+            self._update_rows(np.array([row]), magnitude=data is not None)
+
+
+    def get_map(self, start, end, data_type='real'):
+        """
+        Returns the integral over points [start, end) for all voxels as an
+        ndarray of shape self.shape.
+
+        """
+        if data_type not in DATA_TYPES:
+            raise ValueError("data_type must be one of %s" % str(DATA_TYPES))
+
+        if start > end:
+            start, end = end, start
+        start = int(np.clip(start, 0, self.dim0))
+        end   = int(np.clip(end,   0, self.dim0))
+
+        if data_type == 'magnitude':
+            result = self._msum[:,end] - self._msum[:,start]
+        else:
+            result = self._csum[:,end] - self._csum[:,start]
+            result = result * np.exp(1j * self._phase_0 * DEGREES_TO_RADIANS)
+            result = result.real if data_type == 'real' else result.imag
+
+        return result.reshape(self.shape)
+
+
+    def _update_rows(self, rows, magnitude=False):
+        """ Recalculates the cumulative sum tables for the given voxel rows """
+
+        ramp = (np.arange(self.dim0) - self._pivot) / self.dim0
+
+        for i in range(0, len(rows), CHUNK_VOXELS):
+            chunk = rows[i:i+CHUNK_VOXELS]
+            data  = self._data[chunk,:]
+
+            angle = np.outer(self._phase_1[chunk] * DEGREES_TO_RADIANS, ramp)
+            self._csum[chunk,1:] = np.cumsum(data * np.exp(1j * angle), axis=1)
+
+            if magnitude:
+                self._msum[chunk,1:] = np.cumsum(np.abs(data), axis=1)
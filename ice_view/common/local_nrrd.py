@@ -26,6 +26,9 @@ import bz2
 import os.path
 from datetime import datetime
 
+# compressed data is read and written this many bytes at a time
+_CHUNK_BYTES = 16 * 1024 * 1024
+
 class NrrdError(Exception):
     """Exceptions for Nrrd class."""
     pass
@@ -216,16 +219,36 @@ def _determine_dtype(fields):
     return np.dtype(np_typestring)
 
 
-def read_data(fields, filehandle, filename=None):
-    """Read the actual data into a numpy structure."""
-    data = np.zeros(0)
+def _read_stream(stream, dtype, count):
+    """Read count items of dtype from a (decompressing) stream, a chunk at a
+    time straight into the returned array, so there is no second copy."""
+    data = np.empty(count, dtype)
+    buf = data.view(np.uint8)
+    pos = 0
+    while pos < buf.nbytes:
+        nread = stream.readinto(buf[pos:pos+_CHUNK_BYTES])
+        if not nread:
+            raise NrrdError('Nrrd data ends after %d of %d bytes.' % (pos, buf.nbytes))
+        pos += nread
+    return data
+
+
+def read_data(fields, filehandle, filename=None, mmap_mode=None):
+    """Read the actual data into a numpy structure.
+
+    For raw encoded data, mmap_mode ('r', 'r+' or 'c', as for np.load) returns
+    a np.memmap of the data file instead of reading it into memory. It is
+    ignored for compressed data, which is decompressed in chunks straight into
+    the result array.
+    """
     # Determine the data type from the fields
     dtype = _determine_dtype(fields)
     # determine byte skip, line skip, and data file (there are two ways to write them)
     lineskip = fields.get('lineskip', fields.get('line skip', 0))
-    byteskip = fields.get('byteskip', fields.get('byteskip', 0))
+    byteskip = fields.get('byteskip', fields.get('byte skip', 0))
     datafile = fields.get("datafile", fields.get("data file", None))
     datafilehandle = filehandle
+    datafilename = filename
     if datafile is not None:
         # If the datafile path is absolute, don't muck with it. Otherwise
         # treat the path as relative to the directory in which the detached
@@ -235,36 +258,39 @@ def read_data(fields, filehandle, filename=None):
         else:
             datafilename = os.path.join(os.path.dirname(filename), datafile)
         datafilehandle = open(datafilename,'rb')
-    totalbytes = dtype.itemsize *\
-                    np.array(fields['sizes']).prod()
-    if fields['encoding'] == 'raw':
-        if byteskip == -1:
-            datafilehandle.seek(-totalbytes, 2)
-        else:
-            for _ in range(lineskip):
-                datafilehandle.readline()
-            datafilehandle.read(byteskip)
-        data = np.fromfile(datafilehandle, dtype)
-    elif fields['encoding'] == 'gzip' or\
-         fields['encoding'] == 'gz':
-        gzipfile = gzip.GzipFile(fileobj=datafilehandle)
-        # Again, unfortunately, np.fromfile does not support
-        # reading from a gzip stream, so we'll do it like this.
-        # I have no idea what the performance implications are.
-        data = np.fromstring(gzipfile.read(), dtype)
-    elif fields['encoding'] == 'bzip2' or\
-         fields['encoding'] == 'bz2':
-        bz2file = bz2.BZ2File(fileobj=datafilehandle)
-        # Again, unfortunately, np.fromfile does not support
-        # reading from a gzip stream, so we'll do it like this.
-        # I have no idea what the performance implications are.
-        data = np.fromstring(bz2file.read(), dtype)
-    else:
-        raise NrrdError('Unsupported encoding: "%s"' % fields['encoding'])
     # dkh : eliminated need to reverse order of dimensions. nrrd's
     # data layout is same as what numpy calls 'Fortran' order,
-    shape_tmp = list(fields['sizes'])
-    data = np.reshape(data, tuple(shape_tmp), order='F')
+    shape = tuple(fields['sizes'])
+    count = int(np.prod(shape))
+    totalbytes = dtype.itemsize * count
+    try:
+        if fields['encoding'] == 'raw':
+            if byteskip == -1:
+                datafilehandle.seek(-totalbytes, 2)
+            else:
+                for _ in range(lineskip):
+                    datafilehandle.readline()
+                datafilehandle.read(byteskip)
+            if mmap_mode is not None and datafilename is not None:
+                return np.memmap(datafilename, dtype=dtype, mode=mmap_mode,
+                                 offset=datafilehandle.tell(), shape=shape, order='F')
+            data = np.fromfile(datafilehandle, dtype, count=count)
+            if data.size < count:
+                raise NrrdError('Nrrd data ends after %d of %d bytes.' % (data.nbytes, totalbytes))
+        elif fields['encoding'] == 'gzip' or\
+             fields['encoding'] == 'gz':
+            with gzip.GzipFile(fileobj=datafilehandle) as gzipfile:
+                data = _read_stream(gzipfile, dtype, count)
+        elif fields['encoding'] == 'bzip2' or\
+             fields['encoding'] == 'bz2':
+            with bz2.BZ2File(datafilehandle) as bz2file:
+                data = _read_stream(bz2file, dtype, count)
+        else:
+            raise NrrdError('Unsupported encoding: "%s"' % fields['encoding'])
+    finally:
+        if datafilehandle is not filehandle:
+            datafilehandle.close()
+    data = np.reshape(data, shape, order='F')
     return data
 
 def _validate_magic_line(line):
@@ -346,11 +372,12 @@ def read_header(nrrdfile):
     return header
 
 
-def read(filename):
-    """Read a nrrd file and return a tuple (data, header)."""
+def read(filename, mmap_mode=None):
+    """Read a nrrd file and return a tuple (data, header). See read_data()
+    for mmap_mode."""
     with open(filename,'rb') as filehandle:
         header = read_header(filehandle)
-        data = read_data(header, filehandle, filename)
+        data = read_data(header, filehandle, filename, mmap_mode=mmap_mode)
         return (data, header)
 
 
@@ -407,21 +434,35 @@ _NRRD_FIELD_FORMATTERS = {
 }
 
 
+def _iter_fortran_bytes(data):
+    """Yield the data in Fortran order, as uint8 arrays of about _CHUNK_BYTES,
+    without making a Fortran ordered copy of all of it."""
+    if data.ndim < 2 or data.flags.f_contiguous:
+        flat = np.asfortranarray(data).ravel(order='F').view(np.uint8)
+        for i in range(0, flat.size, _CHUNK_BYTES):
+            yield flat[i:i+_CHUNK_BYTES]
+    else:
+        # slabs along the last axis are contiguous in Fortran order
+        slab = max(data[...,0].nbytes, 1)
+        step = max(_CHUNK_BYTES // slab, 1)
+        for i in range(0, data.shape[-1], step):
+            yield np.asfortranarray(data[...,i:i+step]).ravel(order='F').view(np.uint8)
+
+
 def _write_data(data, filehandle, options):
-    # Now write data directly
-    rawdata = data.tostring(order = 'F')
+    # Now write data directly, a chunk at a time
     if options['encoding'] == 'raw':
-        filehandle.write(rawdata)
+        fileobj = filehandle
     elif options['encoding'] == 'gzip':
-        gzfileobj = gzip.GzipFile(fileobj = filehandle)
-        gzfileobj.write(rawdata)
-        gzfileobj.close()
+        fileobj = gzip.GzipFile(fileobj = filehandle, mode = 'wb')
     elif options['encoding'] == 'bz2':
-        bz2fileobj = bz2.BZ2File(fileobj = filehandle)
-        bz2fileobj.write(rawdata)
-        bz2fileobj.close()
+        fileobj = bz2.BZ2File(filehandle, 'wb')
     else:
         raise NrrdError('Unsupported encoding: "%s"' % options['encoding'])
+    for chunk in _iter_fortran_bytes(data):
+        fileobj.write(chunk)
+    if fileobj is not filehandle:
+        fileobj.close()
 
 
 def write(filename, data, options={}, separate_header=False):
@@ -434,6 +475,8 @@ def write(filename, data, options={}, separate_header=False):
     3d data with sampling deltas `s1`, `s2`, and `s3` in each dimension.
 
     """
+    # Work on a copy, the fields set below are not returned to the caller
+    options = dict(options)
     # Infer a number of fields from the ndarray and ignore values
     # in the options dictionary.
     options['type'] = _TYPEMAP_NUMPY2NRRD[data.dtype.str[1:]]
@@ -454,18 +497,24 @@ def write(filename, data, options={}, separate_header=False):
     # If *.nrrd filename provided AND separate_header=True, separate files
     #   written.
     # For all other cases, header & data written to same file.
+    # The 'data file' field is written relative to the header directory,
+    # which is how read_data() looks for it.
     if filename[-5:] == '.nhdr':
         separate_header = True
         if 'data file' not in options:
             datafilename = filename[:-4] + str('raw')
             if options['encoding'] == 'gzip':
                 datafilename += '.gz'
-            options['data file'] = datafilename
+            elif options['encoding'] == 'bz2':
+                datafilename += '.bz2'
+            options['data file'] = os.path.basename(datafilename)
         else:
-            datafilename = options['data file']
+            datafilename = os.path.join(os.path.dirname(filename), options['data file'])
     elif filename[-5:] == '.nrrd' and separate_header:
         datafilename = filename
         filename = filename[:-4] + str('nhdr')
+        if 'data file' not in options:
+            options['data file'] = os.path.basename(datafilename)
     else:
         # Write header & data as one file
         datafilename = filename
@@ -502,6 +551,67 @@ def write(filename, data, options={}, separate_header=False):
         with open(datafilename, 'wb') as datafilehandle:
             _write_data(data, datafilehandle, options)
 
+
+def _benchmark(size_mb=256, path=None):
+    """Time writing and reading a float32 volume of about size_mb MB for each
+    encoding, and reading it the previous way, with the whole payload read
+    into a bytes object and then copied into an array. Peak memory is that
+    allocated during the read, as traced by tracemalloc."""
+    import time
+    import tempfile
+    import tracemalloc
+
+    nz = max(int(size_mb * 1024 * 1024 // (4 * 256 * 256)), 1)
+    data = np.random.default_rng(0).normal(size=(256, 256, nz)).astype(np.float32)
+    data[:, :, ::2] = 0.0           # something for the compressors to do
+    mb = data.nbytes / (1024 * 1024)
+
+    def timed(func):
+        tracemalloc.start()
+        t0 = time.time()
+        res = func()
+        t1 = time.time()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return res, t1 - t0, peak / (1024 * 1024)
+
+    def read_whole(filename, opener):
+        # what read_data() did before
+        with open(filename, 'rb') as f:
+            header = read_header(f)
+            with opener(f) as g:
+                res = np.frombuffer(g.read(), _determine_dtype(header)).copy()
+        return np.reshape(res, tuple(header['sizes']), order='F')
+
+    tmpdir = tempfile.mkdtemp() if path is None else path
+    print('%d MB float32 volume %s' % (mb, str(data.shape)))
+    for encoding, opener in (('raw',  lambda f: f),
+                             ('gzip', lambda f: gzip.GzipFile(fileobj=f)),
+                             ('bz2',  lambda f: bz2.BZ2File(f))):
+        filename = os.path.join(tmpdir, '_benchmark_%s.nrrd' % encoding)
+        _, tw, _ = timed(lambda: write(filename, data, {'encoding': encoding}))
+        res, tr, pr = timed(lambda: read(filename)[0])
+        assert np.array_equal(res, data)
+        del res
+        print('%-5s write %6.1f MB/s   read %7.1f MB/s  peak %6.0f MB' % (encoding, mb/tw, mb/tr, pr))
+        if encoding == 'raw':
+            res, tm, pm = timed(lambda: read(filename, mmap_mode='r')[0])
+            _, ts, _ = timed(lambda: float(res.sum()))
+            del res
+            print('      memmap open %.4f s, then sum %7.1f MB/s  peak %6.0f MB' % (tm, mb/ts, pm))
+        else:
+            res, to, po = timed(lambda: read_whole(filename, opener))
+            assert np.array_equal(res, data)
+            del res
+            print('      previous method  read %7.1f MB/s  peak %6.0f MB' % (mb/to, po))
+        os.remove(filename)
+    if path is None:
+        os.rmdir(tmpdir)
+
+
 if __name__ == "__main__":
+    import sys
     import doctest
     doctest.testmod()
+    if '--benchmark' in sys.argv:
+        _benchmark()
@@ -9,7 +9,6 @@ import xml.etree.cElementTree as ElementTree
 import ice_view.common.xml_ as util_xml
 import ice_view.common.time_ as util_time
 from ice_view.common.constants import Deflate
-from ice_view.common.util_generic_spectral import create_fid
 
 
 
@@ -83,6 +82,7 @@ class GenericBasis(object):
         self._fid          = None     # cache for calculated array
         self._spectrum_sum = None     # cache for calculated array
         self._spectrum_all = None
+        self._update_key   = None     # values used for the cached arrays
 
         if attributes is not None:
             self.inflate(attributes)
@@ -195,46 +195,56 @@ class GenericBasis(object):
         This method will return a single line of zeros if there are no lines in
         the widget OR there are lines but none have been checked to include.
 
+        The results are cached, and only recalculated if the lines or the
+        dataset parameters they depend on have changed since the last call.
+
         """
         zfmult = dataset.zero_fill_multiplier if zfmult is None else zfmult
 
         dim0 = dataset.raw_dims[0]
+
+        key = (tuple(self.area), tuple(self.ppm), tuple(self.phase), tuple(self.lw),
+               tuple(self.check), dataset.sw, dim0, zfmult, dataset.frequency,
+               dataset.resppm, dataset.echopeak, dataset.spectral_dims[0])
+        if key == self._update_key:
+            return True
+
         td   = 1.0 / dataset.sw
         off  = round(1.0 * dim0 * dataset.echopeak / 100.0) * td
         xx   = np.arange(dim0) * td
         xxx  = abs(xx - off)
-        tmp  = np.zeros(int(dim0 * zfmult), dtype=np.complex64)
 
-        npk = len(self.area)
-        fids = []
-        specs = []
-        if npk > 0 and any(self.check):
-            for i in range(npk):
-                if self.check[i]:
+        indx = [i for i in range(len(self.area)) if self.check[i]]
+        if indx:
+            # all checked lines at once, one row per line
+            areas  = np.array(self.area)[indx]
+            freqs  = dataset.ppm2hz(np.array(self.ppm)[indx]) * 2.0 * np.pi
+            phases = np.array(self.phase)[indx] * np.pi / 180.0
+            lws    = np.array(self.lw)[indx]
 
-                    fid, _ = create_fid(self.area[i], self.ppm[i], self.phase[i], dataset, calc_peakppm=False)
-                    fids.append(fid)
+            fids = areas[:,np.newaxis] * np.exp(1j * freqs[:,np.newaxis] * xx) * np.exp(1j * phases[:,np.newaxis])
 
-                    expo = (self.lw[i] * 0.6 * np.pi * xxx) ** 2       # only gaussian here
-                    indx = np.where(expo > 50)
-                    cnt = np.size(indx)
-                    if cnt > 0: expo[indx] = 50
-                    lshape = np.exp(-expo)
+            expo = (lws[:,np.newaxis] * 0.6 * np.pi * xxx) ** 2      # only gaussian here
+            expo = np.where(expo > 50, 50, expo)
+            lshape = np.exp(-expo)
 
-                    tmp[0:dim0] = fid * lshape
-                    tmp[0] *= 0.5
+            tmp = np.zeros((len(indx), int(dim0 * zfmult)), dtype=np.complex64)
+            tmp[:,0:dim0] = fids * lshape
+            tmp[:,0] *= 0.5
 
-                    specs.append(np.fft.fft(tmp) / len(tmp))
+            specs = np.fft.fft(tmp, axis=1) / tmp.shape[1]
 
             self._fid          = np.sum(fids, axis=0)
             self._spectrum_sum = np.sum(specs, axis=0)
-            self._spectrum_all = np.array(specs)
+            self._spectrum_all = specs
 
         else:
             self._fid          = np.zeros((dim0 * zfmult), dtype=np.complex64)
             self._spectrum_sum = np.zeros((dim0 * zfmult), dtype=np.complex64)
             self._spectrum_all = np.zeros((dim0 * zfmult), dtype=np.complex64)
 
+        self._update_key = key
+
         return True
 
 
@@ -1,8 +1,21 @@
+"""
+Parser for the XProtocol text headers that ICE writes next to its data files
+(e.g. MiniHead_spe_00001.IceHead).
 
+XProtHeader scans the header once with a single precompiled tokenizer that
+follows ParamMap and ParamArray nesting. During the scan leaf parameters are
+only located, their text is converted to a typed value (based on the Param
+type, not the name) the first time the key is requested. read_xprot() caches
+parsed headers by file path, modification time and size, so opening the same
+file again does not read or scan it.
 
+"""
+
+import os
 import re
-import regex as rx
-from itertools import chain
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
 import os.path as op
 
 
@@ -52,37 +65,272 @@ def try_cast(value, key):
 #     return r
 
 
+# Tokenizer for the XProtocol text. A leaf parameter whose body has no nested
+# braces is matched as one token, and its body is only tokenized when the value
+# is requested. Everything else (ParamMap, ParamArray, other nodes and
+# anonymous brace groups) is walked token by token.
+_QUOTED = r'"(?:[^"]|"")*"'
+
+_RE_TOKEN = re.compile(r'''
+    <(?P<leaf_type>Param\w+)\."(?P<leaf_name>[^"]*)">\s*
+        \{(?P<leaf_body>(?:[^{}"]|''' + _QUOTED + r''')*)\}
+  | <(?P<tag>\w+)(?:\."(?P<name>[^"]*)")?>
+  | (?P<string>''' + _QUOTED + r''')
+  | (?P<open>\{)
+  | (?P<close>\})
+  | (?P<word>[^\s{}<"]+)
+''', re.VERBOSE)
+
+# Value tokens of a leaf body. Modifiers such as <Precision> 16 are a bare tag
+# and one value, they are matched (and then dropped) as a single token.
+_RE_BODY = re.compile(r'(?P<tag><\w+>\s*(?:' + _QUOTED + r'|[^\s<"]+)?)'
+                      r'|' + _QUOTED +
+                      r'|[^\s<"]+')
+
+# Value type and default value (for empty braces) of the leaf parameter types
+_PARAM_TYPES = {'ParamLong'   : (int,   0),
+                'ParamDouble' : (float, 0.0),
+                'ParamBool'   : (bool,  False),
+                'ParamString' : (str,   ''),
+                'ParamChoice' : (str,   ''),
+               }
+
+# Bare tags that hold content, all other bare tags (<Precision>, <Default>,
+# <Limit> ...) are modifiers whose value is skipped
+_CONTAINER_TAGS = ('XProtocol',)
+
+
+def _cast(token, ptype):
+    """ Converts one value token to ptype (int, float, bool or str) """
+    if token.startswith('"'):
+        token = token[1:-1].replace('""', '"')
+    if ptype is bool:
+        return token.lower() == 'true'
+    if ptype is int:
+        try:
+            return int(token)
+        except ValueError:
+            ptype = float
+    if ptype is float:
+        try:
+            return float(token)
+        except ValueError:
+            pass
+    return token
+
+
+def _convert(tokens, param_type, is_array):
+    """
+    Typed value of a list of tokens, nested lists are array elements. For an
+    array of ParamMaps param_type is the list of the map's member types.
+
+    """
+    if isinstance(param_type, list):
+        values = []
+        for element in tokens:
+            members = []
+            for i, member in enumerate(element):
+                member_type = param_type[i] if i < len(param_type) else None
+                members.append(_convert(member, member_type, False))
+            values.append(members)
+        return values
+
+    ptype, default = _PARAM_TYPES.get(param_type, (str, ''))
+
+    values = []
+    for token in tokens:
+        if isinstance(token, list):
+            values.append(_convert(token, param_type, False))
+        else:
+            values.append(_cast(token, ptype))
+
+    if is_array:
+        return values
+    if len(values) == 0:
+        return default
+    if len(values) == 1:
+        return values[0]
+    return values
+
+
+
+class XProtHeader(Mapping):
+    """
+    Read only mapping of parameter name to typed value for an XProtocol text
+    header. Parameters are indexed by name only, if a name appears more than
+    once (e.g. in different ParamMaps) the last one wins.
+
+    Values are typed by their Param type: ParamLong is int, ParamDouble is
+    float, ParamBool is bool and ParamString is str. Empty braces give the
+    default for the type (0, 0.0, False, ''), a leaf with several values gives
+    a list. A ParamArray gives a list with one entry per element, typed by the
+    array's <Default> parameter. Elements of an array of ParamMaps are lists
+    with one entry per map member.
+
+    The header text is kept in self.text.
+
+    """
+    def __init__(self, text):
+        self.text = text
+        self._params = OrderedDict()    # name -> (param type, raw, is_array)
+        self._values = {}
+        self._scan(text)
+
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        param_type, raw, is_array = self._params[key]
+        if isinstance(raw, str):
+            raw = [m.group() for m in _RE_BODY.finditer(raw)
+                   if m.lastgroup != 'tag']
+        value = _convert(raw, param_type, is_array)
+        self._values[key] = value
+        return value
+
+
+    def __iter__(self):
+        return iter(self._params)
+
+
+    def __len__(self):
+        return len(self._params)
+
+
+    def __contains__(self, key):
+        return key in self._params
+
+
+    def get_type(self, key):
+        """ Returns the Param type of key, e.g. 'ParamLong' or 'ParamArray' """
+        param_type, raw, is_array = self._params[key]
+        return 'ParamArray' if is_array else param_type
+
+
+    def _add(self, name, param_type, raw, is_array=False):
+        self._params[name] = (param_type, raw, is_array)
+        self._values.pop(name, None)
+
+
+    def _scan(self, text):
+        """ Indexes all parameters in one pass over the text """
+
+        # one frame per open brace, [param type, name, tokens, skip, element
+        # type, array], param type is None for anonymous groups (e.g. array
+        # elements), array is set for the <Default> ParamMap of an array
+        stack    = []
+        pending  = None     # (param type, name, skip) waiting for its brace
+        default_of = None   # array frame whose <Default> node is pending
+        modifier = None     # bare <Tag> whose value is not content
+
+        for m in _RE_TOKEN.finditer(text):
+            kind  = m.lastgroup
+            frame = stack[-1] if stack else None
+            skipping = frame is not None and frame[3]
+
+            if kind == 'leaf_body':
+                param_type = m.group('leaf_type')
+                if modifier is not None:
+                    if modifier == 'Default' and frame is not None:
+                        frame[4] = param_type
+                    modifier = None
+                elif skipping:
+                    if frame[5] is not None:
+                        frame[5][4].append(param_type)
+                else:
+                    if param_type in _PARAM_TYPES:
+                        self._add(m.group('leaf_name'), param_type, m.group('leaf_body'))
+                    elif param_type == 'ParamArray':
+                        self._add(m.group('leaf_name'), 'ParamString', [], True)
+
+            elif kind == 'name':
+                # named node, e.g. <ParamMap."DICOM">, its group follows
+                if modifier == 'Default' and frame is not None:
+                    if m.group('tag') == 'ParamMap':
+                        frame[4]   = []
+                        default_of = frame
+                    else:
+                        frame[4] = m.group('tag')
+                pending  = (m.group('tag'), m.group('name'), modifier is not None)
+                modifier = None
+
+            elif kind == 'tag':
+                if m.group('tag') not in _CONTAINER_TAGS:
+                    modifier = m.group('tag')
+
+            elif kind == 'open':
+                if pending is not None:
+                    param_type, name, skip = pending
+                else:
+                    param_type, name, skip = None, None, modifier is not None
+                stack.append([param_type, name, [], skipping or skip, None,
+                              default_of])
+                pending    = None
+                modifier   = None
+                default_of = None
+
+            elif kind == 'close':
+                if not stack:
+                    continue
+                param_type, name, tokens, skip, element_type, _ = stack.pop()
+                if skip:
+                    continue
+                if param_type is None:
+                    if stack:
+                        stack[-1][2].append(tokens)
+                elif param_type == 'ParamArray':
+                    self._add(name, element_type or 'ParamString', tokens, True)
+                elif param_type in _PARAM_TYPES:
+                    self._add(name, param_type, tokens)
+
+            else:   # string or word
+                if modifier is not None:
+                    modifier = None
+                elif frame is not None and not skipping:
+                    frame[2].append(m.group())
+
+
+
 def parse_xprot(buffer):
-    xprot = {}
-    tokens = re.finditer(r'<Param(?:Bool|Long|String)\."(\w+)">\s*{([^}]*)', buffer)
-    tokensDouble = re.finditer(r'<ParamDouble\."(\w+)">\s*{\s*(<Precision>\s*[0-9]*)?\s*([^}]*)', buffer)
-    #tokensArray = re.finditer(r"(?s)(?=\<ParamArray\.\".*\"\>\{)(?:(?=.*?\{(?!.*?\1)(.*\}(?!.*\2).*))(?=.*?\}(?!.*?\2)(.*)).)+?.*?(?=\1)[^{]*(?=\2$)", buffer)
+    """ Returns an XProtHeader for the XProtocol text in buffer """
+    return XProtHeader(buffer)
 
-    #tokensArray = rx.finditer(r"(?s)(?=\<ParamArray\.\".*\"\>\{)(?:(?=.*?\{(?!.*?\1)(.*\}(?!.*\2).*))(?=.*?\}(?!.*?\2)(.*)).)+?.*?(?=\1)[^{]*(?=\2$)", buffer)
-    # r'<ParamArray\."(\w+)">\s+{\s+<Visible>.\"(true|false)\"\s+<MinSize>.(\d+)\s+<MaxSize>.(\d+)\s+<Default>.<(\w+).\"(\w*)\">',
-    # r'<ParamArray\."(\w+)">\s+{([^}]*)',
-    #t_arr = [item for item in tokensArray]
-    #arrs = parse_array_objs(t_arr)
 
-    alltokens = chain(tokens, tokensDouble)
+# Parsed headers by absolute path, each entry is ((mtime, size), XProtHeader)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+CACHE_SIZE = 256
 
-    for t in alltokens:
-        name = t.group(1)
 
-        value = re.sub(r'("*)|( *<\w*> *[^\n]*)', '', t.groups()[-1])
-        value = re.sub(r'[\t\n\r\f\v]*', '', value.strip())
+def read_xprot(fname):
+    """
+    Returns the XProtHeader for the XProtocol text file fname. Headers are
+    cached, a file is only read and parsed again if its modification time or
+    size has changed.
 
-        if name.startswith('a'):
-            out = list()
-            for v in value.split():
-                out.append(try_cast(v, name[1:]))
-            value = out
-        else:
-            value = try_cast(value, name)
+    """
+    path = op.abspath(fname)
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
 
-        xprot.update({name: value})
+    with _cache_lock:
+        entry = _cache.get(path)
+        if entry is not None and entry[0] == stamp:
+            _cache.move_to_end(path)
+            return entry[1]
 
-    return xprot
+    with open(path) as f:
+        hdr = XProtHeader(f.read())
+
+    with _cache_lock:
+        _cache[path] = (stamp, hdr)
+        _cache.move_to_end(path)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+    return hdr
 
 
 def parse_xprot_wtc(buffer):
@@ -78,6 +78,7 @@ from matplotlib.lines      import Line2D
 
 # Our modules
 from ice_view.common.constants import DEGREES_TO_RADIANS, RADIANS_TO_DEGREES
+from ice_view.common.decimated_line import DecimatedLine2D
 
 
 
@@ -703,7 +704,7 @@ class PlotPanelPoints(wx.Panel):
     
                 for j, _ in enumerate(data):
                     color = ddict['line_color_real']
-                    axes.plot(xx, data[j,:], color=color, linewidth=width)
+                    axes.add_line(DecimatedLine2D(xx, data[j,:], color=color, linewidth=width))
                     if ddict['markevery']:
                         axes.plot(xx, data[j,:], linestyle='', marker='o', markevery=ddict['markevery'], color=ddict['markevery_color'])
 
@@ -715,9 +716,10 @@ class PlotPanelPoints(wx.Panel):
             # overlay1 line 
             if len(self.overlay1) != data.shape[-1]:
                 self.overlay1 = np.zeros(data.shape[-1])
-            axes.plot(xx, self.overlay1, color=self.prefs.zero_line_plot_color,
-                            linestyle=self.prefs.zero_line_plot_style,
-                            linewidth=width)  
+            axes.add_line(DecimatedLine2D(xx, self.overlay1, 
+                                          color=self.prefs.zero_line_plot_color,
+                                          linestyle=self.prefs.zero_line_plot_style,
+                                          linewidth=width))
 
             # if x-axis has changed, ensure bounds are appropriate
             x0, y0, x1, y1 = axes.dataLim.bounds
@@ -77,6 +77,7 @@ from matplotlib.patches    import Rectangle
 
 # Our modules
 from ice_view.common.constants import DEGREES_TO_RADIANS, RADIANS_TO_DEGREES
+from ice_view.common.decimated_line import DecimatedLine2D
 
 
 
@@ -268,6 +269,21 @@ class PlotPanelSpectrum(wx.Panel):
         self.overlay1         = np.zeros(self.dim0)
         self.show_overlay1    = [False for i in range(naxes)]
 
+        # persistent line artists and x-axis values reused by update_plots(),
+        # and the cached figure background used by blit_plots()
+        self._xaxis_cache     = {}
+        self._lines           = [[] for i in range(naxes)]
+        self._lines_xaxis     = [None for i in range(naxes)]
+        self._background      = None
+        self._background_key  = None
+        self._capturing_background = False
+
+        # phase 1 ramp cached on (dim0, pivot) and per-axes scratch buffers
+        # used by set_phase_0() and set_phase_1() to phase data in place
+        self._phase_ramp      = None
+        self._phase_ramp_key  = None
+        self._phase_buffers   = [{} for i in range(naxes)]
+
         for axis in self.all_axes:
             axis.set_facecolor(self.prefs.bgcolor)
             
@@ -362,6 +378,7 @@ class PlotPanelSpectrum(wx.Panel):
           
         self.do_motion_event = True  
         self.motion_id = self.canvas.mpl_connect('motion_notify_event', self._on_move)
+        self.canvas.mpl_connect('draw_event', self._on_draw)
         
         self.do_scroll_event = do_scroll_event
         if self.do_scroll_event:
@@ -412,10 +429,8 @@ class PlotPanelSpectrum(wx.Panel):
         these options and then do a canvas.plot() call to refresh        
         """
         # take min/max only from first data set, since it will always be there
-        xx = self.all_axes[0].lines[0].get_xdata()
-        xmin = min(xx)
-        xmax = max(xx)
-        ymax = max(np.abs(self.data[0][0]['data'].flatten()))
+        xx, xmin, xmax = self._get_xaxis()
+        ymax = np.abs(self.data[0][0]['data']).max()
         ymin = -ymax
         if ymin == ymax == 0: ymax = 1.0
         self.dataymax = ymax
@@ -448,6 +463,81 @@ class PlotPanelSpectrum(wx.Panel):
             print(a_string)
 
 
+    def _get_xaxis(self):
+        """
+        Returns the x-axis values and their min/max for the current number of
+        points, sweep width and x-axis units. The arrays are cached so that a 
+        refresh with unchanged settings reuses the same array object.
+        
+        """
+        if self.prefs.xaxis_ppm:
+            units = 'ppm'
+        elif self.prefs.xaxis_hertz:
+            units = 'hertz'
+        elif getattr(self.prefs, 'xaxis_sec', False):
+            units = 'sec'
+        else:
+            units = 'points'
+
+        key = (self.dim0, self.sw, self.frequency, self.resppm, units)
+        
+        if key not in self._xaxis_cache:
+            
+            hpp = self.sw / self.dim0
+            xx  = np.arange(self.dim0, dtype='float64')
+    
+            if units == 'ppm':
+                # map to ppm
+                xx = (((0.5 * self.dim0) - xx) * (hpp / self.frequency)) + self.resppm
+            elif units == 'hertz':
+                # find pt value for ppm equal 0.0            
+                pt0 = (0.5 * self.dim0) - (self.frequency * (0.0 - self.resppm) / hpp)
+                # now map to hertz
+                xx = (pt0 - xx) * hpp
+            elif units == 'sec':
+                # map to milliseconds
+                xx = 1000 * xx / self.sw
+
+            # settings only change on user action, keep a handful at most
+            if len(self._xaxis_cache) > 8:
+                self._xaxis_cache.clear()
+            self._xaxis_cache[key] = (xx, xx.min(), xx.max())
+            
+        return self._xaxis_cache[key]
+
+
+    def _on_draw(self, event):
+        """ any full draw not made by blit_plots() may change the background """
+        if not self._capturing_background:
+            self._background = None
+
+
+    def _background_state(self):
+        """ 
+        Returns a tuple describing what is in the cached blit background, if
+        any of these change the background has to be captured again.
+        
+        """
+        state = [tuple(self.figure.bbox.bounds)]
+        for axes in self.axes:
+            state.append((tuple(axes.get_xlim()), 
+                          tuple(axes.get_ylim()), 
+                          axes.xaxis.get_visible(), 
+                          axes.get_xlabel()))
+        return tuple(state)
+
+
+    def _blit_widgets(self):
+        """ returns zoom and reference objects that keep their own background """
+        widgets = []
+        for item in (self.zoom, self.refs):
+            if isinstance(item, list):
+                widgets.extend(item)
+            elif item:
+                widgets.append(item)
+        return widgets
+
+
     def _on_size( self, event ):
         if self._platform_is_gtk:
             # This is a workaround 
@@ -713,9 +803,12 @@ class PlotPanelSpectrum(wx.Panel):
         """
         Sets the data from the saves numpy arrays into the axes.
         
-        Eventually, this will include a step to copy the data into a temp
-        buffer where phase or other actions can be applied without messing
-        up the original data.
+        Line artists are created once and then reused. If the number of lines
+        in an axes is unchanged, the existing Line2D objects are updated with
+        set_ydata() rather than being removed and plotted again. Lines are 
+        always ordered as data lines, zero line, overlay1 line in each axes.
+        Data and overlay lines are DecimatedLine2D objects that only draw a 
+        min/max envelope per pixel of the visible x range.
         
         The only formatting performed here is to ensure that the x-axis
         has proper xmin and xmax set to follow the self.reversex setting
@@ -726,32 +819,16 @@ class PlotPanelSpectrum(wx.Panel):
         else:
             xaxis_sec = self.prefs.xaxis_sec
         
-        # calculate the x-axis values depending on xaxis settings
-        hpp = self.sw / self.dim0
-        xx  = np.arange(self.dim0, dtype='float64')
+        # get the x-axis values depending on xaxis settings
+        xx, xmin, xmax = self._get_xaxis()
 
-        if self.prefs.xaxis_ppm:
-            # map to ppm
-            xx = (((0.5 * self.dim0) - xx) * (hpp / self.frequency)) + self.resppm
+        if self.prefs.xaxis_ppm or self.prefs.xaxis_hertz:
             self.reversex = True
-            
-        elif self.prefs.xaxis_hertz:
-            # find pt value for ppm equal 0.0            
-            pt0 = (0.5 * self.dim0) - (self.frequency * (0.0 - self.resppm) / hpp)
-            # now map to hertz
-            xx = (pt0 - xx) * hpp
-            self.reversex = True
-            
         elif xaxis_sec:
-            # map to milliseconds
-            xx = 1000 * xx / self.sw
             self.reversex = False
 
-        # take min/max only from first axes, since it will always be there
-        ymax = max(np.abs(self.data[0][0]['data'].flatten()))
-        ymin = -ymax
-        xmax = max(xx)
-        xmin = min(xx)
+        if len(self.overlay1) != self.dim0:
+            self.overlay1 = np.zeros(self.dim0)
 
         for i, axes in enumerate(self.all_axes):
 
@@ -761,42 +838,74 @@ class PlotPanelSpectrum(wx.Panel):
             else:
                 old_xmin, old_xmax = axes.get_xlim()
 
-            for item in axes.lines:
-                item.remove()
-
             width  = self.line_width[i]
 
-            dlist = self.data[i]
-            
-            for ddict in dlist:
+            # collect y-values and colors for every line in this axes
+            ydata  = []
+            colors = []
+            for ddict in self.data[i]:
                 
-                data = ddict['data'].copy()
+                data = ddict['data']
                 if self.data_type_summed[i]:
-                    data = np.sum(data, 0)
-                    data.shape = 1,data.shape[0]
+                    data = np.sum(data, 0, keepdims=True)
     
                 for j, _ in enumerate(data):
                     if self.data_type[i] == 'real':
-                        color = ddict['line_color_real']
-                        axes.plot(xx, data[j,:].real, color=color, linewidth=width)
+                        colors.append(ddict['line_color_real'])
+                        ydata.append(data[j,:].real.copy())
                     elif self.data_type[i] == 'imaginary':
-                        color = ddict['line_color_imaginary']
-                        axes.plot(xx, data[j,:].imag, color=color, linewidth=width)    
+                        colors.append(ddict['line_color_imaginary'])
+                        ydata.append(data[j,:].imag.copy())
                     elif self.data_type[i] == 'magnitude':
-                        color = ddict['line_color_magnitude']
-                        axes.plot(xx, np.abs(data[j,:]), color=color, linewidth=width)    
-
-            # zero line 
-            axes.axhline(0, color=self.prefs.zero_line_color,
-                            linestyle=self.prefs.zero_line_style,
-                            linewidth=width)  
-
-            # overlay1 line 
-            if len(self.overlay1) != data.shape[-1]:
-                self.overlay1 = np.zeros(data.shape[-1])
-            axes.plot(xx, self.overlay1, color=self.prefs.zero_line_color,
-                            linestyle=self.prefs.zero_line_style,
-                            linewidth=width)  
+                        colors.append(ddict['line_color_magnitude'])
+                        ydata.append(np.abs(data[j,:]))
+
+            lines = self._lines[i]
+            reuse = len(lines) == len(ydata) + 2 and \
+                    len(axes.lines) == len(lines) and \
+                    all([a is b for a, b in zip(axes.lines, lines)])
+
+            if reuse:
+                newx = self._lines_xaxis[i] is not xx
+                for line, y, color in zip(lines, ydata, colors):
+                    if newx:
+                        line.set_xdata(xx)
+                    line.set_ydata(y)
+                    line.set_color(color)
+                    line.set_linewidth(width)
+
+                # zero line 
+                lines[-2].set_color(self.prefs.zero_line_color)
+                lines[-2].set_linestyle(self.prefs.zero_line_style)
+                lines[-2].set_linewidth(width)
+
+                # overlay1 line 
+                lines[-1].set_data(xx, self.overlay1)
+                lines[-1].set_color(self.prefs.zero_line_color)
+                lines[-1].set_linestyle(self.prefs.zero_line_style)
+                lines[-1].set_linewidth(width)
+                
+            else:
+                for item in list(axes.lines):
+                    item.remove()
+
+                lines = []
+                for y, color in zip(ydata, colors):
+                    lines.append(axes.add_line(DecimatedLine2D(xx, y, color=color, linewidth=width)))
+
+                # zero line 
+                lines.append(axes.axhline(0, color=self.prefs.zero_line_color,
+                                             linestyle=self.prefs.zero_line_style,
+                                             linewidth=width))
+
+                # overlay1 line 
+                lines.append(axes.add_line(DecimatedLine2D(xx, self.overlay1, 
+                                                           color=self.prefs.zero_line_color,
+                                                           linestyle=self.prefs.zero_line_style,
+                                                           linewidth=width)))
+                self._lines[i] = lines
+                
+            self._lines_xaxis[i] = xx
 
             # if x-axis has changed, ensure bounds are appropriate
             x0, y0, x1, y1 = axes.dataLim.bounds
@@ -814,6 +923,65 @@ class PlotPanelSpectrum(wx.Panel):
                     axes.set_xlim(old_xmin,old_xmax)
 
 
+    def blit_plots(self, index=None):
+        """
+        Redraws only the lines in the displayed axes on top of a cached copy
+        of the figure background (axes frames, ticks, labels, cursor spans).
+        Use this in place of canvas.draw() when only the line data changed,
+        e.g. when stepping from voxel to voxel or during interactive phasing.
+        
+        If index is supplied, only the axes at those indices are redrawn.
+        
+        The background is captured with all lines hidden. It is captured
+        again after any full canvas draw, or if the canvas size, axes limits
+        or x-axis labels have changed since it was taken.
+        
+        """
+        captured = False
+        if self._background is None or self._background_key != self._background_state():
+
+            lines   = [line for axes in self.axes for line in axes.lines]
+            visible = [line.get_visible() for line in lines]
+            for line in lines:
+                line.set_visible(False)
+
+            self._capturing_background = True
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    self.canvas.draw()
+                self._background = [self.canvas.copy_from_bbox(axes.bbox.padded(2)) for axes in self.axes]
+                self._background_key = self._background_state()
+            finally:
+                self._capturing_background = False
+                for line, flag in zip(lines, visible):
+                    line.set_visible(flag)
+            captured = True
+
+        if index is None or captured:
+            # full draw above erased all lines, so redraw every axes
+            axes_list = self.axes
+        else:
+            axes_list = [self.all_axes[i] for i in index if self.all_axes[i] in self.axes]
+
+        for axes in axes_list:
+            if not captured:
+                self.canvas.restore_region(self._background[self.axes.index(axes)])
+            for line in axes.lines:
+                axes.draw_artist(line)
+                
+        if index is None or captured:
+            self.canvas.blit(self.figure.bbox)
+        else:
+            for axes in axes_list:
+                self.canvas.blit(axes.bbox.padded(2))
+
+        # zoom and reference spans restore their own copy of the figure while
+        # the mouse is dragged, so refresh it to include the new lines
+        for widget in self._blit_widgets():
+            widget.update_background(None)
+
+
     def get_data(self, index):
         """ Return a copy of one and only one of the data sets. """
         if index < 0 or index >= self.naxes:
@@ -828,10 +996,7 @@ class PlotPanelSpectrum(wx.Panel):
         if index < 0 or index >= self.naxes:
             return None
         else:
-            axes = self.all_axes[index]
-            dim0 = self.dim0
-            piv = (dim0 / 2) - (self.frequency * (self.pivot - self.resppm) / (self.sw / dim0))
-            arr1 = (np.arange(dim0) - piv) / dim0
+            arr1 = self._get_phase_ramp()
 
             phase0 = self.phase0[index] * DEGREES_TO_RADIANS
             phase1 = self.phase1[index] * DEGREES_TO_RADIANS
@@ -871,9 +1036,7 @@ class PlotPanelSpectrum(wx.Panel):
         else:
             xaxis_sec = self.prefs.xaxis_sec
         
-        xx = self.all_axes[0].lines[0].get_xdata()
-        xmin = min(xx)
-        xmax = max(xx)
+        xx, xmin, xmax = self._get_xaxis()
         ymax = self.vertical_scale 
         ymin = -ymax
 
@@ -1018,10 +1181,6 @@ class PlotPanelSpectrum(wx.Panel):
     
     def set_phase_0(self, delta, index=None, absolute=False, no_draw=False):
 
-        dim0   = self.dim0
-        piv    = (dim0 / 2) - (self.frequency * (self.pivot - self.resppm) / (self.sw/dim0))
-        arr1   = (np.arange(dim0) - piv) / dim0
-        
         if index is None:
             if not absolute:
                 self.phase0 = [delta+val for val in self.phase0]
@@ -1029,86 +1188,31 @@ class PlotPanelSpectrum(wx.Panel):
                 self.phase0 = [delta for val in self.phase0] 
                 
             self.phase0 = [item % 360 for item in self.phase0]
-
+            
             # apply to all plots
-            for i,axes in enumerate(self.all_axes):
-    
-                phase0 = self.phase0[i] * DEGREES_TO_RADIANS
-                phase1 = self.phase1[i] * DEGREES_TO_RADIANS 
-                phase1 = phase1 * arr1
-                phase  = np.exp(1j * (phase0 + phase1))
-
-                dlist = self.data[i]
-                iline = 0
-                for ddict in dlist:
-                    dat = ddict['data'].copy()
-                    if self.data_type_summed[i]:
-                        dat = np.sum(dat,0)
-                        dat.shape = 1,dat.shape[0]
-                    dat *= phase
-        
-                    if self.data_type[i] == 'real':
-                        for j, _ in enumerate(dat):
-                            axes.lines[iline].set_ydata(dat[j,:].real)
-                            iline += 1    
-                    elif self.data_type[i] == 'imaginary':
-                        for j, _ in enumerate(dat):
-                            axes.lines[iline].set_ydata(dat[j,:].imag)
-                            iline += 1     
-                    elif self.data_type[i] == 'magnitude':
-                        for j, _ in enumerate(dat):
-                            axes.lines[iline].set_ydata(np.abs(dat[j,:]))
-                            iline += 1 
+            indices = list(range(len(self.all_axes)))
                     
         else:
+            indices = []
             for indx in index:
                 if indx >=0 and indx < self.naxes:
                     if not absolute:
                         self.phase0[indx] += delta
                     else:
                         self.phase0[indx] = delta
-    
-                    axes = self.all_axes[indx]
-    
-                    phase0 = self.phase0[indx] * DEGREES_TO_RADIANS
-                    phase1 = self.phase1[indx] * DEGREES_TO_RADIANS 
-                    phase1 = phase1 * arr1
-                    phase  = np.exp(1j * (phase0 + phase1))
-        
-                    dlist =  self.data[indx]
-                    iline = 0
-                    for ddict in dlist: 
-                        dat = ddict['data'] .copy()
-                        if self.data_type_summed[indx]:
-                            dat = np.sum(dat,0)
-                            dat.shape = 1,dat.shape[0]
-                        dat *= phase
-
-                        if self.data_type[indx] == 'real':
-                            for j, _ in enumerate(dat):
-                                axes.lines[iline].set_ydata(dat[j,:].real)
-                                iline += 1    
-                        elif self.data_type[indx] == 'imaginary':
-                            for j, _ in enumerate(dat):
-                                axes.lines[iline].set_ydata(dat[j,:].imag) 
-                                iline += 1    
-                        elif self.data_type[indx] == 'magnitude':
-                            for j, _ in enumerate(dat):
-                                axes.lines[iline].set_ydata(np.abs(dat[j,:])) 
-                                iline += 1
+                    indices.append(indx)
+
+        for indx in indices:
+            self._apply_phase(indx)
         
         if not no_draw:
-            self.canvas.draw()
+            self.blit_plots(index=None if index is None else indices)
                 
         return self.phase0
 
 
     def set_phase_1(self, delta, index=None, absolute=False, no_draw=False):
 
-        dim0   = self.dim0
-        piv    = (dim0 / 2) - (self.frequency * (self.pivot - self.resppm) / (self.sw/dim0))
-        arr1   = (np.arange(dim0) - piv) / dim0
-        
         if index is None:
             if not absolute:
                 self.phase1 = [delta+val for val in self.phase1]
@@ -1116,77 +1220,96 @@ class PlotPanelSpectrum(wx.Panel):
                 self.phase1 = [delta for val in self.phase1]
 
             # apply to all plots
-            for i,axes in enumerate(self.all_axes):
-                     
-                phase0 = self.phase0[i] * DEGREES_TO_RADIANS
-                phase1 = self.phase1[i] * DEGREES_TO_RADIANS 
-                phase1 = phase1 * arr1
-                phase  = np.exp(1j * (phase0 + phase1))
-
-                dlist = self.data[i]
-                iline = 0
-                for ddict in dlist:
-                    dat =  ddict['data'].copy() 
-                    if self.data_type_summed[i]:
-                        dat = np.sum(dat,0)
-                        dat.shape = 1,dat.shape[0]
-                    dat *= phase
-        
-                    if self.data_type[i] == 'real':
-                        for j, _ in enumerate(dat):
-                            axes.lines[iline].set_ydata(dat[j,:].real)
-                            iline += 1    
-                    elif self.data_type[i] == 'imaginary':
-                        for j, _ in enumerate(dat):
-                            axes.lines[iline].set_ydata(dat[j,:].imag)  
-                            iline += 1   
-                    elif self.data_type[i] == 'magnitude':
-                        for j, _ in enumerate(dat):
-                            axes.lines[iline].set_ydata(np.abs(dat[j,:])) 
-                            iline += 1
+            indices = list(range(len(self.all_axes)))
+            
         else:
+            indices = []
             for indx in index:
                 if indx >=0 and indx < self.naxes:
                     if not absolute:
                         self.phase1[indx] += delta
                     else:
                         self.phase1[indx] = delta
-    
-                    axes = self.all_axes[indx]
-    
-                    phase0 = self.phase0[indx] * DEGREES_TO_RADIANS
-                    phase1 = self.phase1[indx] * DEGREES_TO_RADIANS 
-                    phase1 = phase1 * arr1
-                    phase  = np.exp(1j * (phase0 + phase1))
-        
-                    dlist = self.data[indx]
-                    iline = 0
-                    for ddict in dlist:
-                        dat =  ddict['data'].copy()
-                        if self.data_type_summed[indx]:
-                            dat = np.sum(dat,0)
-                            dat.shape = 1,dat.shape[0]
-                        dat *= phase
-            
-                        if self.data_type[indx] == 'real':
-                            for j, _ in enumerate(dat):
-                                axes.lines[iline].set_ydata(dat[j,:].real)   
-                                iline += 1 
-                        elif self.data_type[indx] == 'imaginary':
-                            for j, _ in enumerate(dat):
-                                axes.lines[iline].set_ydata(dat[j,:].imag) 
-                                iline += 1    
-                        elif self.data_type[indx] == 'magnitude':
-                            for j, _ in enumerate(dat):
-                                axes.lines[iline].set_ydata(np.abs(dat[j,:]))
-                                iline += 1
+                    indices.append(indx)
+
+        for indx in indices:
+            self._apply_phase(indx)
                     
         if not no_draw:
-            self.canvas.draw()
+            self.blit_plots(index=None if index is None else indices)
         
         return self.phase1
 
 
+    def _get_phase_ramp(self):
+        """ Returns the phase 1 ramp, only recalculated if dim0 or pivot change """
+        dim0 = self.dim0
+        piv  = (dim0 / 2) - (self.frequency * (self.pivot - self.resppm) / (self.sw/dim0))
+        if self._phase_ramp_key != (dim0, piv):
+            self._phase_ramp = (np.arange(dim0) - piv) / dim0
+            self._phase_ramp_key = (dim0, piv)
+        return self._phase_ramp
+
+
+    def _apply_phase(self, index):
+        """
+        Applies phase0/1 for one axes to its data and sets the results into the
+        existing line artists. The phase vector, the phased complex data and 
+        the real/imag/magnitude values are all computed in place in scratch
+        buffers kept for each axes, so repeated calls during interactive 
+        phasing do not allocate new arrays. Summed data is only re-summed if 
+        the data array has been replaced.
+        
+        """
+        axes    = self.all_axes[index]
+        buffers = self._phase_buffers[index]
+        ramp    = self._get_phase_ramp()
+
+        if 'phase' not in buffers or len(buffers['phase']) != len(ramp):
+            buffers['angle'] = np.empty(len(ramp))
+            buffers['phase'] = np.empty(len(ramp), dtype=complex)
+        angle = buffers['angle']
+        phase = buffers['phase']
+
+        np.multiply(ramp, self.phase1[index] * DEGREES_TO_RADIANS, out=angle)
+        angle += self.phase0[index] * DEGREES_TO_RADIANS
+        np.cos(angle, out=phase.real)
+        np.sin(angle, out=phase.imag)
+
+        data_type = self.data_type[index]
+        iline = 0
+        for k, ddict in enumerate(self.data[index]):
+            dat = ddict['data']
+            
+            if self.data_type_summed[index]:
+                src, summed = buffers.get(('sum', k), (None, None))
+                if src is not dat:
+                    summed = np.sum(dat, 0, keepdims=True)
+                    buffers[('sum', k)] = (dat, summed)
+                dat = summed
+
+            work, out = buffers.get(k, (None, None))
+            if work is None or work.shape != dat.shape or work.dtype != np.result_type(dat.dtype, np.complex64):
+                work = np.empty(dat.shape, dtype=np.result_type(dat.dtype, np.complex64))
+                out  = np.empty(dat.shape, dtype=work.real.dtype)
+                buffers[k] = (work, out)
+            
+            np.multiply(dat, phase, out=work)
+
+            if data_type == 'real':
+                np.copyto(out, work.real)
+            elif data_type == 'imaginary':
+                np.copyto(out, work.imag)
+            elif data_type == 'magnitude':
+                np.abs(work, out=out)
+            else:
+                continue
+            
+            for j in range(out.shape[0]):
+                axes.lines[iline].set_ydata(out[j,:])
+                iline += 1
+
+
     def set_overlay1(self, value):
         if len(value) == self.dim0:
             self.overlay1 = value
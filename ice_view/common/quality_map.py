@@ -0,0 +1,249 @@
+"""
+QualityMap calculates spectral quality measures for every voxel of a CSI
+data set:
+
+  - fwhm   - full width at half maximum of the largest peak in a range of
+             points, in Hz, interpolated between points
+  - peak   - height of that peak
+  - noise  - RMS (standard deviation) of the spectrum over a noise range
+  - snr    - peak / noise
+
+As in IntegralMap, the phase 0 and phase 1 of each voxel are applied to the
+complex data before the real, imaginary or magnitude spectrum is measured,
+so results are for the spectrum as displayed. Results are kept for all
+voxels. Changing the ranges or data type recalculates all of them, in chunks
+of voxels, while a data or phase change in one voxel only recalculates that
+voxel.
+
+full_width_half_max_all() is a vectorized full_width_half_max() (see
+util_generic_spectral) for many spectra at once.
+
+"""
+
+# Python modules
+
+
+# 3rd party modules
+import numpy as np
+
+
+# Our modules
+from ice_view.common.constants import DEGREES_TO_RADIANS
+
+
+
+# number of voxels processed at a time when (re)calculating results
+CHUNK_VOXELS = 256
+
+MAP_TYPES  = ['fwhm', 'peak', 'noise', 'snr']
+DATA_TYPES = ['real', 'imaginary', 'magnitude']
+
+# default noise range in ppm, and the fewest points in a noise range, with
+# fewer (e.g. the default range is outside a narrow sweep width) the first
+# 1/16th of the spectrum is used instead
+DEFAULT_NOISE_PPM = (9.0, 10.0)
+MIN_NOISE_POINTS  = 8
+
+
+
+def full_width_half_max_all(data, start=0, end=None, minfloor=False, interpolate=True):
+    """
+    Finds the maximum of each row of data within points [start, end), then
+    the points at half its amplitude to the left and right of it anywhere in
+    the row. Returns the widths (in points), and peak heights and indices.
+
+    With interpolate=False, widths are the same as full_width_half_max() for
+    each row, the distance between the first points below half max. With
+    interpolate=True, the half max crossings are linearly interpolated
+    between the points on either side of them. A peak with no crossing on a
+    side is measured to the end of the row.
+
+    """
+    data = np.asarray(data).real
+    nspec, npts = data.shape
+    end = npts if end is None else end
+
+    rows = np.arange(nspec)
+    idx  = np.arange(npts)
+    peak_index = start + np.argmax(data[:,start:end], axis=1)
+    peak = data[rows, peak_index]
+
+    if minfloor:
+        floor = np.min(data, axis=1)
+        floor = np.where(floor > 0, floor, 0)
+    else:
+        floor = 0.0
+    half_peak = peak - ((peak-floor)/2.0)
+
+    below = data < half_peak[:,np.newaxis]
+
+    # first point below half max right of the peak, last one left of it
+    mask  = below & (idx > peak_index[:,np.newaxis])
+    has_r = mask.any(axis=1)
+    right = np.where(has_r, np.argmax(mask, axis=1), npts-1)
+
+    mask  = below & (idx < peak_index[:,np.newaxis])
+    has_l = mask.any(axis=1)
+    left  = np.where(has_l, npts-1-np.argmax(mask[:,::-1], axis=1), 0)
+
+    if interpolate:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            d1 = data[rows, np.maximum(right-1, 0)]
+            d2 = data[rows, right]
+            right = np.where(has_r, right - 1 + (d1-half_peak)/(d1-d2), right)
+            d1 = data[rows, left]
+            d2 = data[rows, np.minimum(left+1, npts-1)]
+            left = np.where(has_l, left + (half_peak-d1)/(d2-d1), left)
+
+    width = right - left
+
+    # peak below floor, full_width_half_max() does not move from the peak
+    width = np.where(peak >= half_peak, width, 0)
+
+    return width, peak, peak_index
+
+
+
+class QualityMap(object):
+    """
+    Quality measures and per voxel phases for a spectral data set.
+
+    data     - complex ndarray, shape (..., dim0), spectral dim last
+    phase_0  - ndarray in degrees, shape data.shape[:-1]
+    phase_1  - ndarray in degrees, shape data.shape[:-1]
+    pivot    - phase 1 pivot location, in points
+    hpp      - Hz per point, to convert widths to Hz
+
+    """
+    def __init__(self, data, phase_0, phase_1, pivot, hpp):
+
+        data = np.asarray(data)
+
+        self.shape = data.shape[:-1]
+        self.dim0  = data.shape[-1]
+        self.hpp   = hpp
+
+        nvox = int(np.prod(self.shape))
+
+        self._data     = data.reshape(nvox, self.dim0)
+        self._phase_0  = np.array(np.ravel(phase_0), dtype=float)
+        self._phase_1  = np.array(np.ravel(phase_1), dtype=float)
+        self._pivot    = pivot
+
+        # ranges and data type the results were calculated for
+        self._params = None
+
+        self._fwhm  = np.zeros(nvox)
+        self._peak  = np.zeros(nvox)
+        self._noise = np.zeros(nvox)
+
+
+    def set_phases(self, phase_0, phase_1, pivot=None):
+        """
+        Sets phase 0 and phase 1 for all voxels. Only voxels whose phases
+        changed are recalculated, unless the pivot changed.
+
+        """
+        phase_0 = np.ravel(phase_0)
+        phase_1 = np.ravel(phase_1)
+
+        if pivot is not None and pivot != self._pivot:
+            self._pivot = pivot
+            rows = np.arange(len(phase_1))
+        else:
+            rows = np.nonzero((phase_0 != self._phase_0) | (phase_1 != self._phase_1))[0]
+
+        self._phase_0[:] = phase_0
+        self._phase_1[:] = phase_1
+        if len(rows) and self._params is not None:
+            self._update_rows(rows)
+
+
+    def update_voxel(self, index, data=None, phase_0=None, phase_1=None):
+        """
+        Updates one voxel, index is a tuple into self.shape. If data is given
+        it replaces the spectrum for that voxel.
+
+        """
+        row = np.ravel_multi_index(index, self.shape)
+
+        if data is not None:
+            self._data[row,:] = data
+        if phase_0 is not None:
+            self._phase_0[row] = phase_0
+        if phase_1 is not None:
+            self._phase_1[row] = phase_1
+
+        if self._params is not None:
+            self._update_rows(np.array([row]))
+
+
+    def get_map(self, map_type, start, end, noise_start, noise_end, data_type='real'):
+        """
+        Returns one of MAP_TYPES for all voxels as an ndarray of shape
+        self.shape. The peak is searched for in points [start, end) and the
+        noise is measured over points [noise_start, noise_end).
+
+        """
+        if map_type not in MAP_TYPES:
+            raise ValueError("map_type must be one of %s" % str(MAP_TYPES))
+        if data_type not in DATA_TYPES:
+            raise ValueError("data_type must be one of %s" % str(DATA_TYPES))
+
+        start, end = self._clip_range(start, end)
+        noise_start, noise_end = self._clip_range(noise_start, noise_end)
+        if noise_end - noise_start < MIN_NOISE_POINTS:
+            noise_start, noise_end = 0, max(self.dim0 // 16, MIN_NOISE_POINTS)
+
+        params = (start, end, noise_start, noise_end, data_type)
+        if params != self._params:
+            self._params = params
+            self._update_rows(np.arange(len(self._fwhm)))
+
+        if map_type == 'fwhm':
+            result = self._fwhm * self.hpp
+        elif map_type == 'peak':
+            result = self._peak.copy()
+        elif map_type == 'noise':
+            result = self._noise.copy()
+        else:
+            result = np.divide(self._peak, self._noise, out=np.zeros(len(self._peak)),
+                               where=self._noise > 0)
+
+        return result.reshape(self.shape)
+
+
+    def _clip_range(self, start, end):
+        if start > end:
+            start, end = end, start
+        start = int(np.clip(start, 0, self.dim0))
+        end   = int(np.clip(end,   0, self.dim0))
+        if end == start:
+            end = min(start+1, self.dim0)
+            start = end-1
+        return start, end
+
+
+    def _update_rows(self, rows):
+        """ Recalculates the results for the given voxel rows """
+
+        start, end, noise_start, noise_end, data_type = self._params
+
+        ramp = (np.arange(self.dim0) - self._pivot) / self.dim0
+
+        for i in range(0, len(rows), CHUNK_VOXELS):
+            chunk = rows[i:i+CHUNK_VOXELS]
+            data  = self._data[chunk,:]
+
+            if data_type == 'magnitude':
+                data = np.abs(data)
+            else:
+                angle = np.outer(self._phase_1[chunk], ramp) + self._phase_0[chunk][:,np.newaxis]
+                data  = data * np.exp(1j * angle * DEGREES_TO_RADIANS)
+                data  = data.real if data_type == 'real' else data.imag
+
+            width, peak, _ = full_width_half_max_all(data, start, end)
+
+            self._fwhm[chunk]  = width
+            self._peak[chunk]  = peak
+            self._noise[chunk] = np.std(data[:,noise_start:noise_end], axis=1)
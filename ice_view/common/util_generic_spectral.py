@@ -1,6 +1,7 @@
 # Python modules
 
 import math
+import functools
 
 # 3rd party modules
 import numpy as np
@@ -403,27 +404,36 @@ def full_width_half_max(data, minfloor=False, positive=False):
 
 
 def voigt_width( ta, tb, dataset, hzres=0.1 ):
+    """
+    Returns the FWHM in Hz of a Voigt lineshape with Lorentzian decay ta and
+    Gaussian decay tb, and the inverse of its peak height. Results are
+    cached on the lineshape and dataset parameters, see _voigt_width().
+
+    """
+    return _voigt_width(float(ta), float(tb), dataset.sw, dataset.raw_dims[0],
+                        dataset.zero_fill_multiplier, dataset.echopeak, hzres)
+
+
+@functools.lru_cache(maxsize=256)
+def _voigt_width(ta, tb, sw, npts, zfmult, echopeak, hzres):
 
     if hzres < 0.01:
         hzres = 0.1
 
-    zfmult = dataset.zero_fill_multiplier
-
     # Calc zerofill needed for < hzres Hz per point
-    hpp  = dataset.raw_hpp / zfmult
+    hpp  = (sw / npts) / zfmult
     mult = 1
     while hpp >= hzres:
        hpp  = hpp  / 2.0
        mult = mult * 2.0
 
-    npts    = dataset.raw_dims[0]
     nptszf1 = npts * zfmult * mult
     nptszf2 = npts * zfmult
     f1      = np.zeros(int(nptszf1), complex)
     f2      = np.zeros(int(nptszf2), complex)
 
-    td      = 1.0/dataset.sw
-    off     = round(1.0 * npts * dataset.echopeak/100.0) * td
+    td      = 1.0/sw
+    off     = round(1.0 * npts * echopeak/100.0) * td
     t       = np.arange(npts) * td              # for T2, always decreases with time
     ta      = ta if ta > 0.00001 else 0.00001       # Ta > 0
     tb      = tb if tb > 0.00001 else 0.00001       # Tb > 0
@@ -443,7 +453,7 @@ def voigt_width( ta, tb, dataset, hzres=0.1 ):
     f2 = np.fft.fft(f2) / nptszf2
 
     widpts = full_width_half_max(f1.real)
-    peak_width = widpts * dataset.sw / nptszf1
+    peak_width = widpts * sw / nptszf1
 
     peak_norm = np.max(f2.real)
     peak_norm = 1.0/peak_norm
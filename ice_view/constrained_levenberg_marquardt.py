@@ -11,11 +11,18 @@
 
 # 3rd party modules
 import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+
+
+# constrained_levenberg_marquardt_multi() fits this many voxels at a time, the
+# forward difference stack is CHUNK_VOXELS * (NTERMS+1) function evaluations
+CHUNK_VOXELS = 256
 
 
 def constrained_levenberg_marquardt(y, w, a, limits, function=None, 
                                                      itmax=50, 
-                                                     tol=1.e-3):
+                                                     tol=1.e-3,
+                                                     batched=False):
     '''
     =========
     Arguments 
@@ -58,6 +65,12 @@ def constrained_levenberg_marquardt(y, w, a, limits, function=None,
       decrease in chi-squared is less than TOL in an iteration. Default 
       is 1.0e-3.
 
+    **batched:**  [keyword][boolean][default=False]
+
+      if True, 'function' evaluates a stack of parameter vectors in one call,
+      see RESTRICTIONS below. The forward difference derivatives then take
+      one call per iteration rather than one per parameter.
+
     =========
     Outputs 
     =========
@@ -137,6 +150,12 @@ def constrained_levenberg_marquardt(y, w, a, limits, function=None,
 
     Note. pder can be returned as None, in which case the forward difference
           approximation will be calculated by constrained_levenberg_marquardt()
+
+    If batched=True, 'a' is instead a 2D array of parameter vectors, shape
+    (NSETS, NTERMS), and f must be returned as an (NSETS, NPOINT) array with
+    one function evaluation per row. pder is not used, return None. For the
+    derivatives the routine passes NTERMS+1 rows, the current parameters and
+    each one with a single parameter incremented. See gfunct_batched().
           
     
     ======    
@@ -176,10 +195,20 @@ def constrained_levenberg_marquardt(y, w, a, limits, function=None,
     if nfree <= 0: 
         raise ValueError( "constrained_levenberg_marquardt error - not enough degrees of freedom = %s " % str(nfree))
 
-    flambda = 0.001                 # Initial lambda
+    def evaluate(params):
+        # returns f for one parameter vector, made real if need be
+        if batched:
+            yfit, pder = function(params[np.newaxis,:])
+            yfit = yfit[0]
+        else:
+            yfit, pder = function(params)
+        if complex_flag:
+            yfit = np.concatenate([yfit.real, yfit.imag])
+            if pder is not None:
+                pder = np.concatenate([pder.real, pder.imag], axis=1)
+        return yfit, pder
 
-    #Define the partial derivative array ---
-    pder = np.zeros((np.size(y), nterms), float)
+    flambda = 0.001                 # Initial lambda
 
     inc = eps * np.abs(a) 
     badfit = False
@@ -207,87 +236,72 @@ def constrained_levenberg_marquardt(y, w, a, limits, function=None,
                 a[no_zero[indxt]]   = limits[1,no_zero[indxt]] * (1.0-eps)
                 inc[no_zero[indxt]] = limits[1,no_zero[indxt]] * eps
 
-            yfit, pder1 = function(a)
-            if complex_flag:    
-                yfit = np.concatenate([yfit.real, yfit.imag])
-                if pder1 != None:
-                    pder1 = np.concatenate([pder1.real, pder1.imag], axis=1)
-
-            if pder1 == None:
+        if batched:
+            # current parameters plus one forward step per term, one call
+            p = np.tile(a, (nterms+1, 1))
+            p[1:][np.diag_indices(nterms)] += inc
+            yfits, _ = function(p)
+            if complex_flag:
+                yfits = np.concatenate([yfits.real, yfits.imag], axis=1)
+            yfit  = yfits[0]
+            pder1 = ((yfits[1:] - yfit) / inc[:,np.newaxis]).T
+            numeric = True
+        else:
+            yfit, pder1 = evaluate(a)
+            numeric = pder1 is None
+            if numeric:
+                pder1 = np.zeros((np.size(y), nterms), float)
                 for term in range(nterms):
                     # Copy current parameters ---
                     p = a.copy()
-    
-                    # Increment size for forward difference derivative ---
-                    p[term] = p[term] + inc[term]
-                    yfit1, _ = function(p)
-                    if complex_flag:    
-                        yfit1 = np.concatenate([yfit1.real, yfit1.imag])
-                    pder[:,term] = (yfit1-yfit)/inc[term]
-    
-                    # Try to set difference to 1e-5 for next iteration ---
-                    inc[term] = np.size(y)*1e-5/np.sum(abs(pder[:,term]))
-                pder1 = pder
-            else:
-                pder1 = pder1.T
 
-
-        else:  # no constraints applied
-            yfit, pder1 = function(a)
-            if complex_flag:    
-                yfit = np.concatenate([yfit.real, yfit.imag])
-                if pder1 != None:
-                    pder1 = np.concatenate([pder1.real, pder1.imag], axis=1)
-
-            if pder1 == None:
-                for term in range(nterms):
-                    # Copy current parameters ---
-                    p = a.copy()
-    
                     # Increment size for forward difference derivative ---
                     p[term] = p[term] + inc[term]
-                    yfit1, _ = function(p)
-                    if complex_flag:    
-                        yfit1 = np.concatenate([yfit1.real, yfit1.imag])
-                    pder[:,term] = (yfit1-yfit)/inc[term]
-                
-                    # Try to set difference to 1e-5 for next iteration ---
-                    inc[term] = np.size(y)*1e-5/np.sum(abs(pder1[:,term]))
-                pder1 = pder
+                    yfit1, _ = evaluate(p)
+                    pder1[:,term] = (yfit1-yfit)/inc[term]
             else:
                 pder1 = pder1.T
 
-        beta   = np.dot((y-yfit)*w, pder1) 
-        alpha  = np.dot(pder1.transpose(), np.outer(w, np.zeros(nterms,float)+1) * pder1)
+        if numeric:
+            # Try to set difference to 1e-5 for next iteration ---
+            inc = np.size(y)*1e-5/np.sum(np.abs(pder1), axis=0)
+
+        wdiff  = (y-yfit)*w
+        beta   = np.dot(wdiff, pder1)
+        alpha  = np.dot(pder1.T, w[:,np.newaxis] * pder1)
         chisq1 = np.sum(w*(y-yfit)**2)/nfree # Present chi squared.
 
         bs = 0
 
-        # Invert modified curvature matrix to find new parameters. ---
+        # Solve modified curvature matrix for new parameters. ---
+        # The matrix is scaled by sqrt(diagonal), which we then apply to
+        # beta and the step rather than forming and inverting alpha/c.
+        scale = np.sqrt(alpha.diagonal())
         while True:
-            c = np.sqrt(np.outer(alpha.diagonal(), alpha.diagonal())) 
-
-            arr = alpha/c
-            arr = arr + flambda * arr * np.diag(np.zeros(len(arr))+1)
+            arr = alpha / np.outer(scale, scale)
+            arr[np.diag_indices(nterms)] *= (1.0 + flambda)
             try:
-                arr = np.linalg.inv(arr)
+                factor = cho_factor(arr, check_finite=False)
+                step = cho_solve(factor, beta/scale, check_finite=False) / scale
             except np.linalg.LinAlgError:
-                badfit = True
-                chisqr = np.NAN
-                break
-
+                # not positive definite, e.g. negative weights, try inverse
+                factor = None
+                try:
+                    step = np.dot(np.linalg.inv(arr) / np.outer(scale, scale), beta)
+                except np.linalg.LinAlgError:
+                    badfit = True
+                    chisqr = np.nan
+                    break
 
             # Calculate new parameters ---
-            b = a + np.dot(arr/c, np.transpose(beta))
+            b = a + step
 
             # Check for and set any constraints ---
             if count_no_zero > 0:
                 b[no_zero] = np.where(b[no_zero] < limits[1,no_zero], b[no_zero], limits[1,no_zero])
                 b[no_zero] = np.where(b[no_zero] > limits[0,no_zero], b[no_zero], limits[0,no_zero])
 
-            yfit, pder1 = function(b)
-            if complex_flag:    
-                yfit = np.concatenate([yfit.real, yfit.imag])
+            yfit, _ = evaluate(b)
             chisqr  = np.sum(w*(y-yfit)**2)/nfree     # New chisqr
             flambda = flambda*10.0                    # Assume fit got worse
 
@@ -312,12 +326,20 @@ def constrained_levenberg_marquardt(y, w, a, limits, function=None,
 
         if (chisq1-chisqr)/chisq1 <= tol: break
 
-    sigmaa = np.sqrt(arr.diagonal()/alpha.diagonal())   # Return sigma's
+    # diagonal of the inverse of the last curvature matrix tried
+    if factor is not None:
+        arr_inv = cho_solve(factor, np.eye(nterms), check_finite=False)
+    else:
+        try:
+            arr_inv = np.linalg.inv(arr)
+        except np.linalg.LinAlgError:
+            arr_inv = arr
+    sigmaa = np.sqrt(arr_inv.diagonal()/alpha.diagonal())   # Return sigma's
     wchi2  = chisqr                             # Return weighted chi squared
     chi2   = np.sum((y-yfit)**2)/nfree          # Return chi squared
     
     if complex_flag:
-        dim0 = len(yfit)/2
+        dim0 = len(yfit)//2
         yfit = yfit[0:dim0] + 1j * yfit[dim0:2*dim0]  # Convert to complex array
 
     #print( 'final a = ' + str(a)+' chi2,badfit ='+str(chi2)+' '+str(badfit))
@@ -325,6 +347,272 @@ def constrained_levenberg_marquardt(y, w, a, limits, function=None,
     return yfit, a, sigmaa, chi2, wchi2, badfit # Return result
 
 
+def constrained_levenberg_marquardt_multi(y, w, a, limits, function=None,
+                                                           itmax=50,
+                                                           tol=1.e-3,
+                                                           chunk=CHUNK_VOXELS):
+    '''
+    Fits many independent data sets (e.g. the voxels of a CSI data set) with
+    the same model and limits. Each voxel follows the same iterations as a
+    constrained_levenberg_marquardt() call would, with its own lambda, step
+    count and convergence test, but the iterations of all voxels advance
+    together on stacked arrays and the model is called once per round for all
+    of them. Voxels that converged or failed leave the active set.
+
+    =========
+    Arguments 
+    =========
+    **y:**  [array 2D][float or complex]
+
+      Data, shape (NVOX, NPOINT), one row per voxel
+
+    **w:**  [array][float]
+
+      Weights, shape (NPOINT,) to use the same for all voxels, or (NVOX, NPOINT)
+
+    **a:**  [array 2D][float]
+
+      Initial parameter estimates, shape (NVOX, NTERMS). Not changed.
+
+    **limits:**  [array 2D][float]
+
+      Array 2 x NTERMS of min and max limits, as for constrained_levenberg_marquardt()
+
+    **function:**  [keyword][object][default=None]
+
+      the model, called as for constrained_levenberg_marquardt(batched=True),
+
+        f, pder = function(p)
+
+      where p is (NSETS, NTERMS) and f is (NSETS, NPOINT). pder is None for
+      forward difference derivatives, or (NSETS, NTERMS, NPOINT) partial
+      derivatives. Rows of p belong to different voxels.
+
+    **itmax, tol:**  as for constrained_levenberg_marquardt()
+
+    **chunk:**  [keyword][integer][default=CHUNK_VOXELS]
+
+      number of voxels fitted together, limits the memory used
+
+    =========
+    Outputs 
+    =========
+
+    yfit (NVOX, NPOINT), a (NVOX, NTERMS), sigmaa (NVOX, NTERMS), chi2 (NVOX,),
+    wchi2 (NVOX,) and badfit (NVOX,) with the per voxel values returned by
+    constrained_levenberg_marquardt()
+
+    '''
+    y = np.asarray(y)
+    a = np.array(a, dtype=float)
+
+    complex_flag = np.iscomplexobj(y)
+    w = np.broadcast_to(np.asarray(w, dtype=float), y.shape)
+    if complex_flag:
+        y = np.concatenate([y.real, y.imag], axis=1)
+        w = np.concatenate([w, w], axis=1)
+
+    nvox, nterms = a.shape
+    nfree = y.shape[1]-nterms       # Degrees of freedom
+
+    if nfree <= 0: 
+        raise ValueError( "constrained_levenberg_marquardt_multi error - not enough degrees of freedom = %s " % str(nfree))
+
+    # order limits [lowerlimit,upperlimit]
+    limits = np.array([np.where(limits[0,:] < limits[1,:], limits[0,:], limits[1,:]), 
+                       np.where(limits[0,:] > limits[1,:], limits[0,:], limits[1,:])])
+    no_zero = np.where( (limits[0,:] != 0) + (limits[1,:] != 0) )[0]
+
+    # one small call to find out if the model returns derivatives
+    analytic = nvox > 0 and function(a[:1].copy())[1] is not None
+
+    yfit   = np.zeros(y.shape)
+    sigmaa = np.zeros((nvox, nterms))
+    chi2   = np.zeros(nvox)
+    wchi2  = np.zeros(nvox)
+    badfit = np.zeros(nvox, bool)
+
+    for i in range(0, nvox, chunk):
+        sl = slice(i, i+chunk)
+        yfit[sl], a[sl], sigmaa[sl], chi2[sl], wchi2[sl], badfit[sl] = \
+            _clm_chunk(y[sl], w[sl], a[sl], limits, no_zero, nfree, function, 
+                       itmax, tol, complex_flag, analytic)
+
+    if complex_flag:
+        dim0 = yfit.shape[1]//2
+        yfit = yfit[:,0:dim0] + 1j * yfit[:,dim0:2*dim0]
+
+    return yfit, a, sigmaa, chi2, wchi2, badfit
+
+
+
+def _clm_chunk(y, w, a, limits, no_zero, nfree, function, itmax, tol, 
+               complex_flag, analytic):
+    """
+    constrained_levenberg_marquardt() for a stack of voxels. Each round, a
+    voxel either needs the model and derivatives at its parameters 'a'
+    (jacobian True) or the model at its trial parameters 'b' (jacobian False).
+    All of these are evaluated in one call to function().
+
+    """
+    nvox, nterms = a.shape
+    eps  = np.sqrt(np.finfo(np.float64).eps)
+    diag = np.diag_indices(nterms)
+    nrow = 1 if analytic else nterms+1
+
+    lo = limits[0,no_zero]
+    hi = limits[1,no_zero]
+
+    inc      = eps * np.abs(a)
+    flambda  = np.full(nvox, 0.001)     # Initial lambda
+    niter    = np.ones(nvox, int)
+    nkick    = np.zeros(nvox, int)      # curvature matrix tries this iteration
+    badfit   = np.zeros(nvox, bool)
+    active   = np.ones(nvox, bool)
+    jacobian = np.ones(nvox, bool)
+
+    b      = a.copy()
+    yfit   = np.zeros(y.shape)
+    chisq1 = np.zeros(nvox)
+    chisqr = np.zeros(nvox)
+    beta   = np.zeros((nvox, nterms))
+    scale  = np.ones((nvox, nterms))
+    alpha  = np.zeros((nvox, nterms, nterms))
+    arr    = np.zeros((nvox, nterms, nterms))
+
+    while np.any(active):
+        ij = np.where(active &  jacobian)[0]
+        it = np.where(active & ~jacobian)[0]
+
+        if ij.size and no_zero.size:
+            # apply hard limits, keep in mind the increment for the derivatives
+            aa = a[np.ix_(ij, no_zero)]
+            ii = inc[np.ix_(ij, no_zero)]
+            aa = np.where(aa > (lo+1.1*ii), aa, (lo+1.1*ii))
+            aa = np.where(aa < (hi-1.1*ii), aa, (hi-1.1*ii))
+
+            # if still out of constraints reset increment AND params
+            below = aa < lo
+            above = aa > hi
+            aa = np.where(below, lo*(1.0+eps), aa)
+            ii = np.where(below, lo*eps, ii)
+            aa = np.where(above, hi*(1.0-eps), aa)
+            ii = np.where(above, hi*eps, ii)
+            a[np.ix_(ij, no_zero)]   = aa
+            inc[np.ix_(ij, no_zero)] = ii
+
+        # parameters plus forward steps for ij voxels, trial parameters for it
+        p = np.repeat(a[ij], nrow, axis=0).reshape(ij.size, nrow, nterms)
+        if not analytic:
+            p[:,1:][:,diag[0],diag[1]] += inc[ij]
+        f, pder = function(np.concatenate([p.reshape(-1, nterms), b[it]]))
+        if complex_flag:
+            f = np.concatenate([f.real, f.imag], axis=1)
+            if pder is not None:
+                pder = np.concatenate([pder.real, pder.imag], axis=2)
+        nj = ij.size*nrow
+
+        resolve = ij
+
+        if it.size:
+            # result of the trial parameters
+            yfit[it]    = f[nj:]
+            chisqr[it]  = np.sum(w[it]*(y[it]-yfit[it])**2, axis=1)/nfree
+            flambda[it] = flambda[it]*10.0              # Assume fit got worse
+            nkick[it]  += 1
+
+            bad = ~np.isfinite(chisqr[it]) | (nkick[it] > 100)
+            better = ~bad & (chisqr[it] <= chisq1[it])
+            badfit[it[bad]] = True
+            active[it[bad]] = False
+
+            iv = it[better]
+            flambda[iv] = flambda[iv]/100.0
+            a[iv]       = b[iv]
+            niter[iv]  += 1
+            done = ((chisq1[iv]-chisqr[iv])/chisq1[iv] <= tol) | (niter[iv] > itmax)
+            active[iv[done]]    = False
+            jacobian[iv[~done]] = True
+
+            resolve = np.concatenate([ij, it[~bad & ~better]])
+
+        if ij.size:
+            # alpha and beta matrices at the current parameters
+            fj = f[:nj].reshape(ij.size, nrow, -1)
+            yfit[ij] = fj[:,0]
+            if analytic:
+                pd = pder[:nj]
+            else:
+                pd = (fj[:,1:] - fj[:,:1]) / inc[ij][:,:,np.newaxis]
+                # Try to set difference to 1e-5 for next iteration
+                inc[ij] = y.shape[1]*1e-5/np.sum(np.abs(pd), axis=2)
+
+            resid = y[ij]-yfit[ij]
+            beta[ij]   = np.einsum('vp,vkp->vk', resid*w[ij], pd)
+            alpha[ij]  = np.matmul(pd * w[ij][:,np.newaxis,:], pd.transpose(0,2,1))
+            chisq1[ij] = np.sum(w[ij]*resid**2, axis=1)/nfree
+            scale[ij]  = np.sqrt(np.diagonal(alpha[ij], axis1=1, axis2=2))
+            nkick[ij]  = 0
+            jacobian[ij] = False
+
+        if resolve.size:
+            # new trial parameters from the modified curvature matrix
+            sc  = scale[resolve]
+            mat = alpha[resolve] / (sc[:,:,np.newaxis] * sc[:,np.newaxis,:])
+            mat[:,diag[0],diag[1]] *= (1.0 + flambda[resolve])[:,np.newaxis]
+            arr[resolve] = mat
+            step, ok = _solve_stack(mat, beta[resolve]/sc)
+
+            failed = resolve[~ok]
+            badfit[failed] = True
+            active[failed] = False
+            chisqr[failed] = np.nan
+
+            bb = a[resolve] + step/sc
+            if no_zero.size:
+                bn = bb[:,no_zero]
+                bn = np.where(bn < hi, bn, hi)
+                bb[:,no_zero] = np.where(bn > lo, bn, lo)
+            b[resolve] = bb
+
+    # diagonal of the inverse of the last curvature matrix tried
+    arr_inv = _invert_stack(arr)
+    sigmaa = np.sqrt(np.diagonal(arr_inv, axis1=1, axis2=2) / np.diagonal(alpha, axis1=1, axis2=2))
+    chi2   = np.sum((y-yfit)**2, axis=1)/nfree
+
+    return yfit, a, sigmaa, chi2, chisqr, badfit
+
+
+def _solve_stack(mat, rhs):
+    """ Solves each mat[i] x = rhs[i], returns x and a mask of successes """
+    ok = np.ones(len(mat), bool)
+    try:
+        return np.linalg.solve(mat, rhs[:,:,np.newaxis])[:,:,0], ok
+    except np.linalg.LinAlgError:
+        # at least one is singular, find out which
+        x = np.zeros(rhs.shape)
+        for i in range(len(mat)):
+            try:
+                x[i] = np.linalg.solve(mat[i], rhs[i])
+            except np.linalg.LinAlgError:
+                ok[i] = False
+        return x, ok
+
+
+def _invert_stack(mat):
+    """ Inverts each mat[i], singular ones are returned as is """
+    try:
+        return np.linalg.inv(mat)
+    except np.linalg.LinAlgError:
+        res = mat.copy()
+        for i in range(len(mat)):
+            try:
+                res[i] = np.linalg.inv(mat[i])
+            except np.linalg.LinAlgError:
+                pass
+        return res
+
+
 
 def gfunct(a):  
     x  = np.arange(10)  
@@ -346,6 +634,15 @@ def gfunct0(a):
     return f, None
 
 
+def gfunct_batched(a):  
+    # a is (nsets, nterms), one row of parameters per function evaluation
+    x  = np.arange(10)  
+    bx = np.exp(a[:,1:2] * x)  
+    f  = a[:,0:1] * bx + a[:,2:3]  
+
+    return f, None
+
+
 def gfunct1(a, y, w):  
     nfree   = np.size(y)-len(a)
     yfit, _ = gfunct(a)
@@ -406,7 +703,64 @@ def _test():
 #     bob = 10
 #     bob = bob + 1
 
+
+def _benchmark(nfits=2000):
+    """
+    Times the fit with forward difference derivatives from one call per
+    parameter (gfunct0), from one batched call (gfunct_batched) and with
+    analytic derivatives (gfunct).
+
+    """
+    import time
+
+    y = np.array([12.0, 11.0, 10.2, 9.4, 8.7, 8.1, 7.5, 6.9, 6.5, 6.1])  
+    w = 1.0/y  
+    limits = np.array([[ 8.0,-1.2,-2.0],
+                       [12.0, 1.2, 6.0]])
+
+    for label, funct, batched in [('per term', gfunct0,        False),
+                                  ('batched ', gfunct_batched, True),
+                                  ('analytic', gfunct,         False)]:
+        ts = time.time()
+        for i in range(nfits):
+            a = np.array([10.0,-0.1,2.0])  
+            yfit, a, sig, chis, wchis, badfit = constrained_levenberg_marquardt(y, w, a, limits, funct, batched=batched)
+        te = time.time()
+        print( 'CLM %s took: %2.4f msec/fit   a = ' % (label, 1000*(te-ts)/nfits) + str(a))
+
+
+def _benchmark_multi(nvox=2000):
+    """
+    Times a loop of constrained_levenberg_marquardt() calls against one
+    constrained_levenberg_marquardt_multi() call for nvox noisy data sets.
+
+    """
+    import time
+
+    rng = np.random.default_rng(0)
+    atrue = np.array([10.0,-0.1,2.0]) + rng.normal(0, [1.0,0.05,0.5], (nvox,3))
+    y, _ = gfunct_batched(atrue)
+    y = y + rng.normal(0, 0.1, y.shape)
+    w = 1.0/np.abs(y)
+    a0 = np.tile(np.array([10.0,-0.1,2.0]), (nvox,1))
+    limits = np.array([[ 8.0,-1.2,-2.0],
+                       [12.0, 1.2, 6.0]])
+
+    ts = time.time()
+    a1 = np.array([constrained_levenberg_marquardt(y[i], w[i], a0[i].copy(), limits, gfunct0)[1] for i in range(nvox)])
+    te1 = time.time() - ts
+
+    ts = time.time()
+    yfit, a2, sig, chis, wchis, badfit = constrained_levenberg_marquardt_multi(y, w, a0, limits, gfunct_batched)
+    te2 = time.time() - ts
+
+    print( 'CLM loop  took: %2.4f sec for %d voxels' % (te1, nvox))
+    print( 'CLM multi took: %2.4f sec for %d voxels, max |a diff| = %g' % (te2, nvox, np.max(np.abs(a1-a2))))
+
+
 if __name__ == '__main__':
     
     _test()
+    _benchmark()
+    _benchmark_multi()
 
@@ -71,7 +71,7 @@ class ImagePanelIceView(image_panel_toolbar.ImagePanelToolbar2):
         zvox = tmp
         self.tab.process()
         self.tab.plot()
-        self.tab.show()
+        self.tab.update_image_integral()
         self.top.statusbar.SetStatusText( " Cursor X,Y,Slc=%i,%i,%i" % (xvox,yvox,zvox), 0)
         self.top.statusbar.SetStatusText( " Plot X,Y,Slc=%i,%i,%i"   % (xvox,yvox,zvox), 3)
 
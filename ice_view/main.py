@@ -9,6 +9,7 @@
 # Python modules
 import os
 import struct
+from concurrent.futures import ThreadPoolExecutor
 
 # 3rd party modules
 import wx
@@ -28,14 +29,17 @@ import ice_view.mrsi_data_raw as mrsi_data_raw
 import ice_view.default_content as default_content
 import ice_view.notebook_ice_view as notebook_ice_view
 import ice_view.util_ice_view_config as util_ice_view_config
+import ice_view.util_ice_index as util_ice_index
+import ice_view.util_ice_watch as util_ice_watch
 
 import ice_view.common.misc as misc
 import ice_view.common.export as export
 import ice_view.common.wx_util as wx_util
 import ice_view.common.parse_xprot as parse_xprot
+import ice_view.common.funct_spectral_all as funct_spectral_all
 
-from ice_view.common.common_dialogs import pickfile, save_as, message, E_OK
-from ice_view.util_ice_view import get_spe_pair, is_dicom, transformation_matrix
+from ice_view.common.common_dialogs import pickfile, pickdir, save_as, message, E_OK
+from ice_view.util_ice_view import get_spe_pair, get_spe_params, is_dicom, transformation_matrix
 
 from wx.lib.embeddedimage import PyEmbeddedImage
 
@@ -51,22 +55,106 @@ class MyFileDropTarget(wx.FileDropTarget):
     def OnDropFiles(self, x, y, filenames):
         if not filenames:
             return False
-        item = filenames[0]
-        if os.path.isfile(item):
+        items = [item for item in filenames if os.path.isfile(item)]
+        if len(items) == 1:
+            item = items[0]
             if is_dicom(item):
                 self.frame.open_dicom(item)
             else:
                 self.frame.open_spe(item)
+        elif items:
+            self.frame.open_files(items)
         else:
             txt0 = "Object was NOT a File"
             txt1 = "Try File->Open"
             self.frame.statusbar.SetStatusText((txt0), 0)
             self.frame.statusbar.SetStatusText((txt1), 1)
             return False
-
         return True
 
 
+class _BulkLoader(object):
+    """
+    Reads a list of files in a pool of worker threads and opens a tab for
+    each data set, on the GUI thread, as soon as it is ready, so the app
+    stays responsive while many files load. The workers also run HLSVD on
+    the voxel the new tab shows first, by far the slowest part of opening
+    it, the rest of the voxels are fit as they are viewed. Progress is shown in a modeless
+    dialog whose Cancel button drops all files not yet read. Files that fail
+    to load are reported together at the end.
+
+    """
+    def __init__(self, frame, fnames, load, jobs=None, on_finish=None):
+
+        self.frame     = frame
+        self.fnames    = list(fnames)
+        self.load      = load
+        self.on_finish = on_finish
+        self.count     = 0
+        self.errors    = []
+        self.cancelled = False
+
+        nfiles = len(self.fnames)
+        self.dialog = wx.ProgressDialog(default_content.APP_NAME+" - Open Files",
+                                        "Reading %d files ..." % nfiles,
+                                        maximum=nfiles,
+                                        parent=frame,
+                                        style=wx.PD_CAN_ABORT | wx.PD_ELAPSED_TIME |
+                                              wx.PD_REMAINING_TIME)
+
+        if not jobs:
+            jobs = min(nfiles, os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+        for fname in self.fnames:
+            future = self.executor.submit(self._load, fname)
+            future.add_done_callback(lambda f, fname=fname: wx.CallAfter(self._on_done, f, fname))
+        self.executor.shutdown(wait=False)
+
+
+    def cancel(self):
+        """ Files still queued are dropped, their futures finish as cancelled """
+        self.cancelled = True
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+    def _load(self, fname):
+        # runs in a worker thread, see TabIceView.voxel for the first voxel
+        dataset = self.load(fname)
+        funct_spectral_all.fit_svd_voxels(dataset, dataset.blocks['spectral'], [(0,0,0)])
+        return dataset
+
+
+    def _on_done(self, future, fname):
+
+        self.count += 1
+        if not (self.cancelled or future.cancelled()):
+            if future.exception() is not None:
+                self.errors.append('%s - %s' % (os.path.basename(fname), str(future.exception())))
+            else:
+                notebook = self.frame.notebook_ice_view
+                notebook.Freeze()
+                notebook.add_ice_view_tab(dataset=future.result())
+                notebook.Thaw()
+                notebook.Layout()
+
+        if self.count < len(self.fnames):
+            if not self.cancelled:
+                msg = "Read %d of %d - %s" % (self.count, len(self.fnames), os.path.basename(fname))
+                keep_going, _ = self.dialog.Update(self.count, msg)
+                if not keep_going:
+                    self.cancel()
+            return
+
+        self.dialog.Destroy()
+        self.frame.update_title()
+        if self.errors:
+            msg = """Error (open_files): Exception reading files, skipped: \n""" + "\n".join(self.errors)
+            message(msg, style=E_OK)
+        if self.on_finish is not None:
+            self.on_finish()
+
+
+
 class Main(wx.Frame):
 
     def __init__(self, position, size, fname=None):
@@ -102,6 +190,9 @@ class Main(wx.Frame):
 
         self.SetDropTarget(MyFileDropTarget(self))
 
+        # folder watcher for live data from the scanner, see on_watch_spe_dir()
+        self.watcher = None
+
         if fname is not None:
             self.load_on_start(fname)
 
@@ -168,51 +259,7 @@ class Main(wx.Frame):
                 message(msg, style=E_OK)
                 raise (ValueError(msg))
 
-            # parse header, get data params
-            with open(fname_hdr) as f:
-                buffer = f.read()
-            hdr = parse_xprot.parse_xprot(buffer)
-            npts  = int(hdr['DataPointColumns'])
-            dwell = float(hdr['RealDwellTime']) * 1e-9
-            avgs  = int(hdr['NoOfAverages'])
-            tr    = float(hdr['TR'])
-            te    = float(hdr['TE'])
-            sequ  = str(hdr['SequenceString'])
-            sw    = 1.0/dwell
-            phenc = int(hdr['NoOfPhaseEncodingSteps'])
-            ncol  = int(hdr['NoOfCols'])
-            nrow = int(hdr['NoOfRows'])
-
-
-            # read binary data file
-            data = np.fromfile(fname_dat, dtype=np.complex64)
-
-            if phenc==1:
-                if data.shape != (npts,) :
-                    msg = 'Error (open_spe): Wrong Dimensions, data.shape = %s' % str(data.shape)
-                    raise (ValueError(msg))
-                data = data * np.exp(-1j * np.pi * 90 / 180)
-                data *= 100
-            else:
-                if data.shape[0] != npts * ncol * nrow :
-                    msg = 'Error (open_spe): Wrong Dimensions, data.shape = %d\n  Npts, NCols, NRows = %d, %d, %d' % str(data.shape, npts, ncol, nrow)
-                    raise (ValueError(msg))
-                data = np.conj(data)
-                data.shape = nrow, ncol, npts
-
-            # bjs hack
-
-            raw = mrsi_data_raw.MrsiDataRaw()
-            raw.data_sources = [fname_hdr,]
-            raw.data = data
-            raw.sw = sw
-            raw.frequency = 123.9
-            raw.resppm = 4.7
-            raw.seqte = te
-            raw.seqtr = tr
-            raw.headers = [buffer,]
-
-            dataset = mrsi_dataset.dataset_from_raw(raw)
+            dataset = self.dataset_from_spe(fname_hdr, fname_dat)
 
         except Exception as e:
             msg = """Error (open_spe): Exception reading SPE file, returning! \n"%s"."""%str(e)
@@ -228,6 +275,165 @@ class Main(wx.Frame):
         util_ice_view_config.set_path(ini_name, path)
 
 
+    def dataset_from_spe(self, fname_hdr, fname_dat):
+        """ Reads an ICE IceHead/spe file pair, returns a Dataset """
+
+        # parse header (cached by file mtime/size), get data params
+        hdr = parse_xprot.read_xprot(fname_hdr)
+        params = get_spe_params(hdr)
+        npts  = params['npts']
+        avgs  = params['averages']
+        tr    = params['tr']
+        te    = params['te']
+        sequ  = params['sequence']
+        sw    = params['sw']
+        phenc = params['phenc']
+        ncol  = params['ncol']
+        nrow  = params['nrow']
+
+
+        # read binary data file
+        data = np.fromfile(fname_dat, dtype=np.complex64)
+
+        if phenc==1:
+            if data.shape != (npts,) :
+                msg = 'Error (open_spe): Wrong Dimensions, data.shape = %s' % str(data.shape)
+                raise (ValueError(msg))
+            data = data * np.exp(-1j * np.pi * 90 / 180)
+            data *= 100
+        else:
+            if data.shape[0] != npts * ncol * nrow :
+                msg = 'Error (open_spe): Wrong Dimensions, data.shape = %d\n  Npts, NCols, NRows = %d, %d, %d' % str(data.shape, npts, ncol, nrow)
+                raise (ValueError(msg))
+            data = np.conj(data)
+            data.shape = nrow, ncol, npts
+
+        # bjs hack
+
+        raw = mrsi_data_raw.MrsiDataRaw()
+        raw.data_sources = [fname_hdr,]
+        raw.data = data
+        raw.sw = sw
+        raw.frequency = 123.9
+        raw.resppm = 4.7
+        raw.seqte = te
+        raw.seqtr = tr
+        raw.headers = [hdr.text,]
+
+        dataset = mrsi_dataset.dataset_from_raw(raw)
+
+        return dataset
+
+
+    def on_open_spe_dir(self, event):
+
+        ini_name = "open_spe"
+        default_path = util_ice_view_config.get_path(ini_name)
+        msg = 'Select folder with ICE *.spe and *.IceHead Spectroscopy files'
+
+        path = pickdir(message=msg, default_path=default_path)
+        if path:
+            self.open_spe_dir(path)
+
+
+    def open_spe_dir(self, path, ini_name='open_spe'):
+        """
+        Indexes all ICE spe file pairs in a folder, lets the user pick which
+        ones to open, and opens each in its own tab as it is read.
+
+        """
+        wx.BeginBusyCursor()
+        try:
+            index = util_ice_index.IceIndex(path)
+            index.build()
+        except Exception as e:
+            wx.EndBusyCursor()
+            msg = """Error (open_spe_dir): Exception indexing folder, returning! \n"%s"."""%str(e)
+            message(msg, style=E_OK)
+            return
+        wx.EndBusyCursor()
+
+        entries = index.filter(kind='spe')
+        if not entries:
+            msg = 'No ICE *.spe/*.IceHead file pairs found in folder, returning! - \n' + path
+            message(msg, style=E_OK)
+            return
+
+        choices = []
+        for entry in entries:
+            choices.append('%s  -  %s  TE=%g  TR=%g  npts=%d  %dx%d' % (entry['num'],
+                                                                   entry['sequence'],
+                                                                   entry['te'],
+                                                                   entry['tr'],
+                                                                   entry['npts'],
+                                                                   entry['ncol'],
+                                                                   entry['nrow']))
+        dialog = wx.MultiChoiceDialog(self, 'Select data sets to open', 'Open ICE SPE Folder', choices)
+        dialog.SetSelections(list(range(len(choices))))
+        selections = dialog.GetSelections() if dialog.ShowModal() == wx.ID_OK else []
+        dialog.Destroy()
+        if not selections:
+            return
+
+        fnames = [entries[i]['fname_dat'] for i in selections]
+        on_finish = lambda: util_ice_view_config.set_path(ini_name, path)
+        _BulkLoader(self, fnames, self.dataset_from_file, on_finish=on_finish)
+
+
+    def on_watch_spe_dir(self, event):
+        """
+        Starts watching a folder for new ICE spe file pairs, or stops watching
+        if a watch is already running. New data sets get the spectral settings
+        of the active tab, if any, are HLSVD fit in the background and then
+        opened in a new tab. Data sets still loading when the watch stops are
+        dropped.
+
+        """
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+            self.statusbar.SetStatusText("Stopped watching folder", 0)
+            return
+
+        ini_name = "open_spe"
+        default_path = util_ice_view_config.get_path(ini_name)
+        msg = 'Select folder to watch for new ICE *.spe and *.IceHead files'
+
+        path = pickdir(message=msg, default_path=default_path)
+        if not path:
+            return
+
+        preset = None
+        tab = self.notebook_ice_view.active_tab
+        if tab is not None:
+            preset = util_ice_watch.get_preset(tab.dataset)
+
+        self.watcher = util_ice_watch.IceFolderWatcher(path,
+                            self.dataset_from_spe,
+                            lambda *args: wx.CallAfter(self._on_watch_dataset, *args),
+                            lambda *args: wx.CallAfter(self._on_watch_error, *args),
+                            preset=preset)
+        self.watcher.start()
+        self.statusbar.SetStatusText("Watching - " + path, 0)
+        util_ice_view_config.set_path(ini_name, path)
+
+
+    def _on_watch_dataset(self, dataset, fname_hdr, fname_dat):
+        if self.watcher is None:
+            return
+        self.notebook_ice_view.Freeze()
+        self.notebook_ice_view.add_ice_view_tab(dataset=dataset)
+        self.notebook_ice_view.Thaw()
+        self.notebook_ice_view.Layout()
+        self.update_title()
+        self.statusbar.SetStatusText("Watching - new data " + os.path.basename(fname_dat), 0)
+
+
+    def _on_watch_error(self, msg, fname_hdr, fname_dat):
+        # not a dialog, the watch keeps running and more data may follow
+        self.statusbar.SetStatusText("Watching - error reading %s: %s" % (os.path.basename(fname_dat), msg), 0)
+
+
     def on_open_dicom(self, event):
 
         ini_name = "open_dicom"
@@ -248,60 +454,7 @@ class Main(wx.Frame):
 
         path = os.path.dirname(fname)
         try:
-            ds = pydicom.dicomio.read_file(fname)
-
-
-            data_shape = (ds['NumberOfFrames'].value, ds['Columns'].value, ds['Rows'].value, ds['DataPointColumns'].value)
-
-            dataf = convert_numbers(ds['SpectroscopyData'].value, True, 'f')  # (0x5600, 0x0020)
-            data_iter = iter(dataf)
-            data = [complex(r, i) for r, i in zip(data_iter, data_iter)]
-            complex_data = np.fromiter(data, dtype=np.complex64)
-            complex_data.shape = data_shape
-            complex_data = complex_data.conjugate()
-
-            try:
-
-                iorient = ds[0x5200, 0x9230][0][0x0020, 0x9116][0]['ImageOrientationPatient'].value
-                row_vector = np.array(iorient[0:3])
-                col_vector = np.array(iorient[3:6])
-                voi_position = ds[0x5200, 0x9230][0][0x0020, 0x9113][0]['ImagePositionPatient'].value
-
-                voxel_size = [ds[0x0018, 0x9126][0]['SlabThickness'].value,
-                              ds[0x0018, 0x9126][1]['SlabThickness'].value,
-                              ds[0x0018, 0x9126][2]['SlabThickness'].value]
-
-                tform = transformation_matrix(row_vector, col_vector, voi_position, voxel_size)
-
-            except:
-                # this will trigger default
-                voxel_size = np.array([20.0, 20.0, 20.0])
-                tform = None
-
-            sw = ds["SpectralWidth"].value,
-            frequency = ds["TransmitterFrequency"].value,
-            resppm = 4.7,
-            echopeak = 0.0,
-            nucleus = ds["ResonantNucleus"].value,
-            te = float(ds[0x5200, 0x9229][0][0x0018, 0x9114][0]['EffectiveEchoTime'].value),
-            tr = 10000.0 #float(ds[0x5200, 0x9229][0][0x0018, 0x9112][0]['RepetitionTime'].value),
-            voxel_dimensions = voxel_size,
-            header = str(ds),
-            transform = tform,
-            data = complex_data
-
-            raw = mrsi_data_raw.MrsiDataRaw()
-            raw.data_sources = [fname,]
-            raw.data = data
-            raw.sw = sw[0]
-            raw.frequency = frequency[0]
-            raw.resppm = resppm[0]
-            raw.seqte = te[0]
-            raw.seqtr = tr
-            raw.headers = [header[0], ]
-
-            dataset = mrsi_dataset.dataset_from_raw(raw)
-
+            dataset = self.dataset_from_dicom(fname)
         except Exception as e:
             msg = """Error (open_spe): Exception reading DICOM file, returning! \n"%s"."""%str(e)
             message(msg, style=E_OK)
@@ -316,6 +469,113 @@ class Main(wx.Frame):
         util_ice_view_config.set_path(ini_name, path)
 
 
+    def dataset_from_dicom(self, fname):
+        """ Reads an ICE Spectroscopy DICOM file, returns a Dataset """
+
+        ds = pydicom.dicomio.read_file(fname)
+
+
+        data_shape = (ds['NumberOfFrames'].value, ds['Columns'].value, ds['Rows'].value, ds['DataPointColumns'].value)
+
+        dataf = convert_numbers(ds['SpectroscopyData'].value, True, 'f')  # (0x5600, 0x0020)
+        # interleaved real/imag float32 values, view as complex64 in place
+        complex_data = np.asarray(dataf, dtype=np.float32).view(np.complex64)
+        complex_data.shape = data_shape
+        complex_data = complex_data.conjugate()
+
+        try:
+
+            iorient = ds[0x5200, 0x9230][0][0x0020, 0x9116][0]['ImageOrientationPatient'].value
+            row_vector = np.array(iorient[0:3])
+            col_vector = np.array(iorient[3:6])
+            voi_position = ds[0x5200, 0x9230][0][0x0020, 0x9113][0]['ImagePositionPatient'].value
+
+            voxel_size = [ds[0x0018, 0x9126][0]['SlabThickness'].value,
+                          ds[0x0018, 0x9126][1]['SlabThickness'].value,
+                          ds[0x0018, 0x9126][2]['SlabThickness'].value]
+
+            tform = transformation_matrix(row_vector, col_vector, voi_position, voxel_size)
+
+        except:
+            # this will trigger default
+            voxel_size = np.array([20.0, 20.0, 20.0])
+            tform = None
+
+        sw = ds["SpectralWidth"].value,
+        frequency = ds["TransmitterFrequency"].value,
+        resppm = 4.7,
+        echopeak = 0.0,
+        nucleus = ds["ResonantNucleus"].value,
+        te = float(ds[0x5200, 0x9229][0][0x0018, 0x9114][0]['EffectiveEchoTime'].value),
+        tr = 10000.0 #float(ds[0x5200, 0x9229][0][0x0018, 0x9112][0]['RepetitionTime'].value),
+        voxel_dimensions = voxel_size,
+        header = str(ds),
+        transform = tform,
+        data = complex_data
+
+        raw = mrsi_data_raw.MrsiDataRaw()
+        raw.data_sources = [fname,]
+        raw.data = data
+        raw.sw = sw[0]
+        raw.frequency = frequency[0]
+        raw.resppm = resppm[0]
+        raw.seqte = te[0]
+        raw.seqtr = tr
+        raw.headers = [header[0], ]
+
+        dataset = mrsi_dataset.dataset_from_raw(raw)
+
+        return dataset
+
+
+    def dataset_from_file(self, fname):
+        """
+        Returns a Dataset for any file type we can open, namely DICOM, a CRT
+        numpy *.npy file, or either file of an ICE IceHead/spe pair.
+
+        """
+        if is_dicom(fname):
+            return self.dataset_from_dicom(fname)
+        if fname.lower().endswith('.npy'):
+            return self.dataset_from_crt(fname)
+
+        fname_hdr, fname_dat = get_spe_pair(fname)
+        for item in (fname_hdr, fname_dat):
+            if not os.path.isfile(item):
+                raise ValueError('File does not exist - \n' + item)
+        return self.dataset_from_spe(fname_hdr, fname_dat)
+
+
+    def open_files(self, fnames, ini_name=None):
+        """
+        Opens several files at once. They are read in worker threads and
+        each gets its tab as soon as its data set is ready, see _BulkLoader.
+        Both files of an ICE pair only open the data set once.
+
+        """
+        unique = []
+        seen = set()
+        for fname in fnames:
+            key = fname
+            try:
+                if not is_dicom(fname) and not fname.lower().endswith('.npy'):
+                    key = get_spe_pair(fname)[1]
+            except ValueError:
+                pass                # reported when it fails to load
+            if key not in seen:
+                seen.add(key)
+                unique.append(fname)
+        if not unique:
+            return
+
+        on_finish = None
+        if ini_name is not None:
+            path = os.path.dirname(unique[0])
+            on_finish = lambda: util_ice_view_config.set_path(ini_name, path)
+
+        _BulkLoader(self, unique, self.dataset_from_file, on_finish=on_finish)
+
+
     def on_open_xml(self, event):
         wx.BeginBusyCursor()
 
@@ -399,6 +659,28 @@ class Main(wx.Frame):
 
     def load_on_start(self, fname):
 
+        if isinstance(fname, (list, tuple)):
+            self.open_files(fname)
+            return
+
+        try:
+            dataset = self.dataset_from_crt(fname)
+        except Exception as e:
+            msg = str(e)
+            if msg:
+                message(msg, title=default_content.APP_NAME+" - Load on Start", style=E_OK)
+            return
+
+        self.notebook_ice_view.Freeze()
+        self.notebook_ice_view.add_ice_view_tab(dataset=dataset)
+        self.notebook_ice_view.Thaw()
+        self.notebook_ice_view.Layout()
+        self.update_title()
+
+
+    def dataset_from_crt(self, fname):
+        """ Returns a Dataset for a CRT numpy *.npy file name or ndarray """
+
         msg=''
         if isinstance(fname, np.ndarray):
             crt_dat = fname
@@ -409,11 +691,11 @@ class Main(wx.Frame):
                 except Exception as e:
                     msg = """Error (load_on_start): Exception reading Numpy CRT dat file: \n"%s"."""%str(e)
                 if msg:
-                    message(msg, title=default_content.APP_NAME+" - Load on Start", style=E_OK)
-                    return
+                    raise ValueError(msg)
+            else:
+                raise ValueError('Error (load_on_start): File does not exist - \n' + fname)
         else:
-            # TODO bjs - better error/warning reporting
-            return
+            raise ValueError('Error (load_on_start): CRT input must be a filename or ndarray')
 
         if crt_dat.shape == (512,24,24):
             crt_dat = np.swapaxes(crt_dat,0,2)
@@ -421,31 +703,25 @@ class Main(wx.Frame):
             msg = 'Error (load_on_start): Wrong Dimensions, arr.shape = %d' % len(crt_dat.shape)
         elif crt_dat.dtype not in [np.complex64, np.complex128]:
             msg = 'Error (load_on_start): Wrong Dtype, arr.dtype = '+str(crt_dat.dtype)
-        
+
         if msg:
-            message(msg, title=default_content.APP_NAME+" - Load on Start", style=E_OK)
-        else:
-            path, _ = os.path.split(fname)
+            raise ValueError(msg)
 
-            # bjs hack
-            crt_dat = crt_dat * np.exp(-1j*np.pi*90/180)
+        # bjs hack
+        crt_dat = crt_dat * np.exp(-1j*np.pi*90/180)
 
-            raw = mrsi_data_raw.MrsiDataRaw()
-            raw.data_sources = [fname,]
-            raw.data = crt_dat
-            raw.sw = 1250.0
-            raw.frequency = 123.9
-            raw.resppm = 4.7
-            raw.seqte = 110.0
-            raw.seqtr = 2000.0
+        raw = mrsi_data_raw.MrsiDataRaw()
+        raw.data_sources = [fname if isinstance(fname, str) else '',]
+        raw.data = crt_dat
+        raw.sw = 1250.0
+        raw.frequency = 123.9
+        raw.resppm = 4.7
+        raw.seqte = 110.0
+        raw.seqtr = 2000.0
 
-            dataset = mrsi_dataset.dataset_from_raw(raw)
+        dataset = mrsi_dataset.dataset_from_raw(raw)
 
-            self.notebook_ice_view.Freeze()
-            self.notebook_ice_view.add_ice_view_tab(dataset=dataset)
-            self.notebook_ice_view.Thaw()
-            self.notebook_ice_view.Layout()
-            self.update_title()
+        return dataset
 
 
     ############    View menu events
@@ -498,10 +774,29 @@ class Main(wx.Frame):
         wx_util.show_wx_inspector(self)
 
 
+    def on_memory_usage(self, event):
+        stats = self.notebook_ice_view.memory.get_stats()
+        mb = lambda nbytes: '%.1f MB' % (nbytes / (1024*1024)) if nbytes is not None else 'n/a'
+
+        lines = ["Process RSS     : " + mb(stats['rss']),
+                 "Budget          : " + mb(stats['budget']),
+                 "In memory       : " + mb(stats['resident']),
+                 "Spilled to disk : " + mb(stats['spilled']),
+                 "Tabs (spilled)  : %d (%d)" % (stats['tabs'], stats['spilled_tabs']),
+                 "Spills, reloads : %d, %d" % (stats['spill_count'], stats['reload_count']),
+                 "Spill directory : " + stats['cache_dir'], ]
+        message("\n".join(lines), title=default_content.APP_NAME+" - Memory Usage", style=E_OK)
+
+
 
     ############    Global Events
     
     def on_self_close(self, event):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+        self.notebook_ice_view.memory.close()
+
         # I trap this so I can save my coordinates
         config = util_ice_view_config.Config()
 
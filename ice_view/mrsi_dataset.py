@@ -6,6 +6,7 @@ import collections
 # 3rd party modules
 import numpy as np
 import xml.etree.cElementTree as ElementTree
+from scipy.fft import fft, fftshift
 
 # Our modules
 import ice_view.block_raw as block_raw
@@ -25,6 +26,10 @@ from ice_view.common.constants import Deflate
 
 ###########    Start of "private" constants, functions and classes    #########
 
+# number of voxels transformed at a time in whole volume FFTs, keeps the
+# temporary arrays small for large CSI data sets
+_CHUNK_VOXELS = 256
+
 # _XML_TAG_TO_SLOT_CLASS_MAP maps XML element tags to 2-tuples of
 # (slot name, block class) where slot name is one of "raw", "prep", "spectral",
 # or "fit" and the class can be any class appropriate for that slot.
@@ -624,6 +629,27 @@ class Dataset(object):
         return self.blocks[block_name].data
 
 
+    def fft_source_to_spectral(self):
+        """
+        Sets the spectral block data to fftshift(fft(source data)), one chunk
+        of voxels at a time into a single output array, rather than making
+        whole volume temporaries.
+
+        """
+        source = self.get_source_data('spectral')
+        dim0   = source.shape[-1]
+        flat   = source.reshape(-1, dim0)
+        dtype  = np.result_type(source.dtype, np.complex64)
+        out    = np.empty(source.shape, dtype=dtype)
+
+        out_flat = out.reshape(-1, dim0)
+        for i in range(0, flat.shape[0], _CHUNK_VOXELS):
+            chunk = fft(flat[i:i+_CHUNK_VOXELS], axis=-1)
+            out_flat[i:i+_CHUNK_VOXELS] = fftshift(chunk, axes=-1)
+
+        self.blocks['spectral'].data = out
+
+
     def get_source_chain(self, block_name):
         """
         Returns the chain object from the first block to the left of the named
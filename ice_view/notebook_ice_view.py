@@ -21,6 +21,8 @@ import wx.lib.agw.aui as aui        # NB. wx.aui version throws odd wxWidgets ex
 # Our modules
 import ice_view.default_content as default_content
 import ice_view.tab_ice_view as tab_ice_view
+import ice_view.util_memory as util_memory
+import ice_view.util_ice_view_config as util_ice_view_config
 import ice_view.common.wx_util as wx_util
 import ice_view.common.notebook_base as notebook_base
 
@@ -56,6 +58,9 @@ class NotebookIceView(notebook_base.BaseAuiNotebook):
         notebook_base.BaseAuiNotebook.__init__(self, top)
 
         self.top    = top
+
+        # spills the arrays of least recently viewed tabs to disk
+        self.memory = util_memory.MemoryManager(util_ice_view_config.get_memory_budget())
         self.count  = 0
         
         self.show_welcome_tab()
@@ -94,6 +99,7 @@ class NotebookIceView(notebook_base.BaseAuiNotebook):
         self._set_title()
             
         if self.active_tab:
+            self.memory.touch(self.active_tab)
             self.active_tab.on_activation()
             
             
@@ -139,6 +145,7 @@ class NotebookIceView(notebook_base.BaseAuiNotebook):
         # create new notebook tab with process controls 
         tab = tab_ice_view.TabIceView(self, self.top, dataset)
         self.AddPage(tab, name, True)
+        self.memory.touch(tab)
 
 
     def close_ice_view(self):
@@ -136,8 +136,7 @@ class PlotPanelSpectral(PlotPanelSpectrum):
             delta = dy
             self.tab.set_phase_0(delta, voxel)
             phase0 = self.tab.block.get_phase_0(voxel)
-            self.set_phase_0(phase0, index=[0], absolute=True, no_draw=True)
-            self.canvas.draw()
+            self.set_phase_0(phase0, index=[0], absolute=True)
             # r = self.tab.block.get_phase_0(voxel)
             # print('phase0 = '+str(r))
         else:
@@ -146,8 +145,7 @@ class PlotPanelSpectral(PlotPanelSpectrum):
             delta = dx*10
             self.tab.set_phase_1(delta, voxel)
             phase1 = self.tab.block.get_phase_1(voxel)
-            self.set_phase_1(phase1, index=[0], absolute=True, no_draw=True)
-            self.canvas.draw()
+            self.set_phase_1(phase1, index=[0], absolute=True)
 
         # Calculate the new area after phasing
         area, rms = self.calculate_area()
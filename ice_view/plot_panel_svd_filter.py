@@ -206,15 +206,13 @@ class PlotPanelSvdFilter(plot_panel_spectrum.PlotPanelSpectrum):
             delta = dy
             self.tab.set_phase_0(delta, voxel)
             phase0 = self.tab.block.get_phase_0(voxel)
-            self.set_phase_0(phase0, index=[0], absolute=True, no_draw=True)
-            self.canvas.draw()
+            self.set_phase_0(phase0, index=[0], absolute=True)
         else:
             # first order phase
             delta = dx*10
             self.tab.set_phase_1(delta, voxel)
             phase1 = self.tab.block.get_phase_1(voxel)
-            self.set_phase_1(phase1, index=[0], absolute=True, no_draw=True)
-            self.canvas.draw()
+            self.set_phase_1(phase1, index=[0], absolute=True)
 
         # Calculate the new area after phasing
         area, rms = self.calculate_area()
@@ -23,8 +23,6 @@ import wx.grid as gridlib
 import wx.lib.agw.aui as aui
 import wx.stc as stc
 import numpy as np
-from scipy.fft import fft, fftshift
-from wx.lib.mixins.listctrl import CheckListCtrlMixin, ColumnSorterMixin
 import matplotlib.cm as cm
 
 # Our modules
@@ -34,7 +32,12 @@ import ice_view.util_menu as util_menu
 import ice_view.prefs as prefs
 from ice_view.plot_panel_spectral import PlotPanelSpectral
 from ice_view.plot_panel_svd_filter import PlotPanelSvdFilter
+from ice_view.image_panel_ice_view import ImagePanelIceView
 import ice_view.common.funct_water_filter as funct_watfilt
+from ice_view.common.integral_map import IntegralMap
+from ice_view.common.quality_map import QualityMap
+import ice_view.util_ice_view_config as util_ice_view_config
+import ice_view.util_prefetch as util_prefetch
 
 import ice_view.auto_gui.ice_view as ice_view_ui
 
@@ -47,40 +50,115 @@ HLSVD_MAX_SINGULAR_VALUES = 256
 HLSVD_MIN_DATA_POINTS = 128
 _HLSVD_RESULTS_DISPLAY_SIZE = 6
 
+# (label, map type) for the choices on the Maps sub-tab, map types other
+# than 'integral' are QualityMap.get_map() types
+_IMAGE_MAPS = [('Integral',    'integral'),
+               ('FWHM [Hz]',   'fwhm'),
+               ('Peak Height', 'peak'),
+               ('Noise RMS',   'noise'),
+               ('SNR',         'snr'), ]
+
 #------------------------------------------------------------------------------
 
-class CheckListCtrl(wx.ListCtrl, ColumnSorterMixin):
+class CheckListCtrl(wx.ListCtrl):
+    """
+    Virtual list control that shows the HLSVD results for the current voxel.
+
+    Item text and check state are read on demand from the SvdOutput arrays
+    (check state from in_model), so a refresh only formats the rows that are
+    visible, no matter how many lines HLSVD returned. Clicking on a column
+    header sorts the rows by that column, clicking it again reverses the sort.
+
+    """
     def __init__(self, _inner_notebook, tab):
-        style = wx.LC_REPORT | wx.LC_HRULES | wx.LC_VRULES
+        style = wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_HRULES | wx.LC_VRULES
         wx.ListCtrl.__init__(self, _inner_notebook, -1, style=style)
-        ColumnSorterMixin.__init__(self, _HLSVD_RESULTS_DISPLAY_SIZE)
-        self.itemDataMap = {}
         self._tab_dataset = _inner_notebook
         self.tab = tab
+        self.svd_output = None
+        self._columns = np.zeros((_HLSVD_RESULTS_DISPLAY_SIZE, 0))
+        self._order = np.zeros(0, dtype=int)
+        self._sort_column = 0
+        self._sort_ascending = True
         self.Bind(wx.EVT_LIST_ITEM_ACTIVATED, self.OnItemActivated)
         self.Bind(wx.EVT_LIST_ITEM_CHECKED , self.OnCheckItem)
         self.Bind(wx.EVT_LIST_ITEM_UNCHECKED, self.OnCheckItem)
+        self.Bind(wx.EVT_LIST_COL_CLICK, self.OnColClick)
 
 
     def GetListCtrl(self):
         return self
 
+    def set_svd_output(self, svd_output, ppm):
+        """ Points the list at new results, only visible rows get redrawn """
+        nsvd = len(svd_output)
+        self.svd_output = svd_output
+        self._columns = np.array([np.arange(1, nsvd+1),
+                                  ppm,
+                                  svd_output.frequencies*1000,
+                                  svd_output.damping_factors,
+                                  svd_output.phases,
+                                  svd_output.amplitudes], dtype=float)
+        self._sort()
+        if self.GetItemCount() != nsvd:
+            self.SetItemCount(nsvd)
+        self.Refresh()
+
+    def refresh_checks(self):
+        """ Redraw check boxes after in_model was changed elsewhere """
+        count = self.GetItemCount()
+        if count:
+            self.RefreshItems(0, count-1)
+
+    def get_line_index(self, item):
+        """ Index of the HLSVD line (in the SvdOutput arrays) shown in row item """
+        return int(self._order[item])
+
+    def _sort(self):
+        order = np.argsort(self._columns[self._sort_column], kind='stable')
+        if not self._sort_ascending:
+            order = order[::-1]
+        self._order = order
+
+    def OnGetItemText(self, item, col):
+        value = self._columns[col, self._order[item]]
+        if col == 0:
+            return ' %d ' % value
+        elif col == 1:
+            return '%.2f' % value
+        return '%.1f' % value
+
+    def OnGetItemIsChecked(self, item):
+        if self.svd_output is None:
+            return False
+        return bool(self.svd_output.in_model[self._order[item]])
+
+    def OnColClick(self, evt):
+        col = evt.GetColumn()
+        if col < 0:
+            return
+        if col == self._sort_column:
+            self._sort_ascending = not self._sort_ascending
+        else:
+            self._sort_column = col
+            self._sort_ascending = True
+        self._sort()
+        self.Refresh()
+
     def OnItemActivated(self, evt):
-        flag = evt.GetEventObject().IsItemChecked(evt.Index)
+        flag = self.OnGetItemIsChecked(evt.Index)
         self.CheckItem(evt.Index, check=(not flag))
 
     # this is called by the base class when an item is checked/unchecked
     def OnCheckItem(self, event):
         """
-        Note. This event is called everytime self.svd_checklist_update() calls
-          CheckItem() for the lines it includes while updating the SVD table.
-          This was creating a race condition that crashed Analysis. That method
-          is only called when _update_svd_gui is True, so we check for False
-          here and know that it is a manual click on a CheckBox and that we
-          need to call the on_check_item() method.
+        Note. In a virtual list the check state is read from in_model, which
+          is not yet updated when this event arrives, so the new state is
+          taken from the event type. The table itself never calls CheckItem()
+          while updating, but we still only call on_check_item() for manual
+          clicks, i.e. when _update_svd_gui is False.
         """
-        flag = event.GetEventObject().IsItemChecked(event.Index)
-#        print('in OnCheckItem index/flag = '+str(event.Index)+'/'+str(flag))
+        flag = event.GetEventType() == wx.wxEVT_LIST_ITEM_CHECKED
         if self.tab._update_svd_gui == False:
             self.tab.on_check_item(self, event.Index, flag)
 
@@ -283,6 +361,21 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
 
         # values used in plot and export routines, filled in process()
         self.last_export_filename  = ''
+
+        # whole volume integral map engine, created in update_image_integral()
+        # and then kept up to date as single voxels are processed or phased
+        self.integral_map = None
+
+        # whole volume linewidth/SNR engine, same life cycle as integral_map,
+        # noise is measured over this ppm range
+        self.quality_map  = None
+        self.qc_noise_ppm = util_ice_view_config.get_qc_noise_range()
+
+        # fits HLSVD for the voxels around the current one in the background,
+        # the chain takes those fits instead of running HLSVD itself
+        self.prefetcher = util_prefetch.VoxelPrefetcher(dataset, self.block)
+        if self.block.chain is not None:
+            self.block.chain.svd_prefetch = self.prefetcher
         
         # Plotting is disabled during some of init. That's because the plot
         # isn't ready to plot, but the population of some controls
@@ -323,8 +416,7 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
         self.Bind(wx.EVT_WINDOW_DESTROY, self.on_destroy, self)
 
         # bjs hack - for now process all data into 'spectral' block here
-        dat = self.dataset.blocks['raw'].data
-        self.dataset.blocks['spectral'].data = fftshift(fft(dat, axis=-1), axes=-1)
+        self.dataset.fft_source_to_spectral()
 
         # If the sash position isn't recorded in the INI file, we use the
         # arbitrary-ish value of 400.
@@ -349,6 +441,13 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
         tab = self.NotebookSpectral.GetPage(self.NotebookSpectral.GetSelection())
         return (tab.Id == self.PanelSvdFilter.Id)
 
+    @property
+    def image_tab_active(self):
+        """Returns True if Maps is the active tab on the spectral
+        notebook, False otherwise."""
+        tab = self.NotebookSpectral.GetPage(self.NotebookSpectral.GetSelection())
+        return (tab.Id == self.PanelViewImage.Id)
+
     # @property
     # def view_mode(self):
     #     return (3 if self._prefs.plot_view_all else 1)
@@ -520,6 +619,30 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
         self.PanelViewSvd.SetSizer(sizer)
         self.view_svd.Fit()
 
+        #------------------------------------------------------------
+        # Integral and quality map tab settings
+        #------------------------------------------------------------
+
+        self.PanelViewImage = wx.Panel(self.NotebookSpectral, wx.ID_ANY)
+        self.NotebookSpectral.InsertPage(2, self.PanelViewImage, "Maps")
+
+        self.ChoiceImageMap = wx.Choice(self.PanelViewImage, wx.ID_ANY,
+                                        choices=[item[0] for item in _IMAGE_MAPS])
+        self.ChoiceImageMap.SetSelection(0)
+        self.Bind(wx.EVT_CHOICE, self.on_image_map, self.ChoiceImageMap)
+
+        self.view_image = ImagePanelIceView(self.PanelViewImage,
+                                            self,
+                                            self._tab_dataset,
+                                            naxes=1,
+                                            layout='vertical')
+
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(self.ChoiceImageMap, 0, wx.LEFT | wx.TOP, 4)
+        sizer.Add(self.view_image, 1, wx.LEFT | wx.TOP | wx.EXPAND)
+        self.PanelViewImage.SetSizer(sizer)
+        self.view_image.Fit()
+
         #------------------------------------------------------------
         # Results Control
 
@@ -778,10 +901,16 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
 
     def on_destroy(self, event):
         tab_base.Tab.on_destroy(self, event)
+        self._tab_dataset.memory.discard(self)
+        self.prefetcher.close()
 
     def on_activation(self):
         tab_base.Tab.on_activation(self)
 
+        # the maps are dropped if this tab was spilled to disk
+        if self.integral_map is None and self.image_tab_active:
+            self.update_image_integral()
+
         # these BlockSpectral object values may be changed by other tabs, so
         # update their widget values on activation of this tab
         voxel      = self.voxel
@@ -903,6 +1032,9 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
 
         self.FloatScale.SetValue(view.vertical_scale)
 
+        if self.image_tab_active:
+            self.update_image_integral()
+
     def on_splitter(self, event=None):
         # This is sometimes called programmatically, in which case event is None
         self._prefs.sash_position_main = self.SplitterWindow.GetSashPosition()
@@ -925,6 +1057,7 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
         self.voxel = [tmpx, tmpy, tmpz]
         self.process()
         self.plot()
+        self.prefetcher.schedule(self.voxel)
 
     def on_scale(self, event):
         view = self.view
@@ -1124,8 +1257,7 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
             self.dataset.set_phase_1(0.0, self.voxel)    # value is NULL here since method checks the 'lock' flag
             self.FloatPhase1.SetValue(0.0)
         self.CheckZeroPhase1.SetValue(value)
-        self.view.set_phase_1(self.block.get_phase_1(self.voxel), index=[0], absolute=True, no_draw=True)
-        self.view.canvas.draw()
+        self.view.set_phase_1(self.block.get_phase_1(self.voxel), index=[0], absolute=True)
 
     def on_left_shift_correction(self, event):
         # left shift correction respects the sync A/B setting
@@ -1184,16 +1316,14 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
         value = event.GetEventObject().GetValue()
         orig = self.dataset.get_phase_0(self.voxel)
         self.set_phase_0(value-orig, self.voxel)         # sets delta change
-        self.view.set_phase_0(self.block.get_phase_0(self.voxel), index=[0], absolute=True, no_draw=True)
-        self.view.canvas.draw()
+        self.view.set_phase_0(self.block.get_phase_0(self.voxel), index=[0], absolute=True)
 
     def on_phase1(self, event):
         # phase 1 respects the sync A/B setting
         value = event.GetEventObject().GetValue()
         orig = self.dataset.get_phase_1(self.voxel)
         self.set_phase_1(value-orig, self.voxel)         # sets delta change
-        self.view.set_phase_1(self.block.get_phase_1(self.voxel), index=[0], absolute=True, no_draw=True)
-        self.view.canvas.draw()
+        self.view.set_phase_1(self.block.get_phase_1(self.voxel), index=[0], absolute=True)
 
     def on_phase1_pivot(self, event):
         # phase 1 pivot respects the sync A/B setting
@@ -1203,6 +1333,7 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
     def set_phase1_pivot(self, value):
         self.block.set.phase_1_pivot = value
         self.FloatPhase1Pivot.SetValue(value)
+        self.update_integral_phases()
         self.process_and_plot()
 
     def on_dc_offset(self, event):
@@ -1229,11 +1360,24 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
             self.FloatPhase0.SetValue(phase)
             self.process_and_plot()
 
+    def do_process_all(self, event):
+        self.on_process_all(event)
+
     def on_process_all(self, event):
-        pass
-        # self.process(init=True, dataset_to_process=[0,], dynamic=False)
-        # self.update_image_integral(set_ceil=True, set_floor=True)
-        # self.plot()
+        wx.BeginBusyCursor()
+        try:
+            self.block.chain.run(self.dataset.all_voxels, entry='all')
+            # all voxels have new data, so integral tables are rebuilt
+            self.integral_map = None
+            self.quality_map  = None
+            self.process(init=True)
+            self.update_image_integral(set_ceil=True, set_floor=True)
+            self.plot()
+        finally:
+            wx.EndBusyCursor()
+
+    def on_image_map(self, event):
+        self.update_image_integral(set_ceil=True, set_floor=True)
 
     # SVD Tab Control events ---------------------------------------
 
@@ -1244,6 +1388,7 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
             # set all results to 0, turn off all lines. Note. when we replot
             # the current voxel, this will calculate a result for that voxel
             self.block.set_dims(self.dataset)
+            self.prefetcher.invalidate()
             self.on_voxel_change(self.voxel)
             self.process_and_plot()
 
@@ -1266,7 +1411,7 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
         # because the user can sort the list using any column, we need to
         # get the rank value for the item at index that is causing the event,
         # this is the actual index of the line in the block
-        block_index = int(self.list_svd_results.GetItemText(index))-1
+        block_index = self.list_svd_results.get_line_index(index)
 
         svd_output = self.block.get_svd_output(voxel)
         svd_output.in_model[block_index] = flag
@@ -1305,6 +1450,7 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
         self.FloatSvdThreshold.Enable()
         self.ComboSvdThresholdUnit.Enable()
         self._update_svd_gui = True
+        self.update_svd_selection()
         self.process_and_plot()
         self._update_svd_gui = False
 
@@ -1326,6 +1472,7 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
             elif val > maxppm:
                 self.block.set.svd_threshold = maxppm
                 self.FloatSvdThreshold.SetValue(self.block.set.svd_threshold)
+        self.update_svd_selection()
         self.process_and_plot()
         self._update_svd_gui = False
 
@@ -1347,6 +1494,7 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
             elif self.block.set.svd_threshold > maxppm:
                 self.block.set.svd_threshold = maxppm
                 self.FloatSvdThreshold.SetValue(self.block.set.svd_threshold)
+        self.update_svd_selection()
         self.process_and_plot()
 
     def on_svd_exclude_lipid(self, event):
@@ -1359,6 +1507,7 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
             self.FloatSvdExcludeLipidStart.Disable()
             self.FloatSvdExcludeLipidEnd.Disable()
         self._update_svd_gui = True
+        self.update_svd_selection()
         self.process_and_plot()
         self._update_svd_gui = False
 
@@ -1369,6 +1518,7 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
         self.block.set.svd_exclude_lipid_start = max
         self.block.set.svd_exclude_lipid_end   = min
         self._update_svd_gui = True
+        self.update_svd_selection()
         self.process_and_plot()
         self._update_svd_gui = False
 
@@ -1379,6 +1529,7 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
         self.block.set.svd_exclude_lipid_start = max
         self.block.set.svd_exclude_lipid_end   = min
         self._update_svd_gui = True
+        self.update_svd_selection()
         self.process_and_plot()
         self._update_svd_gui = False
 
@@ -1517,12 +1668,12 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
         
         self.block.set_phase_0(phase_0,voxel)
         self.FloatPhase0.SetValue(phase_0)
+        self.update_integral_phases()
 
 
     def set_phase_0_view(self, voxel):
         phase0 = self.block.get_phase_0(voxel)
-        self.view.set_phase_0(phase0, index=[0], absolute=True, no_draw=True)
-        self.view.canvas.draw()
+        self.view.set_phase_0(phase0, index=[0], absolute=True)
 
 
     def set_phase_1(self, delta, voxel, auto_calc=False):
@@ -1547,11 +1698,11 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
 
         self.block.set_phase_1(phase_1,voxel)
         self.FloatPhase1.SetValue(phase_1)
+        self.update_integral_phases()
 
     def set_phase_1_view(self, voxel):
         phase1 = self.block.get_phase_1(voxel)
-        self.view.set_phase_1(phase1, index=[0], absolute=True, no_draw=True)
-        self.view.canvas.draw()
+        self.view.set_phase_1(phase1, index=[0], absolute=True)
 
     def chain_status(self, msg, slot=1):
         self.top.statusbar.SetStatusText((msg), slot)
@@ -1605,6 +1756,8 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
             self.plot_results = block.chain.run(voxel, entry=entry)
 
             if not dynamic:
+                self.update_integral_voxel(self.voxel)
+
                 # refresh the hlsvd sub-tab on the active dataset tab
                 if do_fit or init or self._update_svd_gui:
                     # we changed results, now need to update results widget
@@ -1652,14 +1805,14 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
             if self._svd_scale_initialized:
                 self.view_svd.update(no_draw=True)
             else:
-                ymax = np.max(np.abs(fft(self.dataset.get_source_data('spectral'))) / self.dataset.spectral_dims[0])
                 self.view_svd.update(no_draw=True, set_scale=True)  # TODO bjs, get from siview  , force_ymax=ymax)
                 self._svd_scale_initialized = True
 
             ph0 = self.dataset.get_phase_0(voxel)
             ph1 = self.dataset.get_phase_1(voxel)
             self.view_svd.set_phase_0(ph0, absolute=True, no_draw=True)
-            self.view_svd.set_phase_1(ph1, absolute=True)
+            self.view_svd.set_phase_1(ph1, absolute=True, no_draw=True)
+            self.view_svd.blit_plots()
 
     def plot(self, no_draw=False):
         """
@@ -1690,7 +1843,6 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
             if self._scale_initialized:
                 self.view.update(no_draw=True)
             else:
-                ymax = np.max(np.abs(fft(self.dataset.get_source_data('spectral'))) / self.dataset.spectral_dims[0])
                 self.view.update(no_draw=True, set_scale=True) # TODO bjs, get from siview , force_ymax=ymax)
                 self._scale_initialized = True
 
@@ -1703,7 +1855,8 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
 
             self.set_plot_c()
 
-            self.view.canvas.draw_idle()
+            # only line data changed, redraw against the cached background
+            self.view.blit_plots()
 
             # Calculate the new area after phasing
             area, rms = self.view.calculate_area()
@@ -1786,16 +1939,127 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
     def set_check_boxes(self):
         """
         This method only refreshes the checkboxes in the current checklist
-        widget.
+        widget. The check state is read from in_model of the svd_output the
+        widget holds, so we only have to make sure it is the current one.
 
         """
-        voxel   = self.voxel
-        num     = self.list_svd_results.GetItemCount()
-        svd_output = self.block.get_svd_output(voxel)
-        for i in range(num):
-            if i < self.list_svd_results.GetItemCount():
-                index = int(self.list_svd_results.GetItemText(i))-1
-                self.list_svd_results.SetItemImage(i, svd_output.in_model[index])
+        svd_output = self.block.get_svd_output(self.voxel)
+        if self.list_svd_results.svd_output is not svd_output:
+            self.svd_checklist_update()
+        else:
+            self.list_svd_results.refresh_checks()
+
+
+    def update_image_integral(self, set_ceil=False, set_floor=False):
+        """
+        Displays the map chosen on the Maps sub-tab for the current slice.
+
+        For the integral map, the integral range is the reference span in the
+        spectral plot, and the data type (real, imaginary, magnitude) is the
+        one displayed there, so map values match the area in the status bar.
+        The quality maps (FWHM, peak height, noise, SNR) measure the largest
+        peak in the reference span of the same spectrum, with noise measured
+        over the self.qc_noise_ppm range.
+
+        The IntegralMap and QualityMap engines are only created the first time
+        through or when the data dimensions change, after that they are kept
+        up to date per voxel by update_integral_voxel() and
+        update_integral_phases().
+
+        """
+        data = self.block.data[0,0]     # [z,y,x,dim0]
+        map_type = _IMAGE_MAPS[self.ChoiceImageMap.GetSelection()][1]
+        rstr, rend = self.view.ref_locations
+        data_type = self.view.data_type[0]
+
+        if map_type == 'integral':
+            imap = self.integral_map
+            if imap is None or imap.shape != data.shape[:-1] or imap.dim0 != data.shape[-1]:
+                phase_0, phase_1 = self.block.get_phase_maps()
+                imap = IntegralMap(data, phase_0, phase_1, self._integral_pivot())
+                self.integral_map = imap
+                set_ceil = set_floor = True
+            image = imap.get_map(rstr, rend, data_type=data_type)
+        else:
+            qmap = self.quality_map
+            if qmap is None or qmap.shape != data.shape[:-1] or qmap.dim0 != data.shape[-1]:
+                phase_0, phase_1 = self.block.get_phase_maps()
+                qmap = QualityMap(data, phase_0, phase_1, self._integral_pivot(),
+                                  self.dataset.spectral_hpp)
+                self.quality_map = qmap
+                set_ceil = set_floor = True
+            nstr, nend = self.dataset.ppm2pts(np.array(self.qc_noise_ppm))
+            image = qmap.get_map(map_type, rstr, rend, nstr, nend, data_type=data_type)
+
+        image = image[self.voxel[2]]
+
+        view = self.view_image
+        ddict = {'data' : image,
+                 'vmax' : image.max() if set_ceil  else view.vmax[0],
+                 'vmin' : image.min() if set_floor else view.vmin[0] }
+        view.set_data([[ddict]])
+        view.update()
+
+
+    def update_svd_selection(self):
+        """
+        The HLSVD threshold and lipid exclusion settings apply to all voxels,
+        not only the current one. Here we select lines for all voxels at once
+        and batch reprocess those whose selection changed. The current voxel
+        is then processed (and plotted) as usual by the caller.
+
+        """
+        if len(self.dataset.all_voxels) < 2:
+            return
+        changed = self.block.chain.update_svd_selection(self.dataset.all_voxels)
+        if not changed:
+            return
+        for imap in (self.integral_map, self.quality_map):
+            if imap is not None:
+                for x, y, z in changed:
+                    imap.update_voxel((z, y, x), data=self.block.data[0,0,z,y,x,:])
+        if self.image_tab_active:
+            self.update_image_integral()
+
+
+    def update_integral_voxel(self, voxel):
+        """ Refreshes one voxel in the integral and quality maps after it was processed """
+        if self.integral_map is None and self.quality_map is None:
+            return
+        x, y, z = voxel
+        for imap in (self.integral_map, self.quality_map):
+            if imap is not None:
+                imap.update_voxel((z, y, x),
+                                  data=self.block.data[0,0,z,y,x,:],
+                                  phase_0=self.block.get_phase_0(voxel),
+                                  phase_1=self.block.get_phase_1(voxel))
+        if self.image_tab_active:
+            self.update_image_integral()
+
+
+    def update_integral_phases(self):
+        """
+        Phase lock can change phases in all voxels, so we pass in all of them.
+        Only voxels with a changed phase 1 (or all, if the pivot changed) have
+        their integral tables recalculated, and only voxels with a changed
+        phase their quality measures.
+
+        """
+        if self.integral_map is None and self.quality_map is None:
+            return
+        phase_0, phase_1 = self.block.get_phase_maps()
+        for imap in (self.integral_map, self.quality_map):
+            if imap is not None:
+                imap.set_phases(phase_0, phase_1, pivot=self._integral_pivot())
+        if self.image_tab_active:
+            self.update_image_integral()
+
+
+    def _integral_pivot(self):
+        """ Phase 1 pivot in points, same as used in the spectral plot """
+        ds = self.dataset
+        dim0 = ds.spectral_dims[0]
+        return (dim0 / 2) - (ds.frequency * (ds.phase_1_pivot - ds.resppm) / ds.spectral_hpp)
 
 
     def set_plot_c(self):
@@ -1811,7 +2075,8 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
 
     def svd_checklist_update(self, dynamic=False):
         """
-        This method totally rebuilds the result set in the checklist widget.
+        This method points the checklist widget at a new result set. The
+        widget is virtual, so only the rows that are visible get formatted.
 
         Take the hlsvd results for the current voxel and set them into the
         checklist widget. If the spectral tab hlsvd water filter is on and
@@ -1826,32 +2091,16 @@ class TabIceView(tab_base.Tab, ice_view_ui.IceViewUI):
         svd_output = self.block.get_svd_output(voxel)
 
         amp = svd_output.amplitudes
-        dam = svd_output.damping_factors
         fre = svd_output.frequencies
-        pha = svd_output.phases
         in_model = svd_output.in_model
-        nsvd = len(svd_output)
 
         ppm = self.dataset.resppm - (fre*1000.0/self.dataset.frequency)
 
         # Update the list_svd_results widget
-        if sum(amp) == 0:
+        if np.sum(amp) == 0:
             in_model.fill(False)
 
-        res = {}
-        self.list_svd_results.DeleteAllItems()
-        for i in range(nsvd):
-            res[i] = (i + 1, float(ppm[i]), float(fre[i]*1000), float(dam[i]), float(pha[i]), float(amp[i]))
-            index = self.list_svd_results.InsertItem(i,' '+str(res[i][0])+' ')
-            self.list_svd_results.SetItem(index, 1, '%.2f'%(res[i][1])) # bjs_ccx
-            self.list_svd_results.SetItem(index, 2, '%.1f'%(res[i][2])) # bjs_ccx
-            self.list_svd_results.SetItem(index, 3, '%.1f'%(res[i][3])) # bjs_ccx
-            self.list_svd_results.SetItem(index, 4, '%.1f'%(res[i][4])) # bjs_ccx
-            self.list_svd_results.SetItem(index, 5, '%.1f'%(res[i][5])) # bjs_ccx
-            self.list_svd_results.CheckItem(index, check=in_model[i])
-            self.list_svd_results.SetItemData(index, i)
-
-        self.list_svd_results.itemDataMap = res
+        self.list_svd_results.set_svd_output(svd_output, ppm)
 
 
     def on_voxel_change(self, voxel, dynamic=False):
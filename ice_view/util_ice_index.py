@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2023-2024 Brian J Soher - All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are not permitted without explicit permission.
+
+
+"""
+Indexes a directory of ICE output files.
+
+ICE writes each data set as a pair of files, a MiniHead_spe_NNNNN.IceHead
+XProtocol header and a WriteToFile_NNNNN.spe binary (or _sc_/.sc, _ima_/.ima).
+IceIndex finds all complete pairs in one os.scandir() pass, parses the
+headers concurrently and keeps a short summary of each (points, dimensions,
+TE/TR, sequence, ...), so a whole session can be filtered and opened at once.
+
+The summaries are cached in a small JSON file in the indexed directory. An
+entry is reused as long as its header file modification time and size and
+its data file size are unchanged, so re-indexing a directory only parses new
+or changed headers. If the directory is not writable the index just isn't
+cached.
+
+"""
+
+# Python modules
+import os
+import re
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+# 3rd party modules
+
+
+# Our modules
+import ice_view.common.parse_xprot as parse_xprot
+from ice_view.util_ice_view import get_spe_params
+
+
+INDEX_FILENAME = '.ice_view_index.json'
+INDEX_VERSION  = 1
+
+# Matches both halves of an ICE file pair, the kind is 'spe', 'sc' or 'ima'
+_RE_ICE_FILE = re.compile(r'^(?:MiniHead_(?P<hdr_kind>spe|sc|ima)_(?P<hdr_num>\d+)\.IceHead'
+                          r'|WriteToFile_(?P<dat_num>\d+)\.(?P<dat_kind>spe|sc|ima))$',
+                          re.IGNORECASE)
+
+
+
+def scan_ice_dir(path):
+    """
+    Returns a list of (kind, num, fname_hdr, fname_dat, stamp) for all
+    complete ICE file pairs in directory path, sorted by kind and number.
+    The stamp is (header mtime_ns, header size, data size).
+
+    """
+    hdrs = {}
+    dats = {}
+    with os.scandir(path) as it:
+        for entry in it:
+            m = _RE_ICE_FILE.match(entry.name)
+            if m is None or not entry.is_file():
+                continue
+            if m.group('hdr_kind'):
+                hdrs[(m.group('hdr_kind').lower(), m.group('hdr_num'))] = entry
+            else:
+                dats[(m.group('dat_kind').lower(), m.group('dat_num'))] = entry
+
+    pairs = []
+    for key in sorted(set(hdrs) & set(dats)):
+        hdr_stat = hdrs[key].stat()
+        dat_stat = dats[key].stat()
+        stamp = [hdr_stat.st_mtime_ns, hdr_stat.st_size, dat_stat.st_size]
+        pairs.append((key[0], key[1], hdrs[key].path, dats[key].path, stamp))
+
+    return pairs
+
+
+
+def index_ice_pair(kind, num, fname_hdr, fname_dat, stamp):
+    """
+    Returns the index entry (a dict) for one ICE file pair. Header errors are
+    stored in the 'error' item rather than raised.
+
+    """
+    entry = {'kind'      : kind,
+             'num'       : num,
+             'fname_hdr' : fname_hdr,
+             'fname_dat' : fname_dat,
+             'stamp'     : stamp,
+             'error'     : '', }
+    try:
+        hdr = parse_xprot.read_xprot(fname_hdr)
+        entry['sequence_description'] = str(hdr.get('SequenceDescription', ''))
+        entry['acquisition_time']     = str(hdr.get('AcquisitionTime', ''))
+        entry.update(get_spe_params(hdr))
+    except Exception as e:
+        entry['error'] = str(e)
+
+    return entry
+
+
+
+class IceIndex(object):
+    """
+    Index of the ICE file pairs in one directory. Call build() to (re)scan
+    the directory, the entries are then in self.entries as dicts with keys:
+
+      kind, num, fname_hdr, fname_dat, stamp, error, sequence_description,
+      acquisition_time and the params from get_spe_params() (npts, dwell, sw,
+      averages, tr, te, sequence, phenc, ncol, nrow)
+
+    """
+    def __init__(self, path):
+        self.path    = os.path.abspath(path)
+        self.entries = []
+
+
+    @property
+    def index_filename(self):
+        return os.path.join(self.path, INDEX_FILENAME)
+
+
+    def build(self, jobs=None, use_cache=True):
+        """
+        Scans the directory and returns the list of index entries. Headers
+        not in the cache (or changed since) are parsed by 'jobs' threads, None
+        uses one per CPU.
+
+        """
+        cached = self._load() if use_cache else {}
+
+        entries = []
+        todo = []
+        for kind, num, fname_hdr, fname_dat, stamp in scan_ice_dir(self.path):
+            entry = cached.get(os.path.basename(fname_hdr))
+            if entry is not None and entry['stamp'] == stamp:
+                entry['fname_hdr'] = fname_hdr
+                entry['fname_dat'] = fname_dat
+                entries.append(entry)
+            else:
+                entries.append(None)
+                todo.append((len(entries)-1, (kind, num, fname_hdr, fname_dat, stamp)))
+
+        if todo:
+            if jobs is None or jobs < 1:
+                jobs = os.cpu_count() or 1
+            with ThreadPoolExecutor(max_workers=min(jobs, len(todo))) as executor:
+                results = executor.map(lambda item: index_ice_pair(*item[1]), todo)
+                for (i, _), entry in zip(todo, results):
+                    entries[i] = entry
+
+        self.entries = entries
+        if todo or len(entries) != len(cached):
+            self._save()
+        return entries
+
+
+    def filter(self, kind=None, sequence=None, te=None, tr=None, npts=None,
+               valid_only=True):
+        """
+        Returns the entries that match all criteria given. The sequence is
+        matched as a case insensitive substring of the sequence string or
+        description, other criteria must be equal.
+
+        """
+        result = []
+        for entry in self.entries:
+            if valid_only and entry['error']:
+                continue
+            if kind is not None and entry['kind'] != kind:
+                continue
+            if te is not None and entry.get('te') != te:
+                continue
+            if tr is not None and entry.get('tr') != tr:
+                continue
+            if npts is not None and entry.get('npts') != npts:
+                continue
+            if sequence is not None:
+                seq = sequence.lower()
+                if (seq not in entry.get('sequence', '').lower() and
+                    seq not in entry.get('sequence_description', '').lower()):
+                    continue
+            result.append(entry)
+        return result
+
+
+    def _load(self):
+        """ Returns the cached entries by header file name, or {} """
+        try:
+            with open(self.index_filename) as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(content, dict) or content.get('version') != INDEX_VERSION:
+            return {}
+        return {os.path.basename(entry['fname_hdr']) : entry
+                for entry in content.get('entries', [])}
+
+
+    def _save(self):
+        content = {'version' : INDEX_VERSION, 'entries' : self.entries}
+        try:
+            with open(self.index_filename, 'w') as f:
+                json.dump(content, f, indent=1)
+        except OSError:
+            # e.g. a read-only share on the reconstruction computer
+            pass
@@ -120,4 +120,24 @@ def get_spe_pair(fname, verbose=False):
         raise(ValueError(msg))
 
     # we have both ICE files
-    return fname_hdr, fname_dat
\ No newline at end of file
+    return fname_hdr, fname_dat
+
+def get_spe_params(hdr):
+    """
+    returns a dict of the data params needed to read an ICE spe file, taken
+    from its parsed MiniHead header (see parse_xprot)
+
+    """
+    dwell = float(hdr['RealDwellTime']) * 1e-9
+
+    params = {'npts'     : int(hdr['DataPointColumns']),
+              'dwell'    : dwell,
+              'sw'       : 1.0/dwell,
+              'averages' : int(hdr['NoOfAverages']),
+              'tr'       : float(hdr['TR']),
+              'te'       : float(hdr['TE']),
+              'sequence' : str(hdr['SequenceString']),
+              'phenc'    : int(hdr['NoOfPhaseEncodingSteps']),
+              'ncol'     : int(hdr['NoOfCols']),
+              'nrow'     : int(hdr['NoOfRows']), }
+    return params
@@ -15,6 +15,8 @@ import os
 # Our modules
 import ice_view.config as config
 import ice_view.default_content as default_content
+import ice_view.util_memory as util_memory
+import ice_view.common.quality_map as quality_map
 import ice_view.common.misc as misc
 
 
@@ -35,6 +37,16 @@ def set_path(type_, path):
     config.set_path(type_, path)
     config.write()
     
+def get_memory_budget():
+    """A shortcut for the Config object method of the same name."""
+    config = Config()
+    return config.get_memory_budget()
+
+def get_qc_noise_range():
+    """A shortcut for the Config object method of the same name."""
+    config = Config()
+    return config.get_qc_noise_range()
+
 def get_last_export_path():
     """A shortcut for the Config object method of the same name."""
     config = Config()
@@ -71,6 +83,43 @@ class Config(config.BaseConfig):
                self["debug"].as_bool("show_wx_inspector")
 
 
+    def get_memory_budget(self):
+        """
+        Returns the memory budget in bytes for the large arrays of open
+        tabs, see util_memory. Set in MB as memory_budget_mb under [general].
+        """
+        budget = 0
+
+        if "general" in self:
+            try:
+                budget = int(self["general"].get("memory_budget_mb", 0))
+            except ValueError:
+                pass
+
+        if budget <= 0:
+            return util_memory.DEFAULT_BUDGET
+
+        return budget * 1024 * 1024
+
+
+    def get_qc_noise_range(self):
+        """
+        Returns the (start, end) ppm range over which noise is measured for
+        the quality maps, see common/quality_map. Set as qc_noise_start_ppm
+        and qc_noise_end_ppm under [general].
+        """
+        start, end = quality_map.DEFAULT_NOISE_PPM
+
+        if "general" in self:
+            try:
+                start = float(self["general"].get("qc_noise_start_ppm", start))
+                end   = float(self["general"].get("qc_noise_end_ppm", end))
+            except ValueError:
+                start, end = quality_map.DEFAULT_NOISE_PPM
+
+        return start, end
+
+
     def get_last_export_path(self):
         """
         Returns the last path from which the user exported a file via this
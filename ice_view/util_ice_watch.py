@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2023-2024 Brian J Soher - All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are not permitted without explicit permission.
+
+
+"""
+Watches a directory for new ICE output file pairs.
+
+The reconstruction computer writes the MiniHead_spe_NNNNN.IceHead header and
+the WriteToFile_NNNNN.spe data file of each data set some time apart, and
+each file may take a while to write. IceFolderWatcher polls the directory
+with util_ice_index.scan_ice_dir() (a single os.scandir() pass, cheap even for
+a few thousand files) and treats a pair as complete once both halves exist
+and their sizes and header modification time have not changed between two
+polls. Complete pairs are loaded and HLSVD fit in a pool of worker threads,
+so the GUI thread only has to create the Tab. Only the fits are done in the
+background, the rest of the processing is quick and the Tab redoes it anyway.
+
+Polling is used rather than inotify because the output folder is usually a
+network share from the reconstruction computer, where inotify events are not
+delivered. The default 0.25 second interval means a new data set is picked up
+well under a second after it is written.
+
+This module does not use wx. The callbacks are run in a worker thread, so a
+GUI caller should forward them with wx.CallAfter().
+
+"""
+
+# Python modules
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 3rd party modules
+
+
+# Our modules
+from ice_view.util_ice_index import scan_ice_dir
+from ice_view.common.funct_spectral_all import fit_svd_voxels
+from ice_view.common.constants import Deflate
+
+
+POLL_INTERVAL = 0.25        # seconds
+
+
+
+def get_preset(dataset):
+    """
+    Returns the spectral processing settings of dataset as a dict that can be
+    given to apply_preset(). The ECC filter settings reference another data
+    set, so like Preset files these are not included.
+
+    """
+    settings = dataset.blocks['spectral'].set.deflate(Deflate.DICTIONARY)
+    return {key : val for key, val in settings.items() if not key.startswith('ecc_')}
+
+
+
+def apply_preset(dataset, preset):
+    """ Sets the spectral processing settings of dataset from a get_preset() dict """
+
+    settings = dataset.blocks['spectral'].set
+    zero_fill_multiplier = preset.get('zero_fill_multiplier', settings.zero_fill_multiplier)
+    for key, val in preset.items():
+        if key != 'zero_fill_multiplier':
+            setattr(settings, key, val)
+    if zero_fill_multiplier != settings.zero_fill_multiplier:
+        dataset.update_for_zerofill_change(zero_fill_multiplier)
+
+
+
+class IceFolderWatcher(object):
+    """
+    Watches directory path for new ICE 'spe' file pairs and, for each,
+    calls on_dataset(dataset, fname_hdr, fname_dat) with a Dataset whose
+    voxels are all HLSVD fit, or on_error(msg, fname_hdr, fname_dat) if it
+    could not be loaded.
+
+    load       - callable(fname_hdr, fname_dat) that returns a Dataset
+    preset     - None, or a get_preset() dict applied to each new Dataset
+                 before its voxels are fit
+    existing   - if True, pairs already in the directory when the watch
+                 starts are also loaded, otherwise only new ones are
+
+    """
+    def __init__(self, path, load, on_dataset, on_error=None, preset=None,
+                       existing=False, interval=POLL_INTERVAL, jobs=None):
+
+        self.path       = os.path.abspath(path)
+        self.load       = load
+        self.on_dataset = on_dataset
+        self.on_error   = on_error
+        self.preset     = preset
+        self.existing   = existing
+        self.interval   = interval
+        self.jobs       = jobs if jobs else min(4, os.cpu_count() or 1)
+
+        self._stop     = threading.Event()
+        self._thread   = None
+        self._executor = None
+
+        # pair key -> stamp, for pairs seen but not yet stable, and for pairs
+        # that were queued (or failed) at that stamp
+        self._pending  = {}
+        self._done     = {}
+
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+
+    def start(self):
+        if self.is_running:
+            return
+        # each watch has its own stop event and executor, so a poll thread
+        # still finishing after stop(wait=False) can not pick up a new watch
+        self._stop = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self.jobs)
+        if not self.existing:
+            for pair in self._scan():
+                self._done[pair[:2]] = pair[4]
+        self._thread = threading.Thread(target=self._run, args=(self._stop, self._executor),
+                                        name='IceFolderWatcher', daemon=True)
+        self._thread.start()
+
+
+    def stop(self, wait=False):
+        """
+        Stops polling. Queued data sets are dropped, and those already being
+        loaded are finished but not delivered. With wait=True returns once
+        the poll thread and the loads have finished.
+
+        """
+        self._stop.set()
+        if self._thread is not None and wait:
+            self._thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+        self._thread = None
+        self._executor = None
+
+
+    def poll(self):
+        """ Checks the directory once, returns the number of pairs queued """
+        return self._poll(self._stop, self._executor)
+
+
+    def _poll(self, stop, executor):
+        count = 0
+        if executor is None or stop.is_set():
+            return count
+        for kind, num, fname_hdr, fname_dat, stamp in self._scan():
+            key = (kind, num)
+            if self._done.get(key) == stamp:
+                continue
+            if self._pending.get(key) != stamp:
+                # new or still being written, check again on the next poll
+                self._pending[key] = stamp
+                continue
+            try:
+                executor.submit(self._process, fname_hdr, fname_dat, stop)
+            except RuntimeError:
+                # stopped while polling, the executor is shut down
+                break
+            del self._pending[key]
+            self._done[key] = stamp
+            count += 1
+        return count
+
+
+    def _scan(self):
+        try:
+            return [pair for pair in scan_ice_dir(self.path) if pair[0] == 'spe']
+        except OSError:
+            # e.g. the share went away for a moment, try again next time
+            return []
+
+
+    def _run(self, stop, executor):
+        while not stop.wait(self.interval):
+            self._poll(stop, executor)
+
+
+    def _process(self, fname_hdr, fname_dat, stop):
+        if stop.is_set():
+            return
+        try:
+            dataset = self.load(fname_hdr, fname_dat)
+            if self.preset is not None:
+                apply_preset(dataset, self.preset)
+            # TabIceView.__init__ replaces the processed spectral data, so only
+            # the HLSVD fits, the slow part, are worth doing here
+            fit_svd_voxels(dataset, dataset.blocks['spectral'], dataset.all_voxels)
+        except Exception as e:
+            # A pair with a bad or truncated data file is only tried again
+            # if one of its files changes.
+            if self.on_error is not None and not stop.is_set():
+                self.on_error(str(e), fname_hdr, fname_dat)
+            return
+        if not stop.is_set():
+            self.on_dataset(dataset, fname_hdr, fname_dat)
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2023-2024 Brian J Soher - All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are not permitted without explicit permission.
+
+
+"""
+Keeps the memory used by the large arrays of open IceView tabs in a budget.
+
+Each TabIceView holds its raw data, the processed spectral data and the
+chain's per-line result arrays. MemoryManager tracks tabs in least recently
+viewed order. When the arrays of all tabs add up to more than the budget, the
+arrays of the least recently viewed tabs are written to .npy files in a
+temporary directory and replaced by read/write numpy memmaps of those files.
+
+A spilled tab keeps working, the memmap is an ndarray, just one whose pages
+the OS reads from disk as needed (and may drop again). When the tab is viewed
+(on_activation) its arrays are read back into memory and the files removed.
+
+The integral and quality maps of a spilled tab are dropped, they hold a view
+of the spectral data and are recreated the next time they are displayed. So
+is the chain's cache of HLSVD line fids and spectra, which also holds the
+svd_fids_all array, it is refilled as voxels are processed.
+
+"""
+
+# Python modules
+import os
+import shutil
+import weakref
+import tempfile
+from collections import OrderedDict
+
+# 3rd party modules
+import numpy as np
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+# Our modules
+from ice_view.common.funct_spectral_all import svd_cache_bytes
+
+
+
+DEFAULT_BUDGET = 2048 * 1024 * 1024     # bytes
+
+# arrays smaller than this stay in memory, spilling them would gain nothing
+MIN_SPILL_BYTES = 1024 * 1024
+
+_CHAIN_ARRAYS = ('time_fids', 'svd_peaks_checked', 'svd_fids_all')
+
+
+
+def get_rss():
+    """ Returns the resident set size of this process in bytes, or None """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def tab_arrays(tab):
+    """ Returns (owner, attribute name) pairs for the large arrays of a tab """
+    dataset = tab.dataset
+    block   = dataset.blocks['spectral']
+    items   = [(dataset.blocks['raw'], 'data'), (block, 'data')]
+    if block.chain is not None:
+        items += [(block.chain, name) for name in _CHAIN_ARRAYS]
+    return items
+
+
+
+def _cached_chain(tab):
+    """ Returns the chain of a tab if it keeps an HLSVD line cache, or None """
+    chain = tab.dataset.blocks['spectral'].chain
+    return chain if hasattr(chain, 'svd_cache') else None
+
+
+
+class MemoryManager(object):
+    """
+    Spills the arrays of least recently viewed tabs to memory mapped files
+    to keep the total within budget (in bytes). Call touch() whenever a tab
+    becomes the current one and discard() when it is closed.
+
+    """
+    def __init__(self, budget=DEFAULT_BUDGET):
+
+        self.budget       = budget
+        self.spill_count  = 0       # number of times a tab was spilled
+        self.reload_count = 0       # number of times a tab was reloaded
+
+        self._tabs      = OrderedDict()     # id(tab) -> tab, oldest first
+        self._spilled   = {}                # id(tab) -> list of file names
+        self._cache_dir = None
+        self._finalizer = None
+
+
+    def touch(self, tab):
+        """
+        Marks tab as the most recently viewed one, reloads it if it was
+        spilled, and then spills other tabs as needed to meet the budget.
+
+        """
+        key = id(tab)
+        self._tabs.pop(key, None)
+        self._tabs[key] = tab
+        if key in self._spilled:
+            self._reload(tab)
+        self.enforce(keep=tab)
+
+
+    def discard(self, tab):
+        """ Forgets about a closed tab and removes its spill files """
+        key = id(tab)
+        self._tabs.pop(key, None)
+        for fname in self._spilled.pop(key, []):
+            _remove(fname)
+
+
+    def enforce(self, keep=None):
+        """ Spills least recently viewed tabs, except keep, until in budget """
+        resident = self.resident_bytes()
+        for key, tab in list(self._tabs.items()):
+            if resident <= self.budget:
+                break
+            if tab is keep or key in self._spilled:
+                continue
+            resident -= self._spill(tab)
+
+
+    def resident_bytes(self):
+        """ Returns the total size of the tracked arrays held in memory """
+        total = 0
+        for tab in self._tabs.values():
+            for arr in self._get_arrays(tab):
+                if not isinstance(arr, np.memmap):
+                    total += arr.nbytes
+            chain = _cached_chain(tab)
+            if chain is not None:
+                total += svd_cache_bytes(chain)
+        return total
+
+
+    def get_stats(self):
+        """ Returns a dict of memory use and spill statistics """
+        spilled = 0
+        for key in self._spilled:
+            for arr in self._get_arrays(self._tabs[key]):
+                if isinstance(arr, np.memmap):
+                    spilled += arr.nbytes
+        return {'budget'        : self.budget,
+                'rss'           : get_rss(),
+                'resident'      : self.resident_bytes(),
+                'spilled'       : spilled,
+                'tabs'          : len(self._tabs),
+                'spilled_tabs'  : len(self._spilled),
+                'spill_count'   : self.spill_count,
+                'reload_count'  : self.reload_count,
+                'cache_dir'     : self._cache_dir or '', }
+
+
+    def close(self):
+        """ Removes the temporary directory with all spill files """
+        self._tabs.clear()
+        self._spilled.clear()
+        if self._finalizer is not None:
+            self._finalizer()
+        self._cache_dir = None
+        self._finalizer = None
+
+
+    def _get_arrays(self, tab):
+        arrays = []
+        for owner, name in tab_arrays(tab):
+            arr = getattr(owner, name, None)
+            if isinstance(arr, np.ndarray):
+                arrays.append(arr)
+        return arrays
+
+
+    def _spill(self, tab):
+        """ Returns the number of bytes moved out of memory """
+        if self._cache_dir is None:
+            self._cache_dir = tempfile.mkdtemp(prefix='ice_view_spill_')
+            self._finalizer = weakref.finalize(self, shutil.rmtree, self._cache_dir, True)
+
+        # the cache holds references to svd_fids_all arrays, drop it first
+        # or spilling those frees nothing
+        nbytes = 0
+        chain  = _cached_chain(tab)
+        if chain is not None:
+            nbytes += svd_cache_bytes(chain)
+            chain.svd_cache.clear()
+
+        fnames = []
+        for owner, name in tab_arrays(tab):
+            arr = getattr(owner, name, None)
+            if (not isinstance(arr, np.ndarray) or isinstance(arr, np.memmap) or
+                arr.dtype.hasobject or arr.nbytes < MIN_SPILL_BYTES):
+                continue
+            fname = os.path.join(self._cache_dir, '%x_%s.npy' % (id(owner), name))
+            np.save(fname, arr)
+            setattr(owner, name, np.load(fname, mmap_mode='r+'))
+            fnames.append(fname)
+            nbytes += arr.nbytes
+
+        if fnames:
+            tab.integral_map = None
+            tab.quality_map  = None
+            self._spilled[id(tab)] = fnames
+            self.spill_count += 1
+        return nbytes
+
+
+    def _reload(self, tab):
+        for owner, name in tab_arrays(tab):
+            arr = getattr(owner, name, None)
+            if isinstance(arr, np.memmap):
+                setattr(owner, name, np.array(arr))
+        for fname in self._spilled.pop(id(tab)):
+            _remove(fname)
+        self.reload_count += 1
+
+
+
+def _remove(fname):
+    try:
+        os.remove(fname)
+    except OSError:
+        # still mapped somewhere (Windows), goes with the directory at exit
+        pass
@@ -127,6 +127,8 @@ def _get_menu_data(main):
                 #     ("ICE Spectroscopy IceHead/spe File", main.on_open_spe),
                 #     ("ICE Spectroscopy DICOM File", main.on_open_dicom))),
                 ("O&pen ICE SPE File\tCTRL+O",   main.on_open_spe),
+                ("Open ICE SPE Folder...",        main.on_open_spe_dir),
+                ("Watch ICE SPE Folder...",       main.on_watch_spe_dir),
                 ("O&pen ICE DICOM File\tCTRL+D", main.on_open_dicom),
                 ("Open IceView XML File", main.on_open_xml),
                 common_menu.SEPARATOR,
@@ -178,6 +180,7 @@ def _get_menu_data(main):
 
     help = (
                 ("&User Manual",          main.on_user_manual),
+                ("Memory Usage",          main.on_memory_usage),
                 ("&About", main.on_about, wx.ITEM_NORMAL, wx.ID_ABOUT),
            )
 
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2023-2024 Brian J Soher - All Rights Reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are not permitted without explicit permission.
+
+
+"""
+Fits HLSVD ahead of time for the voxels a user is likely to view next.
+
+The first time a voxel is processed the chain runs HLSVD on it, which is most
+of the wait when stepping through a CSI grid. Everything after that is fast,
+and the fit is kept in the block. After each voxel change TabIceView calls
+VoxelPrefetcher.schedule(), which fits the 8-connected neighbours of the new
+voxel in its slice, and then the next few voxels in scan order, in a
+background thread. Only voxels that have not been fit yet are queued, and
+requests that have not started yet are dropped when the voxel changes again.
+
+The fits are kept in a bounded cache, keyed on the voxel. The worker never
+changes the block or chain. When the chain needs a fit it asks for one with
+get() (see funct_spectral_all.svd_filter). The cached fit is only used if the
+HLSVD inputs still match: the data points, singular values sought and dwell
+time. So a change to the data or to the HLSVD settings of a voxel makes its
+prefetched fit unusable. The other settings only affect processing after
+HLSVD, which the chain redoes anyway. invalidate() drops all prefetched fits
+and queued requests, e.g. when all results are reset.
+
+"""
+
+# Python modules
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# 3rd party modules
+import numpy as np
+
+
+# Our modules
+import ice_view.common.funct_spectral_all as funct_spectral_all
+
+
+
+# number of prefetched fits kept, more than a few steps in any direction
+PREFETCH_CACHE_VOXELS = 64
+
+# number of voxels after the current one in scan order to prefetch
+SCAN_AHEAD_VOXELS = 4
+
+
+
+def neighbour_voxels(voxel, spectral_dims, scan_ahead=SCAN_AHEAD_VOXELS):
+    """
+    Returns the voxels to prefetch around voxel, an (x, y, z) index. First
+    the 4 voxels next to it and then the 4 diagonal ones, all in the same
+    slice, then the scan_ahead voxels that follow it in scan order (x fastest,
+    then y, then z). Voxels outside the grid are left out.
+
+    """
+    x, y, z = voxel
+    nx, ny, nz = spectral_dims[1:4]
+
+    steps = [(1,0), (-1,0), (0,1), (0,-1), (1,1), (-1,1), (1,-1), (-1,-1)]
+    result = []
+    for dx, dy in steps:
+        if 0 <= x+dx < nx and 0 <= y+dy < ny:
+            result.append((x+dx, y+dy, z))
+
+    index = (z*ny + y)*nx + x
+    for i in range(index+1, min(index+1+scan_ahead, nx*ny*nz)):
+        z_i, rest = divmod(i, nx*ny)
+        y_i, x_i  = divmod(rest, nx)
+        if (x_i, y_i, z_i) not in result:
+            result.append((x_i, y_i, z_i))
+
+    return result
+
+
+def _fit_key(signals, nsv_sought, dwell_time):
+    return (hashlib.sha1(np.ascontiguousarray(signals)).digest(),
+            signals.dtype.str, len(signals), int(nsv_sought), float(dwell_time))
+
+
+
+class VoxelPrefetcher(object):
+    """
+    Runs HLSVD for the voxels around the current one in a background thread
+    and keeps the fits until the chain asks for them. Call schedule() after
+    the current voxel changes, invalidate() when all results are reset and
+    close() when the tab is closed.
+
+    """
+    def __init__(self, dataset, block, cache_voxels=PREFETCH_CACHE_VOXELS):
+
+        self.dataset      = dataset
+        self.block        = block
+        self.cache_voxels = cache_voxels
+        self.hit_count    = 0       # fits taken from the cache
+        self.miss_count   = 0       # fits the chain had to do itself
+
+        self._lock       = threading.Lock()
+        self._cache      = OrderedDict()    # voxel -> (key, SvdOutput)
+        self._futures    = {}               # voxel -> Future
+        self._generation = 0
+        self._executor   = None
+
+
+    def schedule(self, voxel):
+        """
+        Queues HLSVD fits for the neighbours of voxel that are not fit yet,
+        replacing any queued requests that have not started.
+
+        """
+        self._cancel_pending()
+
+        dataset = self.dataset
+        block   = self.block
+        source  = dataset.get_source_data('spectral')
+        dwell_time = 1000.0 / dataset.sw
+
+        for vox in neighbour_voxels(voxel, dataset.spectral_dims):
+            if not block.get_do_fit(vox):
+                continue
+            with self._lock:
+                if vox in self._cache or vox in self._futures:
+                    continue
+
+            # the chain does not run HLSVD on voxels without data
+            x, y, z = vox
+            data = source[0,0,z,y,x,:]
+            if not np.sum(data.real):
+                continue
+
+            # copy the inputs now, the worker does not touch the dataset
+            signals    = np.array(data[:block.get_data_point_count(vox)])
+            nsv_sought = block.get_signal_singular_value_count(vox)
+
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1,
+                                                    thread_name_prefix='ice_view_prefetch')
+            with self._lock:
+                self._futures[vox] = self._executor.submit(self._fit, vox, signals,
+                                                           nsv_sought, dwell_time,
+                                                           self._generation)
+
+
+    def get(self, voxel, signals, nsv_sought, dwell_time):
+        """
+        Returns the prefetched SvdOutput for voxel if it was fit from the
+        same inputs, otherwise None. Either way the voxel is removed from the
+        cache, the chain stores its fit in the block.
+
+        """
+        voxel = tuple(voxel)
+        with self._lock:
+            future = self._futures.get(voxel)
+            if future is not None and future.cancel():
+                del self._futures[voxel]
+                future = None
+
+        # already being fit, waiting is quicker than starting over
+        if future is not None:
+            future.result()
+
+        with self._lock:
+            entry = self._cache.pop(voxel, None)
+
+        if entry is not None and entry[0] == _fit_key(signals, nsv_sought, dwell_time):
+            self.hit_count += 1
+            return entry[1]
+        self.miss_count += 1
+        return None
+
+
+    def invalidate(self):
+        """ Drops all prefetched fits and queued requests """
+        with self._lock:
+            self._generation += 1
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+            self._cache.clear()
+
+
+    def close(self):
+        """ Drops everything and stops the background thread """
+        self.invalidate()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+    def get_stats(self):
+        """ Returns a dict of cache and request counts """
+        with self._lock:
+            return {'cached'  : len(self._cache),
+                    'pending' : len(self._futures),
+                    'hits'    : self.hit_count,
+                    'misses'  : self.miss_count, }
+
+
+    def _cancel_pending(self):
+        with self._lock:
+            for vox, future in list(self._futures.items()):
+                if future.cancel():
+                    del self._futures[vox]
+
+
+    def _fit(self, voxel, signals, nsv_sought, dwell_time, generation):
+        # runs in the worker thread. Errors are left for the chain to raise
+        # when it fits the voxel itself
+        try:
+            svd_output = funct_spectral_all.fit_svd(signals, nsv_sought, dwell_time)
+        except Exception:
+            svd_output = None
+
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._futures.pop(voxel, None)
+            if svd_output is not None:
+                self._cache[voxel] = (_fit_key(signals, nsv_sought, dwell_time), svd_output)
+                self._cache.move_to_end(voxel)
+                while len(self._cache) > self.cache_voxels:
+                    self._cache.popitem(last=False)